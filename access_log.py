@@ -0,0 +1,299 @@
+import json
+import logging
+import os
+import queue
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+
+ACCESS_LOG_TABLE = "user_access_logs"
+ACCESS_LOG_DB = os.environ.get("ACCESS_LOG_DB", "access_logs.db")
+ACCESS_LOG_BATCH = int(os.environ.get("ACCESS_LOG_BATCH", 50))
+ACCESS_LOG_FLUSH_INTERVAL = float(os.environ.get("ACCESS_LOG_FLUSH_INTERVAL", 1.0))
+ACCESS_LOG_RETRIES = int(os.environ.get("ACCESS_LOG_RETRIES", 4))
+# Outbox replays an event may fail before it is moved to the dead-letter table.
+ACCESS_LOG_MAX_ATTEMPTS = int(os.environ.get("ACCESS_LOG_MAX_ATTEMPTS", 10))
+# Longest wait between outbox replays while Supabase keeps failing.
+ACCESS_LOG_REPLAY_MAX_BACKOFF = float(os.environ.get("ACCESS_LOG_REPLAY_MAX_BACKOFF", 60))
+# Postgres error classes that retrying cannot fix: data exceptions, constraint
+# violations, undefined columns/tables; PGRST codes are PostgREST request errors.
+_PERMANENT_PG_CODES = ("22", "23", "42", "PGRST")
+
+
+def is_permanent_error(e: Exception) -> bool:
+    status = getattr(e, "status_code", None) or getattr(getattr(e, "response", None), "status_code", None)
+    if isinstance(status, int) and 400 <= status < 500 and status not in (408, 429):
+        return True
+    code = getattr(e, "code", None)
+    return isinstance(code, str) and code.startswith(_PERMANENT_PG_CODES)
+
+
+# ---------- Background, batched access-log pipeline ------------------------------
+# Login/logout events are queued in memory and written by one daemon thread:
+# logins go out as a single batched insert, logouts as updates keyed by the
+# session_key stored in meta (the row id is not known at login time any more).
+# When Supabase stays unreachable after retries the events are spilled to a
+# local SQLite outbox and replayed, in order, once it comes back. Replays back
+# off exponentially while it stays down, and an empty outbox is never queried
+# (its row count is kept in memory). An event that Supabase rejects outright, or
+# that keeps failing, is moved to a dead-letter table so it cannot hold up the
+# events behind it.
+class AccessLogWriter:
+    def __init__(self, client=None, table: str = ACCESS_LOG_TABLE, db_path: str = ACCESS_LOG_DB,
+                 batch_size: int = ACCESS_LOG_BATCH, flush_interval: float = ACCESS_LOG_FLUSH_INTERVAL,
+                 max_retries: int = ACCESS_LOG_RETRIES, base_backoff: float = 0.5,
+                 max_attempts: int = ACCESS_LOG_MAX_ATTEMPTS,
+                 max_replay_backoff: float = ACCESS_LOG_REPLAY_MAX_BACKOFF):
+        self.client = client
+        self.table = table
+        self.db_path = db_path
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_attempts = max(1, max_attempts)
+        self.max_replay_backoff = max_replay_backoff
+        self.stats = {
+            "queued": 0, "inserted": 0, "updated": 0, "spilled": 0, "replayed": 0, "failed_batches": 0,
+            "dead_lettered": 0,
+        }
+        self._queue = queue.Queue()
+        self._db_lock = threading.Lock()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._outbox_rows = 0
+        self._replay_at = 0.0
+        self._replay_failures = 0
+        self._init_outbox()
+        # Events left over from a previous process are replayed on the first tick.
+        self._outbox_rows = self._outbox_size()
+
+    # ---- public API (called from the Streamlit script thread) ----
+    def log_login(self, session_key: str, email: str, name: str, meta: dict) -> None:
+        row = {"user_email": email, "user_name": name or None, "meta": dict(meta, session_key=session_key)}
+        self._put({"kind": "login", "row": row})
+
+    def log_logout(self, session_key: str, meta: dict) -> None:
+        self._put({"kind": "logout", "session_key": session_key, "meta": dict(meta, session_key=session_key)})
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        # Blocks until everything queued so far has been handed off (sent or spilled).
+        self.start()
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self._queue.unfinished_tasks == 0:
+                return True
+            time.sleep(0.01)
+        return False
+
+    def start(self) -> None:
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="access-log-writer", daemon=True)
+                self._thread.start()
+
+    def _put(self, event: dict) -> None:
+        self.stats["queued"] += 1
+        self._queue.put(event)
+        self.start()
+
+    # ---- worker ----
+    def _run(self) -> None:
+        while True:
+            batch = []
+            try:
+                batch.append(self._queue.get(timeout=self.flush_interval))
+                while len(batch) < self.batch_size:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            try:
+                if batch:
+                    # Keep ordering: while older events wait in the outbox, new ones queue behind them.
+                    sent = 0 if self._outbox_rows else self._send(batch)[0]
+                    if sent < len(batch):
+                        if not self._outbox_rows:
+                            # Supabase just failed after retries: give it time before replaying.
+                            self._backoff()
+                        self._spill(batch[sent:])
+                if self.client is not None and self._outbox_rows and time.monotonic() >= self._replay_at:
+                    self._replay()
+            except Exception as e:
+                logging.warning("Access log writer error: %s", e)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _backoff(self) -> None:
+        delay = min(self.max_replay_backoff, self.base_backoff * (2 ** self._replay_failures))
+        self._replay_failures += 1
+        self._replay_at = time.monotonic() + delay * (0.5 + random.random())
+
+    def _with_retry(self, fn):
+        # Returns None on success, else the last error. Permanent errors are not retried.
+        for attempt in range(self.max_retries + 1):
+            try:
+                fn()
+                return None
+            except Exception as e:
+                if attempt == self.max_retries or is_permanent_error(e):
+                    logging.warning("Access log write failed after %d attempts: %s", attempt + 1, e)
+                    return e
+                time.sleep(self.base_backoff * (2 ** attempt) * (0.5 + random.random()))
+
+    def _send(self, events):
+        # Sends events in order and stops at the first one that still fails after
+        # retries; returns (how many leading events were written, that event's error).
+        if self.client is None:
+            return 0, None
+        t = self.client.table
+        sent = 0
+        error = None
+        while sent < len(events):
+            if events[sent]["kind"] == "login":
+                # Consecutive logins go out as one batched insert.
+                n = sent
+                while n < len(events) and events[n]["kind"] == "login":
+                    n += 1
+                rows = [e["row"] for e in events[sent:n]]
+                error = self._with_retry(lambda: t(self.table).insert(rows).execute())
+                if error is not None and n - sent > 1 and is_permanent_error(error):
+                    # One bad row rejects the whole insert: find it by sending them one at a time.
+                    n = sent + 1
+                    rows = rows[:1]
+                    error = self._with_retry(lambda: t(self.table).insert(rows).execute())
+                if error is not None:
+                    break
+                self.stats["inserted"] += n - sent
+                sent = n
+            else:
+                ev = events[sent]
+                error = self._with_retry(
+                    lambda: t(self.table).update({"meta": ev["meta"]}).eq("meta->>session_key", ev["session_key"]).execute()
+                )
+                if error is not None:
+                    break
+                self.stats["updated"] += 1
+                sent += 1
+        if sent < len(events):
+            self.stats["failed_batches"] += 1
+        return sent, error
+
+    # ---- local SQLite outbox ----
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=5.0)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _init_outbox(self) -> None:
+        try:
+            with self._db_lock, self._connect() as conn:
+                conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS access_log_outbox (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        created_at REAL NOT NULL,
+                        event TEXT NOT NULL,
+                        attempts INTEGER NOT NULL DEFAULT 0
+                    )
+                    """
+                )
+                columns = {row[1] for row in conn.execute("PRAGMA table_info(access_log_outbox)")}
+                if "attempts" not in columns:
+                    conn.execute("ALTER TABLE access_log_outbox ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+                conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS access_log_dead_letter (
+                        id INTEGER PRIMARY KEY,
+                        created_at REAL NOT NULL,
+                        failed_at REAL NOT NULL,
+                        attempts INTEGER NOT NULL,
+                        event TEXT NOT NULL,
+                        error TEXT
+                    )
+                    """
+                )
+        except Exception as e:
+            logging.warning("Access log outbox unavailable: %s", e)
+
+    def _outbox_size(self) -> int:
+        try:
+            with self._db_lock, self._connect() as conn:
+                return conn.execute("SELECT COUNT(*) FROM access_log_outbox").fetchone()[0]
+        except Exception:
+            return 0
+
+    def _spill(self, events) -> None:
+        try:
+            now = time.time()
+            with self._db_lock, self._connect() as conn:
+                conn.executemany(
+                    "INSERT INTO access_log_outbox (created_at, event) VALUES (?, ?)",
+                    [(now, json.dumps(e, default=str)) for e in events],
+                )
+            self._outbox_rows += len(events)
+            self.stats["spilled"] += len(events)
+        except Exception as e:
+            logging.warning("Dropping %d access log events, outbox write failed: %s", len(events), e)
+
+    def _replay(self) -> None:
+        with self._db_lock, self._connect() as conn:
+            rows = conn.execute(
+                "SELECT id, event, attempts FROM access_log_outbox ORDER BY id LIMIT ?", (self.batch_size,)
+            ).fetchall()
+        if not rows:
+            self._outbox_rows = 0
+            return
+        sent, error = self._send([json.loads(ev) for _, ev, _ in rows])
+        moved = 0
+        with self._db_lock, self._connect() as conn:
+            if sent:
+                conn.executemany("DELETE FROM access_log_outbox WHERE id = ?", [(rid,) for rid, _, _ in rows[:sent]])
+            if sent < len(rows):
+                # Charge the failure to the event at the head; move it aside once
+                # it is rejected outright or has used up its attempts.
+                rid, event, attempts = rows[sent]
+                attempts += 1
+                if is_permanent_error(error) or attempts >= self.max_attempts:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO access_log_dead_letter (id, created_at, failed_at, attempts, event, error) "
+                        "SELECT id, created_at, ?, ?, event, ? FROM access_log_outbox WHERE id = ?",
+                        (time.time(), attempts, repr(error), rid),
+                    )
+                    conn.execute("DELETE FROM access_log_outbox WHERE id = ?", (rid,))
+                    moved = 1
+                    self.stats["dead_lettered"] += 1
+                    logging.warning("Access log event %s moved to the dead-letter table after %d attempts: %s",
+                                    rid, attempts, error)
+                else:
+                    conn.execute("UPDATE access_log_outbox SET attempts = ? WHERE id = ?", (attempts, rid))
+        self._outbox_rows = max(0, self._outbox_rows - sent - moved)
+        self.stats["replayed"] += sent
+        if sent or moved:
+            # The head of the outbox moved: go on with the rest on the next tick.
+            self._replay_failures = 0
+            self._replay_at = 0.0
+        elif self._outbox_rows:
+            self._backoff()
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_access_log_writer(client=None) -> AccessLogWriter:
+    # Process-wide writer; the latest non-None client is used for sending.
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = AccessLogWriter(client)
+        elif client is not None and _writer.client is None:
+            _writer.client = client
+        return _writer
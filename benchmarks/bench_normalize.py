@@ -0,0 +1,135 @@
+"""Micro-benchmark: output_format.normalize_model_output (precompiled, gated
+passes plus a per-message memo) vs. the original normaliser that lived in tutor.py.
+tests/test_output_format.py checks that both give identical output.
+
+    python benchmarks/bench_normalize.py [--repeat 200]
+"""
+import argparse
+import os
+import re as _re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from output_format import _normalize_uncached, normalize_model_output  # noqa: E402
+
+
+# ---------- Reference implementation (verbatim from tutor.py before the rewrite) ----
+LATEX_CODE_BLOCK_RE = _re.compile(r"```.*?```", _re.DOTALL)
+
+
+def _convert_tex_delimiters(text: str) -> str:
+    try:
+        parts = LATEX_CODE_BLOCK_RE.split(text)
+        fences = LATEX_CODE_BLOCK_RE.findall(text)
+        out = []
+        for i, seg in enumerate(parts):
+            s = _re.sub(r"\\\[(.*?)\\\]", r"$$\1$$", seg, flags=_re.DOTALL)
+            s = _re.sub(r"\\\((.*?)\\\)", r"$\1$", s)
+            s = s.replace("\\n", "\n")
+            out.append(s)
+            if i < len(fences):
+                out.append(fences[i])
+        return "".join(out)
+    except Exception:
+        return text
+
+
+def _strip_html_tags_keep_structure(text: str) -> str:
+    try:
+        t = text
+        t = _re.sub(r"<br\s*/?>", "\n", t, flags=_re.IGNORECASE)
+        t = _re.sub(r"</p>\s*", "\n\n", t, flags=_re.IGNORECASE)
+        t = _re.sub(r"<p[^>]*>", "", t, flags=_re.IGNORECASE)
+        for i in range(6, 0, -1):
+            t = _re.sub(rf"<h{i}[^>]*>(.*?)</h{i}>", lambda m: "#"*i + " " + m.group(1) + "\n\n", t, flags=_re.IGNORECASE|_re.DOTALL)
+        t = _re.sub(r"<(strong|b)>(.*?)</\1>", r"**\2**", t, flags=_re.IGNORECASE|_re.DOTALL)
+        t = _re.sub(r"<(em|i)>(.*?)</\1>", r"*\2*", t, flags=_re.IGNORECASE|_re.DOTALL)
+        t = _re.sub(r"<pre><code>(.*?)</code></pre>", lambda m: "```\n" + m.group(1) + "\n```", t, flags=_re.IGNORECASE|_re.DOTALL)
+        t = _re.sub(r"<code>(.*?)</code>", r"`\1`", t, flags=_re.IGNORECASE|_re.DOTALL)
+        t = _re.sub(r"\s*</li>\s*", "\n", t, flags=_re.IGNORECASE)
+        t = _re.sub(r"<li[^>]*>", "- ", t, flags=_re.IGNORECASE)
+        t = _re.sub(r"</?(ul|ol)[^>]*>", "\n", t, flags=_re.IGNORECASE)
+        def table_to_md(m):
+            tb = m.group(1)
+            rows = _re.findall(r"<tr[^>]*>(.*?)</tr>", tb, flags=_re.IGNORECASE|_re.DOTALL)
+            md_rows = []
+            headers = []
+            for idx, row in enumerate(rows):
+                th = _re.findall(r"<t[dh][^>]*>(.*?)</t[dh]>", row, flags=_re.IGNORECASE|_re.DOTALL)
+                cells = [ _re.sub(r"<[^>]+>", "", c).strip() for c in th ]
+                if idx == 0:
+                    headers = cells if cells else []
+                md_rows.append("| " + " | ".join(cells) + " |")
+            if headers:
+                sep = "| " + " | ".join(["---"]*len(headers)) + " |"
+                return md_rows[0] + "\n" + sep + ("\n" + "\n".join(md_rows[1:]) if len(md_rows)>1 else "")
+            else:
+                return "\n".join(md_rows)
+        t = _re.sub(r"<table[^>]*>(.*?)</table>", table_to_md, t, flags=_re.IGNORECASE|_re.DOTALL)
+        t = _re.sub(r"<[^>]+>", "", t)
+        return t
+    except Exception:
+        return text
+
+
+def legacy_normalize(text: str) -> str:
+    parts = LATEX_CODE_BLOCK_RE.split(text)
+    fences = LATEX_CODE_BLOCK_RE.findall(text)
+    out = []
+    for i, seg in enumerate(parts):
+        seg = _strip_html_tags_keep_structure(seg)
+        seg = _convert_tex_delimiters(seg)
+        out.append(seg)
+        if i < len(fences):
+            out.append(fences[i])
+    return "".join(out)
+
+
+# ---------- Representative tutor answers ------------------------------------------
+SAMPLES = [
+    # Plain markdown answer (the common case: no tags, no TeX).
+    "Hi there! 👋 Great question about **supply and demand**.\n\n"
+    "- **Demand** is how much buyers want at each price.\n"
+    "- **Supply** is how much sellers offer.\n\n"
+    "### Next Steps\nTry drawing both curves on one graph 👇\n" * 3,
+    # HTML-heavy answer with headings, lists and a table.
+    "<h3>IRAC in a nutshell</h3><p>IRAC stands for <strong>Issue</strong>, <strong>Rule</strong>, "
+    "<strong>Application</strong> and <strong>Conclusion</strong>.</p><ul><li><em>Issue</em>: what is the legal question?</li>"
+    "<li><em>Rule</em>: which law applies?</li><li><em>Application</em>: apply the rule to the facts.</li></ul>"
+    "<table><tr><th>Step</th><th>Question</th></tr><tr><td>I</td><td>What is disputed?</td></tr>"
+    "<tr><td>R</td><td>Which rule?</td></tr></table><p>Next steps: try it on your tutorial case 👇</p>",
+    # Maths answer with TeX delimiters and a code fence.
+    "The derivative of \\(x^2\\) is \\(2x\\). For the area use\\n\\[ A = \\int_0^1 x^2 \\, dx = \\frac{1}{3} \\]\n"
+    "```python\nimport numpy as np\nprint(np.trapz([0, 1], [0, 1]))\n```\nThen check \\(A \\approx 0.33\\).<br>",
+    # Long mixed answer.
+    ("<h2>Photosynthesis</h2><p>Plants convert light into chemical energy.<br/>The equation is "
+     "\\(6CO_2 + 6H_2O \\rightarrow C_6H_{12}O_6 + 6O_2\\).</p>") * 20,
+]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--repeat", type=int, default=200)
+    args = ap.parse_args()
+
+    def run(fn):
+        for s in SAMPLES:
+            fn(s)
+
+    history_len = 30  # messages re-rendered per rerun in a long chat
+    t_legacy = timeit.timeit(lambda: run(legacy_normalize), number=args.repeat)
+    t_single = timeit.timeit(lambda: run(_normalize_uncached), number=args.repeat)
+    normalize_model_output(SAMPLES[0])
+    t_memo = timeit.timeit(lambda: run(normalize_model_output), number=args.repeat)
+    n = args.repeat * len(SAMPLES)
+    print(f"{'legacy':<22}{t_legacy / n * 1e6:10.1f} us/message")
+    print(f"{'precompiled':<22}{t_single / n * 1e6:10.1f} us/message  ({t_legacy / t_single:.1f}x)")
+    print(f"{'precompiled + memo':<22}{t_memo / n * 1e6:10.1f} us/message  ({t_legacy / t_memo:.1f}x)")
+    print(f"rerun of a {history_len}-message chat: legacy {t_legacy / n * history_len * 1e3:.2f} ms, "
+          f"memoised {t_memo / n * history_len * 1e3:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
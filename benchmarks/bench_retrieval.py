@@ -0,0 +1,100 @@
+"""Recall vs. latency of the IVF retrieval backend against exact search.
+
+    python benchmarks/bench_retrieval.py [--rows 20000,50000] [--dim 1024]
+        [--queries 200] [--k 5] [--nprobe 1,4,8,16]
+
+Data is synthetic TF-IDF-like: sparse non-negative rows drawn from a few
+hundred topics, with queries drawn from the same topics. Recall@k is measured
+against ExactBackend on the same matrix; build, save and load times of the
+persisted IVF index are reported too.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rag_backends import ExactBackend, IVFBackend  # noqa: E402
+from rag_index import EmbeddingIndex  # noqa: E402
+
+
+def synthetic_tfidf(n: int, dim: int, topics: int, words: int = 30, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    topic_words = rng.integers(0, dim, size=(topics, 3 * words))
+    topic_of = rng.integers(0, topics, size=n)
+    mat = np.zeros((n, dim), dtype=np.float32)
+    for i, t in enumerate(topic_of):
+        on_topic = rng.choice(topic_words[t], size=words)
+        noise = rng.integers(0, dim, size=words // 3)
+        np.add.at(mat[i], np.concatenate([on_topic, noise]), 1.0)
+    return np.log1p(mat)
+
+
+def _latency(fn, queries):
+    times = []
+    results = []
+    for q in queries:
+        t0 = time.perf_counter()
+        results.append(fn(q))
+        times.append(time.perf_counter() - t0)
+    return np.array(times) * 1000, results
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", default="20000,50000")
+    ap.add_argument("--dim", type=int, default=1024)
+    ap.add_argument("--topics", type=int, default=300)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--k", type=int, default=5)
+    ap.add_argument("--nprobe", default="1,4,8,16")
+    args = ap.parse_args()
+
+    for n in (int(x) for x in args.rows.split(",")):
+        data = synthetic_tfidf(n + args.queries, args.dim, args.topics)
+        rows, queries = data[:n], data[n:]
+        exact = EmbeddingIndex(rows, backend=ExactBackend())
+        qn = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+
+        ms, truth = _latency(lambda q: exact.search(q, args.k)[0][0], qn)
+        csr = exact.matrix
+        csr_bytes = csr.data.nbytes + csr.indices.nbytes + csr.indptr.nbytes
+        print(f"\nrows={n} dim={args.dim} ({rows.nbytes / 2**20:.0f} MiB dense, {csr_bytes / 2**20:.1f} MiB CSR)")
+        print(f"  exact        recall=1.000  p50={np.percentile(ms, 50):7.3f}ms p95={np.percentile(ms, 95):7.3f}ms")
+
+        ivf = IVFBackend(min_rows=0)
+        t0 = time.perf_counter()
+        ivf.build(exact.matrix)
+        build_s = time.perf_counter() - t0
+        tmp = tempfile.mkdtemp(prefix="ivf_bench_")
+        try:
+            t0 = time.perf_counter()
+            ivf.save(tmp)
+            save_s = time.perf_counter() - t0
+            loaded = IVFBackend(min_rows=0)
+            t0 = time.perf_counter()
+            ok = loaded.load(tmp, exact.matrix)
+            load_s = time.perf_counter() - t0
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        print(f"  ivf build={build_s:.2f}s save={save_s * 1000:.1f}ms load={load_s * 1000:.1f}ms (reused={ok})")
+
+        for nprobe in (int(x) for x in args.nprobe.split(",")):
+            loaded.nprobe = nprobe
+            index = EmbeddingIndex(exact.matrix, normalized=True, backend=loaded)
+            ms, got = _latency(lambda q: index.search(q, args.k)[0][0], qn)
+            recall = np.mean([len(set(g) & set(t)) / args.k for g, t in zip(got, truth)])
+            print(
+                f"  ivf nprobe={nprobe:<3} recall={recall:.3f}  "
+                f"p50={np.percentile(ms, 50):7.3f}ms p95={np.percentile(ms, 95):7.3f}ms"
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
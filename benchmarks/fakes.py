@@ -0,0 +1,284 @@
+"""Local stand-ins for the Groq and Supabase clients used by tutor.py, for
+offline load tests and benchmarks. Only the API surface the app touches is
+implemented.
+"""
+import asyncio
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import numpy as np
+import pymupdf
+
+
+# ---------- Groq -------------------------------------------------------------------
+class FakeGroq:
+    # Streams a canned answer: waits `latency` seconds before the first chunk, then
+    # emits `chunk_tokens` words per chunk at `token_rate` words per second. A
+    # system message seen before is reported as cached prompt tokens, like Groq's
+    # prefix cache. `model_latency` overrides the latency per model name (e.g. to
+    # exercise the router's failover).
+    def __init__(self, latency: float = 0.3, token_rate: float = 500.0, answer_tokens: int = 120,
+                 chunk_tokens: int = 4, model_latency: dict = None):
+        self.latency = latency
+        self.model_latency = dict(model_latency or {})
+        self.token_rate = token_rate
+        self.answer_tokens = answer_tokens
+        self.chunk_tokens = max(1, chunk_tokens)
+        self.calls = 0
+        self._seen_prefixes = set()
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+        self.models = SimpleNamespace(list=lambda: SimpleNamespace(data=[]))
+
+    def _answer(self, messages, max_tokens):
+        messages = messages or []
+        prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in messages)
+        system = str(messages[0].get("content", "")) if messages and messages[0].get("role") == "system" else ""
+        with self._lock:
+            self.calls += 1
+            cached = len(system.split()) if system in self._seen_prefixes else 0
+            if system:
+                self._seen_prefixes.add(system)
+        n = min(self.answer_tokens, max_tokens or self.answer_tokens)
+        words = [f"word{i % 50}" for i in range(n)]
+        usage = SimpleNamespace(
+            prompt_tokens=prompt_tokens, completion_tokens=n, total_tokens=prompt_tokens + n,
+            prompt_tokens_details=SimpleNamespace(cached_tokens=cached),
+        )
+        return words, usage
+
+    def _create(self, stream: bool = False, messages=None, max_tokens=None, model=None, **kwargs):
+        words, usage = self._answer(messages, max_tokens)
+        if not stream:
+            msg = SimpleNamespace(content=" ".join(words))
+            return SimpleNamespace(choices=[SimpleNamespace(message=msg)], usage=usage)
+        return self._stream(words, usage, self.model_latency.get(model, self.latency))
+
+    def _chunks(self, words, usage):
+        step = self.chunk_tokens
+        for i in range(0, len(words), step):
+            delta = SimpleNamespace(content=" ".join(words[i:i + step]) + " ")
+            yield step, SimpleNamespace(choices=[SimpleNamespace(delta=delta)], x_groq=None)
+        yield 0, SimpleNamespace(choices=[], x_groq=SimpleNamespace(usage=usage))
+
+    def _stream(self, words, usage, latency: float):
+        time.sleep(latency)
+        for step, chunk in self._chunks(words, usage):
+            if step and self.token_rate:
+                time.sleep(step / self.token_rate)
+            yield chunk
+
+
+class FakeAsyncGroq(FakeGroq):
+    # AsyncGroq-shaped twin: create() and models.list() are coroutines and the
+    # stream is an async iterator, so waits do not hold a thread.
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._acreate))
+        self.models = SimpleNamespace(list=self._alist)
+
+    async def _alist(self):
+        return SimpleNamespace(data=[])
+
+    async def _acreate(self, stream: bool = False, messages=None, max_tokens=None, model=None, **kwargs):
+        words, usage = self._answer(messages, max_tokens)
+        if not stream:
+            msg = SimpleNamespace(content=" ".join(words))
+            return SimpleNamespace(choices=[SimpleNamespace(message=msg)], usage=usage)
+        return self._astream(words, usage, self.model_latency.get(model, self.latency))
+
+    async def _astream(self, words, usage, latency: float):
+        await asyncio.sleep(latency)
+        for step, chunk in self._chunks(words, usage):
+            if step and self.token_rate:
+                await asyncio.sleep(step / self.token_rate)
+            yield chunk
+
+
+# ---------- Supabase ----------------------------------------------------------------
+class _Response:
+    def __init__(self, data):
+        self.data = data
+
+
+_OR_KEYSET_RE = re.compile(r"(\w+)\.gt\.(.+?),and\((\w+)\.eq\.(.+?),(\w+)\.gt\.(.+)\)$")
+
+
+class _Query:
+    def __init__(self, table, columns=None):
+        self.table = table
+        self.columns = columns
+        self.filters = []
+        self.order_by = []
+        self.limit_n = None
+        self.action = "select"
+        self.payload = None
+        self._negate = False
+
+    def gt(self, col, value):
+        self.filters.append(lambda r: r.get(col) is not None and r[col] > _like(value, r[col]))
+        return self
+
+    def eq(self, col, value):
+        if "->>" in col:
+            field, key = col.split("->>", 1)
+            self.filters.append(lambda r: str((r.get(field) or {}).get(key)) == str(value))
+        else:
+            self.filters.append(lambda r: str(r.get(col)) == str(value))
+        return self
+
+    @property
+    def not_(self):
+        self._negate = True
+        return self
+
+    def is_(self, col, value):
+        negate, self._negate = self._negate, False
+        want = None if value == "null" else value
+        self.filters.append(lambda r: (r.get(col) == want) != negate)
+        return self
+
+    def or_(self, expr):
+        # Only the keyset form built by rag_sync.CourseEmbeddingSync.iter_pages.
+        m = _OR_KEYSET_RE.match(expr)
+        if m is None:
+            raise ValueError(f"unsupported or_ filter: {expr}")
+        upd, upd_v, _, _, rid, rid_v = m.groups()
+        self.filters.append(
+            lambda r: r[upd] is not None and (
+                r[upd] > _like(upd_v, r[upd]) or (r[upd] == _like(upd_v, r[upd]) and r[rid] > _like(rid_v, r[rid]))
+            )
+        )
+        return self
+
+    def order(self, col, desc: bool = False):
+        self.order_by.append((col, desc))
+        return self
+
+    def limit(self, n):
+        self.limit_n = n
+        return self
+
+    def execute(self):
+        return self.table._execute(self)
+
+
+def _like(value, sample):
+    # PostgREST filter values arrive as strings; compare them as the column's type.
+    return value if isinstance(value, type(sample)) else type(sample)(value)
+
+
+class _Table:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def select(self, columns="*"):
+        return _Query(self, None if columns.strip() == "*" else [c.strip() for c in columns.split(",")])
+
+    def insert(self, rows):
+        q = _Query(self)
+        q.action, q.payload = "insert", rows if isinstance(rows, list) else [rows]
+        return q
+
+    def upsert(self, rows, on_conflict: str = "id"):
+        q = _Query(self)
+        q.action, q.payload = "upsert", (rows if isinstance(rows, list) else [rows], on_conflict)
+        return q
+
+    def update(self, values):
+        q = _Query(self)
+        q.action, q.payload = "update", values
+        return q
+
+    def _execute(self, q):
+        time.sleep(self.client.latency)
+        with self.client.lock:
+            rows = self.client.tables.setdefault(self.name, [])
+            if q.action == "insert":
+                rows.extend(dict(r) for r in q.payload)
+                return _Response(q.payload)
+            if q.action == "upsert":
+                payload, key = q.payload
+                by_key = {r.get(key): r for r in rows}
+                for new in payload:
+                    if new.get(key) in by_key:
+                        by_key[new.get(key)].update(new)
+                    else:
+                        rows.append(dict(new))
+                return _Response(payload)
+            matched = [r for r in rows if all(f(r) for f in q.filters)]
+            if q.action == "update":
+                for r in matched:
+                    r.update(q.payload)
+                return _Response(matched)
+        for col, desc in reversed(q.order_by):
+            # NULLs sort last, as in Postgres.
+            matched.sort(key=lambda r: (r[col] is None, r[col] if r[col] is not None else 0), reverse=desc)
+        if q.limit_n is not None:
+            matched = matched[: q.limit_n]
+        if q.columns is not None:
+            missing = [c for c in q.columns if matched and c not in matched[0]]
+            if missing:
+                raise RuntimeError(f"column(s) {missing} do not exist")
+            matched = [{c: r[c] for c in q.columns} for r in matched]
+        return _Response(matched)
+
+
+class FakeSupabase:
+    # In-memory tables; every execute() costs `latency` seconds of simulated RTT.
+    def __init__(self, tables=None, latency: float = 0.005):
+        self.tables = tables or {}
+        self.latency = latency
+        self.lock = threading.Lock()
+
+    def table(self, name):
+        return _Table(self, name)
+
+
+def synthetic_course_rows(vectorizer, n_rows: int, words_per_row: int = 40, seed: int = 0):
+    # course_embeddings rows whose embeddings come from the real vectorizer, so
+    # query vectors and stored vectors live in the same space. Embeddings are
+    # pgvector-style strings, as Supabase returns them.
+    rng = np.random.default_rng(seed)
+    vocab = np.array(sorted(vectorizer.vocabulary_))
+    base = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    descriptions = [
+        f"Course {i}: " + " ".join(rng.choice(vocab, size=words_per_row)) for i in range(n_rows)
+    ]
+    embeddings = vectorizer.transform(descriptions).toarray().astype(np.float32)
+    return [
+        {
+            "id": i + 1,
+            "course_description": descriptions[i],
+            "embedding": "[" + ",".join(f"{v:.6g}" for v in embeddings[i]) + "]",
+            "updated_at": (base + timedelta(seconds=i)).isoformat(),
+        }
+        for i in range(n_rows)
+    ]
+
+
+def synthetic_questions(vectorizer, n: int, seed: int = 1):
+    rng = np.random.default_rng(seed)
+    vocab = np.array(sorted(vectorizer.vocabulary_))
+    return [f"Can you explain {' '.join(rng.choice(vocab, size=6))} for my module?" for _ in range(n)]
+
+
+def synthetic_pdf(vectorizer, n_pages: int, paragraphs_per_page: int = 4, words_per_paragraph: int = 60,
+                  seed: int = 0) -> bytes:
+    # A course reading for Material mode: pages of paragraphs drawn from the
+    # vectorizer's vocabulary, so synthetic_questions overlap with its chunks.
+    rng = np.random.default_rng(seed)
+    vocab = np.array(sorted(vectorizer.vocabulary_))
+    doc = pymupdf.open()
+    for _ in range(n_pages):
+        text = "\n\n".join(
+            " ".join(rng.choice(vocab, size=words_per_paragraph)) + "." for _ in range(paragraphs_per_page)
+        )
+        doc.new_page().insert_textbox(pymupdf.Rect(50, 50, 545, 790), text, fontsize=8)
+    data = doc.tobytes()
+    doc.close()
+    return data
@@ -0,0 +1,335 @@
+"""Offline load test: drives tutor.py through Streamlit's AppTest with fake Groq
+and Supabase clients (see benchmarks/fakes.py), for several catalog sizes.
+
+    python benchmarks/load_test.py [--sessions 200] [--concurrency 50] [--turns 3]
+        [--catalog 100,1000,5000] [--groq-latency 0.3] [--token-rate 500]
+        [--material 0.25] [--pdfs 3] [--pdf-pages 30]
+        [--save results.json] [--baseline results.json --max-regression 0.25]
+
+A --material share of the sessions switch to Material Engagement, upload one
+of --pdfs synthetic readings and ask their questions about it, so PDF
+extraction, the page cache and chunk retrieval are under load too.
+
+Reports turn throughput, per-turn and per-stage p50/p95 latency (from
+telemetry.py spans), the session-state footprint per session and the session
+store's in-memory and spilled chat history and PDF blobs (session_store.py). With
+--baseline, exits non-zero when p95 turn latency or throughput regresses by
+more than --max-regression.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Module-level settings are read at import time: lift the Groq rate limits (the
+# fake has none), keep telemetry in memory and leave the response cache off.
+os.environ.setdefault("GROQ_RPM", "1000000")
+os.environ.setdefault("GROQ_TPM", "1000000000")
+os.environ.setdefault("TELEMETRY_SINK", "off")
+os.environ.setdefault("RESPONSE_CACHE_BACKEND", "")
+
+import numpy as np  # noqa: E402
+import streamlit as st  # noqa: E402
+from streamlit.runtime import Runtime  # noqa: E402
+from streamlit.runtime.secrets import Secrets  # noqa: E402
+from streamlit.testing.v1 import AppTest  # noqa: E402
+
+import clients  # noqa: E402
+import model_router  # noqa: E402
+import rag_store  # noqa: E402
+import session_store  # noqa: E402
+import telemetry  # noqa: E402
+import warmup  # noqa: E402
+from fakes import FakeAsyncGroq, FakeSupabase, synthetic_course_rows, synthetic_pdf, synthetic_questions  # noqa: E402
+
+TUTOR_PATH = os.path.join(ROOT, "tutor.py")
+MATERIAL_MODE = "***Material Engagement***"
+
+# AppTest has no login flow; mark the simulated student as signed in before
+# running the real script.
+DRIVER = """
+import runpy
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+get_script_run_ctx().user_info.update(is_logged_in=True, email={email!r}, name={name!r})
+runpy.run_path({path!r}, run_name="__main__")
+"""
+
+SECRETS = {
+    "groq": {"api_key": "gsk_loadtest"},
+    "SUPABASE_URL": "https://loadtest.invalid",
+    "SUPABASE_ANON_KEY": "loadtest",
+}
+
+
+def _allow_concurrent_apptests() -> None:
+    # AppTest installs a mock Runtime singleton (and st.secrets) for the length of
+    # each run and resets it afterwards, so overlapping runs in one process would
+    # see None mid-script. Fall back to the last mock runtime instead; secrets are
+    # installed once, globally, rather than per AppTest.
+    last = {}
+    original = Runtime.instance.__func__
+
+    def instance(cls):
+        if cls._instance is not None:
+            last["runtime"] = cls._instance
+            return cls._instance
+        return last["runtime"] if "runtime" in last else original(cls)
+
+    Runtime.instance = classmethod(instance)
+    secrets = Secrets()
+    secrets._secrets = SECRETS
+    st.secrets = secrets
+
+
+def _deep_sizeof(obj, seen=None) -> int:
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj, 0)
+    if isinstance(obj, dict):
+        size += sum(_deep_sizeof(k, seen) + _deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(_deep_sizeof(v, seen) for v in obj)
+    elif hasattr(obj, "__dict__"):
+        size += _deep_sizeof(vars(obj), seen)
+    elif isinstance(obj, np.ndarray):
+        size += obj.nbytes
+    return size
+
+
+def run_session(idx: int, questions, timeout: float, pdf: tuple = None) -> dict:
+    # pdf: (filename, bytes) to upload in Material Engagement mode before asking.
+    at = AppTest.from_string(
+        DRIVER.format(email=f"student{idx}@loadtest.invalid", name=f"Student {idx}", path=TUTOR_PATH),
+        default_timeout=timeout,
+    )
+    t0 = time.perf_counter()
+    at.run()
+    first_paint = time.perf_counter() - t0
+    upload = None
+    if pdf is not None:
+        at.radio[0].set_value(MATERIAL_MODE).run()
+        t0 = time.perf_counter()
+        at.file_uploader[0].set_value((pdf[0], pdf[1], "application/pdf")).run()
+        upload = time.perf_counter() - t0
+        if at.exception:
+            raise RuntimeError(at.exception[0].message)
+        if not at.session_state["pdf_chars"]:
+            raise RuntimeError(f"{pdf[0]} was uploaded but no text was extracted")
+    turns = []
+    for q in questions:
+        t0 = time.perf_counter()
+        at.chat_input[0].set_value(q).run()
+        turns.append(time.perf_counter() - t0)
+        if at.exception:
+            raise RuntimeError(at.exception[0].message)
+    answered = sum(1 for m in at.session_state["messages"] if m["role"] == "assistant") if questions else 0
+    if answered < len(questions):
+        raise RuntimeError(f"{len(questions) - answered} of {len(questions)} turns got no answer")
+    state = {k: v for k, v in at.session_state.items() if not k.startswith("$$")}
+    return {
+        "first_paint": first_paint, "upload": upload, "material": pdf is not None, "turns": turns,
+        "state_bytes": _deep_sizeof(state),
+    }
+
+
+def _pct(values, q) -> float:
+    return float(np.percentile(values, q)) if len(values) else float("nan")
+
+
+def run_catalog(n_rows: int, args, vectorizer) -> dict:
+    # Fresh process-wide state per catalog size: cached index, snapshot and stats.
+    st.cache_resource.clear()
+    telemetry._telemetry = telemetry.Telemetry(None)
+    warmup._warmup = warmup.Warmup()
+    model_router._router = None
+    fake_sb = FakeSupabase(
+        {"course_embeddings": synthetic_course_rows(vectorizer, n_rows)}, latency=args.supabase_latency
+    )
+    fake_groq = FakeAsyncGroq(latency=args.groq_latency, token_rate=args.token_rate, answer_tokens=args.answer_tokens)
+    clients.get_supabase_client = lambda url, key: fake_sb if url and key else None
+    clients.get_async_groq_client = lambda api_key: fake_groq
+    rag_store.SNAPSHOT_DIR = tempfile.mkdtemp(prefix=f"rag_snapshot_{n_rows}_")
+
+    questions = synthetic_questions(vectorizer, args.sessions * args.turns)
+    per_session = [questions[i * args.turns:(i + 1) * args.turns] for i in range(args.sessions)]
+    # A few shared readings, so repeat uploads of one file hit the page cache.
+    pdfs = [(f"reading{k}.pdf", synthetic_pdf(vectorizer, args.pdf_pages, seed=k)) for k in range(max(1, args.pdfs))]
+    n_material = round(args.sessions * args.material)
+    # Material sessions are spread over the run rather than bunched at the start.
+    material = {round(j * args.sessions / n_material) for j in range(n_material)} if n_material else set()
+
+    # Let the background warm-up finish once so the first wave of sessions is comparable.
+    t0 = time.perf_counter()
+    run_session(-1, [], args.timeout)
+    warmup.get_warmup().wait(args.timeout)
+    cold_start = time.perf_counter() - t0
+    telemetry._telemetry = telemetry.Telemetry(None)
+
+    errors = []
+    errors_lock = threading.Lock()
+
+    def _one(i):
+        try:
+            pdf = pdfs[i % len(pdfs)] if i in material else None
+            return run_session(i, per_session[i], args.timeout, pdf=pdf)
+        except Exception as e:
+            with errors_lock:
+                errors.append(repr(e))
+            return None
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = [r for r in pool.map(_one, range(args.sessions)) if r is not None]
+    wall = time.perf_counter() - t0
+
+    turns = [t for r in results for t in r["turns"]]
+    material_turns = [t for r in results if r["material"] for t in r["turns"]]
+    uploads = [r["upload"] for r in results if r["upload"] is not None]
+    summary = telemetry.get_telemetry().summary()
+    stages = {
+        name: {k: s[k] for k in ("count", "p50", "p95") if k in s}
+        for name, s in summary.items()
+        if not name.startswith("usage.")
+    }
+    usage = {name[len("usage."):]: s.get("mean") for name, s in summary.items() if name.startswith("usage.")}
+    return {
+        "catalog_rows": n_rows,
+        "sessions": len(results),
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "cold_start_s": cold_start,
+        "wall_s": wall,
+        "throughput_turns_per_s": len(turns) / wall if wall else 0.0,
+        "turn_p50_s": _pct(turns, 50),
+        "turn_p95_s": _pct(turns, 95),
+        "first_paint_p95_s": _pct([r["first_paint"] for r in results], 95),
+        "material_sessions": sum(1 for r in results if r["material"]),
+        "material_turn_p95_s": _pct(material_turns, 95),
+        "upload_p95_s": _pct(uploads, 95),
+        "state_bytes_per_session": float(np.mean([r["state_bytes"] for r in results])) if results else 0.0,
+        "groq_calls": fake_groq.calls,
+        "prompt_tokens_per_turn": usage.get("prompt_tokens"),
+        "cached_tokens_per_turn": usage.get("cached_tokens"),
+        "models": model_router.get_router().stats(),
+        "session_store": session_store.get_session_store().stats(),
+        "stages": stages,
+    }
+
+
+def _print_report(report: dict) -> None:
+    print(
+        f"\ncatalog={report['catalog_rows']:>6} sessions={report['sessions']} errors={report['errors']} "
+        f"cold_start={report['cold_start_s']:.2f}s wall={report['wall_s']:.2f}s "
+        f"throughput={report['throughput_turns_per_s']:.1f} turns/s"
+    )
+    print(
+        f"  turn p50={report['turn_p50_s'] * 1000:.0f}ms p95={report['turn_p95_s'] * 1000:.0f}ms  "
+        f"first paint p95={report['first_paint_p95_s'] * 1000:.0f}ms  "
+        f"state/session={report['state_bytes_per_session'] / 1024:.1f} KiB"
+    )
+    if report.get("material_sessions"):
+        print(
+            f"  material sessions={report['material_sessions']} upload p95={report['upload_p95_s'] * 1000:.0f}ms "
+            f"turn p95={report['material_turn_p95_s'] * 1000:.0f}ms"
+        )
+    if report.get("prompt_tokens_per_turn") is not None:
+        print(
+            f"  prompt tokens/turn={report['prompt_tokens_per_turn']:.0f} "
+            f"cached/turn={report.get('cached_tokens_per_turn') or 0:.0f}"
+        )
+    store = report.get("session_store")
+    if store:
+        print(
+            f"  session store: live={store['sessions']} in-memory={store['bytes'] / 1024:.1f} KiB "
+            f"max/session={store['max_session_bytes'] / 1024:.1f} KiB spilled msgs={store['spilled_messages']} "
+            f"evictions={store['evictions']} blobs={store['blob_bytes'] / 1024:.1f} KiB "
+            f"blob evictions={store['blob_evictions']}"
+        )
+    for model, s in report.get("models", {}).items():
+        print(f"  model {model:<28} calls={s['calls']:<5} errors={s['error_rate']:.0%} ttft p95={s.get('ttft_p95', 0) * 1000:.0f}ms")
+    if report["first_error"]:
+        print(f"  first error: {report['first_error']}")
+    for name, s in report["stages"].items():
+        if "p50" in s:
+            print(f"  {name:<24} n={s['count']:<6} p50={s['p50'] * 1000:8.2f}ms p95={s['p95'] * 1000:8.2f}ms")
+
+
+def check_regression(reports, baseline_path: str, tolerance: float):
+    with open(baseline_path, "r", encoding="utf-8") as fh:
+        baseline = {r["catalog_rows"]: r for r in json.load(fh)}
+    failures = []
+    for r in reports:
+        base = baseline.get(r["catalog_rows"])
+        if base is None:
+            continue
+        if r["turn_p95_s"] > base["turn_p95_s"] * (1 + tolerance):
+            failures.append(f"catalog={r['catalog_rows']}: turn p95 {r['turn_p95_s']:.3f}s vs {base['turn_p95_s']:.3f}s")
+        if r["throughput_turns_per_s"] < base["throughput_turns_per_s"] * (1 - tolerance):
+            failures.append(
+                f"catalog={r['catalog_rows']}: throughput {r['throughput_turns_per_s']:.1f} "
+                f"vs {base['throughput_turns_per_s']:.1f} turns/s"
+            )
+        if r["errors"] > base.get("errors", 0):
+            failures.append(f"catalog={r['catalog_rows']}: {r['errors']} failed sessions")
+    return failures
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sessions", type=int, default=200)
+    ap.add_argument("--concurrency", type=int, default=50)
+    ap.add_argument("--turns", type=int, default=3)
+    ap.add_argument("--catalog", default="100,1000,5000", help="comma-separated course_embeddings row counts")
+    ap.add_argument("--groq-latency", type=float, default=0.3, help="seconds before the first streamed chunk")
+    ap.add_argument("--token-rate", type=float, default=500.0, help="streamed words per second")
+    ap.add_argument("--answer-tokens", type=int, default=120)
+    ap.add_argument("--supabase-latency", type=float, default=0.005)
+    ap.add_argument("--material", type=float, default=0.25, help="share of sessions in Material Engagement mode")
+    ap.add_argument("--pdfs", type=int, default=3, help="distinct synthetic PDFs the material sessions upload")
+    ap.add_argument("--pdf-pages", type=int, default=30)
+    ap.add_argument("--timeout", type=float, default=60.0, help="AppTest timeout per script run")
+    ap.add_argument("--save", help="write the JSON report here")
+    ap.add_argument("--baseline", help="earlier --save output to compare against")
+    ap.add_argument("--max-regression", type=float, default=0.25)
+    args = ap.parse_args()
+    args.save = os.path.abspath(args.save) if args.save else None
+    args.baseline = os.path.abspath(args.baseline) if args.baseline else None
+    # tutor.py asks for DEBUG logging; configuring first keeps the report readable.
+    logging.basicConfig(level=logging.WARNING)
+
+    # The app writes its local SQLite files and snapshots relative to the cwd.
+    vectorizer = rag_store.load_vectorizer(os.path.join(ROOT, rag_store.VECTORIZER_PATH))
+    rag_store.VECTORIZER_PATH = os.path.join(ROOT, rag_store.VECTORIZER_PATH)
+    os.chdir(tempfile.mkdtemp(prefix="tutor_loadtest_"))
+    _allow_concurrent_apptests()
+
+    reports = []
+    for n_rows in (int(n) for n in args.catalog.split(",") if n.strip()):
+        report = run_catalog(n_rows, args, vectorizer)
+        _print_report(report)
+        reports.append(report)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as fh:
+            json.dump(reports, fh, indent=2)
+    if args.baseline:
+        failures = check_regression(reports, args.baseline, args.max_regression)
+        for f in failures:
+            print("REGRESSION:", f)
+        return 1 if failures else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
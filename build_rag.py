@@ -0,0 +1,234 @@
+"""Offline build of the TF-IDF vectorizer and the course embedding snapshot.
+
+    python build_rag.py --input courses.csv [--text-col course_description]
+        [--id-col id] [--meta-cols faculty] [--snapshot-dir rag_snapshot]
+        [--workers 4] [--chunk-size 2000] [--min-df 1] [--max-df 1.0]
+        [--max-features N] [--upsert --batch-size 500] [--vectorizer-out PATH]
+    python build_rag.py --from-supabase [...]
+
+Reads course descriptions (CSV, JSON or JSONL file, or the course_embeddings
+table via the app's Streamlit secrets), fits one TfidfVectorizer, transforms
+the descriptions in parallel chunks across a process pool, and writes a
+snapshot the app loads directly: the CSR matrix and meta.json (rag_store.py
+layout) plus the vectorizer itself. meta.json records the vectorizer's
+fingerprint; the app refuses a snapshot whose fingerprint or width does not
+match the vectorizer it loads. With --upsert the rows and their new
+embeddings are written back to Supabase in batches; do that whenever the app
+also syncs from Supabase, so the rows it folds in later come from the same
+vectorizer. A snapshot built without --upsert is marked as such and the app
+serves it without syncing from Supabase.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import joblib
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+import rag_store
+from rag_index import _l2_normalize_rows
+from rag_sync import CourseEmbeddingSync
+
+
+# ---------- Input ------------------------------------------------------------------
+def read_file(path: str, id_col: str, text_col: str, meta_cols):
+    if path.endswith(".csv"):
+        df = pd.read_csv(path)
+    elif path.endswith(".jsonl"):
+        df = pd.read_json(path, lines=True)
+    else:
+        df = pd.read_json(path)
+    if text_col not in df.columns:
+        raise SystemExit(f"{path} has no {text_col!r} column (columns: {', '.join(map(str, df.columns))})")
+    ids = df[id_col].tolist() if id_col in df.columns else list(range(1, len(df) + 1))
+    descriptions = df[text_col].fillna("").astype(str).tolist()
+    cols = [c for c in meta_cols if c in df.columns]
+    metadata = [{c: r[c] for c in cols if pd.notna(r[c])} for r in df[cols].to_dict("records")] if cols else None
+    return ids, descriptions, metadata, (None, max(ids) if ids else None), None
+
+
+def read_supabase(client, table: str, id_col: str, text_col: str, meta_cols):
+    # Text and metadata only: the stored embeddings are what is being rebuilt.
+    syncer = CourseEmbeddingSync(
+        client, table=table, id_col=id_col, text_col=text_col, embedding_col="", snapshot_dir=None,
+        meta_cols=meta_cols,
+    )
+    rows = syncer.fetch_rows()
+    ids = [r.get(id_col) for r in rows]
+    descriptions = [r.get(text_col) or "" for r in rows]
+    metadata = [{c: r.get(c) for c in meta_cols if r.get(c) is not None} for r in rows]
+    return ids, descriptions, metadata, syncer.watermark, syncer.updated_col
+
+
+def _supabase_from_secrets():
+    import streamlit as st
+
+    from clients import get_supabase_client, vectors_supabase_keys
+
+    url, key = vectors_supabase_keys(st.secrets)
+    if not url or not key:
+        raise SystemExit("No Supabase URL/key found in .streamlit/secrets.toml or the environment")
+    return get_supabase_client(url, key)
+
+
+# ---------- Parallel transform -----------------------------------------------------
+_worker_vectorizer = None
+
+
+def _init_worker(vectorizer) -> None:
+    # The fitted vectorizer is pickled to each worker once, not once per chunk.
+    global _worker_vectorizer
+    _worker_vectorizer = vectorizer
+
+
+def _transform_chunk(texts):
+    return sp.csr_matrix(_worker_vectorizer.transform(texts), dtype=np.float32)
+
+
+def transform_parallel(vectorizer, descriptions, workers: int, chunk_size: int) -> sp.csr_matrix:
+    chunks = [descriptions[i:i + chunk_size] for i in range(0, len(descriptions), chunk_size)]
+    if workers <= 1 or len(chunks) <= 1:
+        parts = [sp.csr_matrix(vectorizer.transform(c), dtype=np.float32) for c in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(vectorizer,)) as pool:
+            parts = list(pool.map(_transform_chunk, chunks))
+    if not parts:
+        return sp.csr_matrix((0, len(vectorizer.vocabulary_)), dtype=np.float32)
+    return _l2_normalize_rows(sp.vstack(parts, format="csr", dtype=np.float32))
+
+
+# ---------- Output -----------------------------------------------------------------
+def write_snapshot(path: str, vectorizer, matrix, ids, descriptions, metadata, watermark, updated_col,
+                   build: dict) -> str:
+    # The vectorizer goes in first (uncompressed, so the app can mmap it) and
+    # meta.json last via save_snapshot, so a reader never pairs a new matrix with
+    # an old vectorizer without the fingerprint check noticing.
+    os.makedirs(path, exist_ok=True)
+    version = rag_store.vectorizer_fingerprint(vectorizer)
+    target = os.path.join(path, rag_store.SNAPSHOT_VECTORIZER)
+    joblib.dump(vectorizer, target + ".tmp")
+    os.replace(target + ".tmp", target)
+    rag_store.save_snapshot(
+        matrix, ids, descriptions, path,
+        extra_meta={
+            "vectorizer_version": version, "build": build,
+            "metadata": metadata if metadata is not None else [{} for _ in ids],
+            "watermark": list(watermark), "updated_col": updated_col,
+        },
+    )
+    return version
+
+
+def mark_upserted(path: str) -> None:
+    # Flags the snapshot as matching Supabase once the upsert has gone through.
+    meta_path = os.path.join(path, rag_store.SNAPSHOT_META)
+    with open(meta_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    meta.setdefault("build", {})["upserted"] = True
+    with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(meta, f, default=str)
+    os.replace(meta_path + ".tmp", meta_path)
+
+
+def _embedding_text(row: np.ndarray) -> str:
+    # pgvector/text form, as the app's parse_embedding reads it back.
+    return "[" + ",".join(f"{x:.6g}" for x in row) + "]"
+
+
+def upsert_rows(client, table: str, matrix, ids, descriptions, metadata, id_col: str, text_col: str,
+                embedding_col: str, batch_size: int) -> int:
+    sent = 0
+    for start in range(0, len(ids), batch_size):
+        stop = min(start + batch_size, len(ids))
+        dense = matrix[start:stop].toarray()
+        batch = []
+        for i, row in zip(range(start, stop), dense):
+            record = {id_col: ids[i], text_col: descriptions[i], embedding_col: _embedding_text(row)}
+            if metadata is not None:
+                record.update(metadata[i])
+            batch.append(record)
+        client.table(table).upsert(batch, on_conflict=id_col).execute()
+        sent += len(batch)
+        logging.info("Upserted %d/%d rows", sent, len(ids))
+    return sent
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    src = ap.add_mutually_exclusive_group(required=True)
+    src.add_argument("--input", help="CSV, JSON or JSONL file with one course per row")
+    src.add_argument("--from-supabase", action="store_true", help="read descriptions from the course_embeddings table")
+    ap.add_argument("--table", default="course_embeddings")
+    ap.add_argument("--id-col", default="id")
+    ap.add_argument("--text-col", default="course_description")
+    ap.add_argument("--embedding-col", default="embedding")
+    ap.add_argument("--meta-cols", default=os.environ.get("RAG_META_COLUMNS", ""), help="comma-separated, e.g. faculty")
+    ap.add_argument("--snapshot-dir", default=rag_store.SNAPSHOT_DIR)
+    ap.add_argument("--vectorizer-out", help="also write the vectorizer here (e.g. tfidf_vectorizer.joblib)")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--chunk-size", type=int, default=2000)
+    ap.add_argument("--min-df", type=float, default=1)
+    ap.add_argument("--max-df", type=float, default=1.0)
+    ap.add_argument("--max-features", type=int)
+    ap.add_argument("--upsert", action="store_true", help="write rows and embeddings back to Supabase")
+    ap.add_argument("--batch-size", type=int, default=500)
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    meta_cols = [c.strip() for c in args.meta_cols.split(",") if c.strip()]
+
+    t0 = time.perf_counter()
+    client = _supabase_from_secrets() if args.from_supabase or args.upsert else None
+    if args.input:
+        ids, descriptions, metadata, watermark, updated_col = read_file(args.input, args.id_col, args.text_col, meta_cols)
+    else:
+        ids, descriptions, metadata, watermark, updated_col = read_supabase(client, args.table, args.id_col, args.text_col, meta_cols)
+    if not descriptions:
+        raise SystemExit("No course descriptions to build from")
+    read_s = time.perf_counter() - t0
+
+    # Same settings as the vectorizer the app shipped with, apart from the df limits.
+    min_df = int(args.min_df) if args.min_df >= 1 else args.min_df
+    max_df = int(args.max_df) if args.max_df > 1 else args.max_df
+    vectorizer = TfidfVectorizer(stop_words="english", min_df=min_df, max_df=max_df, max_features=args.max_features)
+    t0 = time.perf_counter()
+    vectorizer.fit(descriptions)
+    fit_s = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    matrix = transform_parallel(vectorizer, descriptions, args.workers, max(1, args.chunk_size))
+    transform_s = time.perf_counter() - t0
+
+    build = {
+        "built_at": time.time(), "rows": len(ids), "terms": len(vectorizer.vocabulary_),
+        "source": args.input or f"supabase:{args.table}", "upserted": False,
+    }
+    version = write_snapshot(
+        args.snapshot_dir, vectorizer, matrix, ids, descriptions, metadata, watermark, updated_col, build
+    )
+    if args.vectorizer_out:
+        joblib.dump(vectorizer, args.vectorizer_out)
+    print(
+        f"rows={len(ids)} terms={len(vectorizer.vocabulary_)} nnz={matrix.nnz} version={version} "
+        f"read={read_s:.2f}s fit={fit_s:.2f}s transform={transform_s:.2f}s ({args.workers} workers)"
+    )
+
+    if args.upsert:
+        t0 = time.perf_counter()
+        sent = upsert_rows(
+            client, args.table, matrix, ids, descriptions, metadata,
+            args.id_col, args.text_col, args.embedding_col, max(1, args.batch_size),
+        )
+        mark_upserted(args.snapshot_dir)
+        print(f"upserted {sent} rows to {args.table} in {time.perf_counter() - t0:.2f}s")
+    print(json.dumps({"snapshot": os.path.abspath(args.snapshot_dir), "vectorizer_version": version}))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
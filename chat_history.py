@@ -0,0 +1,96 @@
+import os
+import re
+
+from tokens import count_tokens
+
+
+HISTORY_TOKEN_BUDGET = int(os.environ.get("HISTORY_TOKEN_BUDGET", 1500))
+SUMMARY_TOKEN_BUDGET = int(os.environ.get("SUMMARY_TOKEN_BUDGET", 300))
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+
+
+def format_message(message: dict) -> str:
+    return f"{message['role'].capitalize()}: {message['content']}"
+
+
+def extractive_summary(messages) -> str:
+    # Cheap local summary: the first sentence of each turn, capped per line.
+    lines = []
+    for m in messages:
+        content = " ".join(str(m.get("content", "")).split())
+        if not content:
+            continue
+        first = _SENTENCE_RE.split(content, maxsplit=1)[0][:200]
+        lines.append(f"- {m['role'].capitalize()}: {first}")
+    return "\n".join(lines)
+
+
+# ---------- Token-budgeted conversation history ----------------------------------
+class HistoryManager:
+    # Keeps recent turns verbatim and folds anything that no longer fits the
+    # budget into a running summary. Per-message formatting and token counts are
+    # cached, so each turn only processes messages added since the last call.
+    # `summarize` takes a list of messages and returns text; swap in an LLM-based
+    # summarizer if the extractive default is too lossy.
+    def __init__(self, budget_tokens: int = HISTORY_TOKEN_BUDGET, summary_tokens: int = SUMMARY_TOKEN_BUDGET,
+                 max_messages: int = None, summarize=extractive_summary):
+        self.budget_tokens = budget_tokens
+        self.summary_tokens = summary_tokens
+        self.max_messages = max_messages
+        self.summarize = summarize
+        self.reset()
+
+    def reset(self) -> None:
+        self._lines = []
+        self._costs = []
+        self._seen = None
+        self.summary = ""
+        self.summarized_upto = 0
+
+    def _sync(self, messages) -> None:
+        # A cleared or replaced message list (new chat) invalidates the cache. A
+        # session_store.SessionMessages is recognised by its key, since its first
+        # message may have been spilled to disk and come back as a new dict.
+        first = getattr(messages, "key", None) or (messages[0] if messages else None)
+        if len(messages) < len(self._lines) or (self._lines and first is not self._seen):
+            self.reset()
+        self._seen = first
+        for m in messages[len(self._lines):]:
+            line = format_message(m)
+            self._lines.append(line)
+            self._costs.append(count_tokens(line) + 1)
+
+    def _fold(self, messages, upto: int) -> None:
+        if upto <= self.summarized_upto:
+            return
+        new_part = self.summarize(messages[self.summarized_upto:upto])
+        summary = "\n".join(x for x in (self.summary, new_part) if x)
+        # Keep the running summary inside its own budget by dropping its oldest lines.
+        lines = summary.split("\n")
+        while len(lines) > 1 and count_tokens("\n".join(lines)) > self.summary_tokens:
+            lines.pop(0)
+        self.summary = "\n".join(lines)
+        # Folded turns are never formatted again; only their count matters.
+        for i in range(self.summarized_upto, upto):
+            self._lines[i] = None
+        self.summarized_upto = upto
+
+    def context(self, messages) -> str:
+        self._sync(messages)
+        budget = self.budget_tokens
+        if self.summary or sum(self._costs[self.summarized_upto:]) > budget:
+            # Reserve room for the summary so summary + recent turns stay in budget.
+            budget -= self.summary_tokens
+        start, used = len(self._lines), 0
+        floor = len(self._lines) - self.max_messages if self.max_messages else 0
+        while start > max(floor, self.summarized_upto) and used + self._costs[start - 1] <= budget:
+            start -= 1
+            used += self._costs[start]
+        if start == len(self._lines) and self._lines:
+            # Always keep the latest message, even if it alone exceeds the budget.
+            start -= 1
+        self._fold(messages, start)
+        recent = "\n".join(self._lines[start:])
+        if self.summary:
+            return f"Summary of earlier conversation:\n{self.summary}\n\n{recent}"
+        return recent
@@ -0,0 +1,252 @@
+import hashlib
+import logging
+import os
+import platform
+import threading
+from collections import OrderedDict
+
+import httpx
+from groq import AsyncGroq
+from supabase import ClientOptions, create_client
+
+
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", 20))
+HTTP_KEEPALIVE = int(os.environ.get("HTTP_KEEPALIVE", 10))
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", 60))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", 10))
+GROQ_TIMEOUT = float(os.environ.get("GROQ_TIMEOUT", 60))
+SUPABASE_TIMEOUT = float(os.environ.get("SUPABASE_TIMEOUT", 30))
+# Per-user Groq keys each get their own client; keep at most this many alive.
+MAX_GROQ_CLIENTS = int(os.environ.get("MAX_GROQ_CLIENTS", 256))
+
+
+def _sanitize_ascii(value: str) -> str:
+    try:
+        return value.encode("ascii", "ignore").decode("ascii")
+    except Exception:
+        return ""
+
+
+# ---------- Groq client with ASCII-only headers (avoid httpx header errors) ------
+class _AsciiHeaders:
+    @property
+    def default_headers(self) -> dict:
+        base = super().default_headers
+        safe = {k: _sanitize_ascii(str(v)) for k, v in base.items()}
+        safe.update(
+            {
+                "User-Agent": "groq-python",
+                "X-Stainless-OS": "Windows",
+                "X-Stainless-Arch": "x64",
+                "X-Stainless-Runtime": "CPython",
+                "X-Stainless-Runtime-Version": _sanitize_ascii(platform.python_version() or "3"),
+            }
+        )
+        return safe
+
+
+class SafeAsyncGroq(_AsciiHeaders, AsyncGroq):
+    pass
+
+
+def groq_default_headers() -> dict:
+    py_ver = _sanitize_ascii(platform.python_version())
+    arch = _sanitize_ascii("x64" if "64" in (platform.machine() or "") else "x32")
+    os_name = _sanitize_ascii("Windows" if platform.system().lower() == "windows" else platform.system())
+    return {
+        "User-Agent": "groq-python",
+        "X-Stainless-OS": os_name or "Windows",
+        "X-Stainless-Arch": arch or "x64",
+        "X-Stainless-Runtime": "CPython",
+        "X-Stainless-Runtime-Version": py_ver or "3",
+    }
+
+
+# ---------- Connection reuse counters ----------------------------------------------
+class PoolStats:
+    # Counts client cache hits and, via httpcore trace events, how many requests
+    # opened a new TCP connection versus reusing a keep-alive one.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {}
+
+    def incr(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            out = dict(self.counts)
+        for svc in ("groq", "supabase"):
+            req = out.get(f"{svc}.requests", 0)
+            new = out.get(f"{svc}.connections_opened", 0)
+            out[f"{svc}.connections_reused"] = max(0, req - new)
+        return out
+
+
+pool_stats = PoolStats()
+
+
+def _instrumented_http_client(service: str, timeout: float) -> httpx.Client:
+    def _trace(event_name, info):
+        if event_name == "connection.connect_tcp.started":
+            pool_stats.incr(f"{service}.connections_opened")
+
+    def _on_request(request):
+        pool_stats.incr(f"{service}.requests")
+        request.extensions["trace"] = _trace
+
+    return httpx.Client(
+        limits=httpx.Limits(
+            max_connections=HTTP_POOL_SIZE,
+            max_keepalive_connections=HTTP_KEEPALIVE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(timeout, connect=HTTP_CONNECT_TIMEOUT),
+        event_hooks={"request": [_on_request]},
+    )
+
+
+def _instrumented_async_http_client(service: str, timeout: float) -> httpx.AsyncClient:
+    # Same pool limits and counters as above; httpx/httpcore want async hooks here.
+    async def _trace(event_name, info):
+        if event_name == "connection.connect_tcp.started":
+            pool_stats.incr(f"{service}.connections_opened")
+
+    async def _on_request(request):
+        pool_stats.incr(f"{service}.requests")
+        request.extensions["trace"] = _trace
+
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=HTTP_POOL_SIZE,
+            max_keepalive_connections=HTTP_KEEPALIVE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(timeout, connect=HTTP_CONNECT_TIMEOUT),
+        event_hooks={"request": [_on_request]},
+    )
+
+
+def _fingerprint(*parts) -> str:
+    # Keys are hashed so raw API keys never end up as dict keys in dumps/logs.
+    return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+
+# ---------- Process-level client registry ------------------------------------------
+_lock = threading.Lock()
+_async_groq_clients = OrderedDict()
+_supabase_clients = {}
+
+
+def get_async_groq_client(api_key: str) -> SafeAsyncGroq:
+    # One client (and keep-alive pool) per API key, shared by every rerun and
+    # session using that key; a student's own key is never shared with others.
+    # Turns run on the turn pipeline (turn_pipeline.py), whose single event loop
+    # owns the pool, so evicted clients are simply dropped rather than closed
+    # from another thread.
+    key = _fingerprint("groq-async", api_key)
+    with _lock:
+        client = _async_groq_clients.get(key)
+        if client is not None:
+            _async_groq_clients.move_to_end(key)
+            pool_stats.incr("groq.client_reuse")
+            return client
+        client = SafeAsyncGroq(
+            api_key=api_key,
+            default_headers=groq_default_headers(),
+            http_client=_instrumented_async_http_client("groq", GROQ_TIMEOUT),
+            timeout=GROQ_TIMEOUT,
+        )
+        _async_groq_clients[key] = client
+        pool_stats.incr("groq.client_created")
+        while len(_async_groq_clients) > MAX_GROQ_CLIENTS:
+            _async_groq_clients.popitem(last=False)
+        return client
+
+
+def get_supabase_client(url: str, key: str):
+    if not url or not key:
+        return None
+    fp = _fingerprint("supabase", url, key)
+    with _lock:
+        client = _supabase_clients.get(fp)
+        if client is not None:
+            pool_stats.incr("supabase.client_reuse")
+            return client
+        options = ClientOptions(
+            postgrest_client_timeout=SUPABASE_TIMEOUT,
+            httpx_client=_instrumented_http_client("supabase", SUPABASE_TIMEOUT),
+        )
+        client = create_client(url, key, options=options)
+        _supabase_clients[fp] = client
+        pool_stats.incr("supabase.client_created")
+        return client
+
+
+# ---------- Credential lookup from Streamlit secrets -------------------------------
+# Takes the secrets mapping as an argument so it also works outside a script run
+# (e.g. the warm-up started before the first session, see warmup.py).
+def supabase_keys(secrets) -> tuple:
+    # (url, key) for the main project, trying the flat keys, a [supabase] table,
+    # the environment and finally the [vectors] table; ("", "") if none is set.
+    try:
+        url = str(secrets.get("SUPABASE_URL", "")).strip()
+        key = ""
+        for kname in ("SUPABASE_SERVICE_ROLE_KEY", "SUPABASE_ANON_KEY"):
+            if not key:
+                key = str(secrets.get(kname, "")).strip()
+        if url and key:
+            return url, key
+    except Exception as e:
+        logging.debug("top-level SUPABASE secrets read failed: %s", e)
+
+    try:
+        sb = secrets.get("supabase", {}) or {}
+        cand_urls = [sb.get("url"), sb.get("URL"), sb.get("supabase_url"), sb.get("SUPABASE_URL")]
+        cand_keys = [
+            sb.get("service_role_key"), sb.get("SERVICE_ROLE_KEY"),
+            sb.get("supabase_service_role_key"), sb.get("SUPABASE_SERVICE_ROLE_KEY"),
+            sb.get("anon_key"), sb.get("ANON_KEY"),
+        ]
+        url = (next((x for x in cand_urls if x), "") or "").strip()
+        key = (next((x for x in cand_keys if x), "") or "").strip()
+        if url and key:
+            return url, key
+    except Exception as e:
+        logging.debug("[supabase] table fallback failed: %s", e)
+
+    url = (os.environ.get("SUPABASE_URL") or "").strip()
+    key = (os.environ.get("SUPABASE_SERVICE_ROLE_KEY") or os.environ.get("SUPABASE_ANON_KEY") or "").strip()
+    if url and key:
+        return url, key
+
+    try:
+        vec_cfg = secrets.get("vectors", {}) or {}
+        url = (vec_cfg.get("SUPABASE_URL1") or vec_cfg.get("url") or "").strip()
+        key = (vec_cfg.get("SUPABASE_KEY1") or vec_cfg.get("key") or "").strip()
+        if url and key:
+            return url, key
+    except Exception:
+        pass
+    return "", ""
+
+
+def vectors_supabase_keys(secrets) -> tuple:
+    # course_embeddings may live in a separate project ([vectors] use_separate_project).
+    try:
+        vec_cfg = secrets.get("vectors", {}) or {}
+        url1 = (vec_cfg.get("SUPABASE_URL1") or "").strip()
+        key1 = (vec_cfg.get("SUPABASE_KEY1") or "").strip()
+        if bool(vec_cfg.get("use_separate_project", False)) and url1 and key1:
+            return url1, key1
+    except Exception:
+        pass
+    return supabase_keys(secrets)
+
+
+def groq_app_key(secrets) -> str:
+    try:
+        return str((secrets.get("groq", {}) or {}).get("api_key", "") or "").strip()
+    except Exception:
+        return ""
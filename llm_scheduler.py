@@ -0,0 +1,221 @@
+import hashlib
+import logging
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+
+
+GROQ_RPM = float(os.environ.get("GROQ_RPM", 30))
+GROQ_TPM = float(os.environ.get("GROQ_TPM", 8000))
+LLM_QUEUE_TIMEOUT = float(os.environ.get("LLM_QUEUE_TIMEOUT", 120))
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", 4))
+
+
+class QueueTimeout(Exception):
+    pass
+
+
+def is_rate_limit(e: Exception) -> bool:
+    return getattr(e, "status_code", None) == 429 or type(e).__name__ == "RateLimitError"
+
+
+def _retry_after(e: Exception):
+    try:
+        value = getattr(getattr(e, "response", None), "headers", {}).get("retry-after")
+        return float(value) if value is not None else None
+    except Exception:
+        return None
+
+
+def _total_tokens(usage):
+    if usage is None:
+        return None
+    if isinstance(usage, dict):
+        return usage.get("total_tokens")
+    return getattr(usage, "total_tokens", None)
+
+
+# ---------- Token bucket ---------------------------------------------------------
+class TokenBucket:
+    # Refills continuously at rate_per_min / 60 per second up to one minute's worth.
+    def __init__(self, rate_per_min: float):
+        self.capacity = max(1.0, float(rate_per_min))
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.stamp = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.tokens >= amount else (amount - self.tokens) / self.rate
+
+    def take(self, amount: float) -> None:
+        self.tokens -= min(amount, self.capacity)
+
+    def give(self, amount: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+# ---------- Fair, rate-limited scheduler -----------------------------------------
+class Ticket:
+    __slots__ = ("user", "tokens", "granted")
+
+    def __init__(self, user: str, tokens: int):
+        self.user = user
+        self.tokens = tokens
+        self.granted = False
+
+
+class LLMScheduler:
+    # Gates outgoing LLM calls for one API key with request- and token-per-minute
+    # buckets. Waiting calls are served round-robin across users, so one student
+    # firing many questions cannot starve the rest of the tutorial group.
+    def __init__(self, rpm: float = GROQ_RPM, tpm: float = GROQ_TPM):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self._queues = OrderedDict()  # user -> deque[Ticket], in round-robin order
+        self._cond = threading.Condition()
+        self._paused_until = 0.0
+        self.stats = {"granted": 0, "rate_limited": 0, "timeouts": 0}
+
+    def position(self, ticket: Ticket) -> int:
+        # 1-based place in the round-robin service order.
+        with self._cond:
+            return self._position(ticket)
+
+    def _position(self, ticket: Ticket) -> int:
+        users = list(self._queues)
+        mine = self._queues.get(ticket.user)
+        if not mine or ticket not in mine:
+            return 0
+        depth = list(mine).index(ticket)
+        me = users.index(ticket.user)
+        ahead = 0
+        for i, user in enumerate(users):
+            n = len(self._queues[user])
+            ahead += min(n, depth + 1) if i < me else min(n, depth) if i > me else depth
+        return ahead + 1
+
+    def acquire(self, user: str, tokens: int, on_wait=None, timeout: float = LLM_QUEUE_TIMEOUT) -> Ticket:
+        ticket = Ticket(user or "anonymous", max(1, int(tokens)))
+        deadline = time.monotonic() + timeout
+        last_pos = None
+        with self._cond:
+            self._queues.setdefault(ticket.user, deque()).append(ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    head_user = next(iter(self._queues))
+                    is_next = head_user == ticket.user and self._queues[head_user][0] is ticket
+                    wait = max(self._paused_until - now, 0.0)
+                    if is_next and wait == 0.0:
+                        wait = max(self.requests.wait_time(1, now), self.tokens.wait_time(ticket.tokens, now))
+                        if wait == 0.0:
+                            self._grant(ticket)
+                            return ticket
+                    if now >= deadline:
+                        self.stats["timeouts"] += 1
+                        raise QueueTimeout(f"LLM queue wait exceeded {timeout:.0f}s")
+                    pos = self._position(ticket)
+                    if on_wait is not None and pos != last_pos:
+                        last_pos = pos
+                        self._cond.release()
+                        try:
+                            on_wait(pos)
+                        except Exception as e:
+                            logging.debug("queue on_wait callback failed: %s", e)
+                        finally:
+                            self._cond.acquire()
+                        continue
+                    self._cond.wait(timeout=min(max(wait, 0.05), 1.0, max(deadline - now, 0.01)))
+            finally:
+                if not ticket.granted:
+                    self._remove(ticket)
+                    self._cond.notify_all()
+
+    def _grant(self, ticket: Ticket) -> None:
+        self.requests.take(1)
+        self.tokens.take(ticket.tokens)
+        ticket.granted = True
+        self._remove(ticket)
+        # Served user goes to the back of the rotation.
+        if ticket.user in self._queues:
+            self._queues.move_to_end(ticket.user)
+        self.stats["granted"] += 1
+        self._cond.notify_all()
+
+    def _remove(self, ticket: Ticket) -> None:
+        q = self._queues.get(ticket.user)
+        if q is None:
+            return
+        try:
+            q.remove(ticket)
+        except ValueError:
+            pass
+        if not q:
+            del self._queues[ticket.user]
+
+    def settle(self, ticket: Ticket, actual_tokens: int) -> None:
+        # Refund the unused part of the reservation once real usage is known
+        # (0 for a call that failed or was abandoned without reporting any).
+        with self._cond:
+            refund = ticket.tokens - int(actual_tokens)
+            if refund > 0:
+                self.tokens.give(refund)
+                self._cond.notify_all()
+
+    def pause(self, seconds: float) -> None:
+        # A 429 means our buckets drifted from the server's view; hold everyone back.
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self.stats["rate_limited"] += 1
+
+    def stream(self, user: str, tokens: int, factory, on_wait=None, stats: dict = None,
+               max_retries: int = LLM_MAX_RETRIES, base_delay: float = 1.0):
+        # Yields from factory() once a slot is granted. A 429 raised before the
+        # first chunk is retried with jittered exponential backoff (or the
+        # server's retry-after) and the request re-queued. Every granted
+        # reservation is settled however the call ends - done, failed, timed
+        # out or closed by the consumer - against the usage it reported, if any.
+        t0 = time.perf_counter()
+        stats = stats if stats is not None else {}
+        for attempt in range(max_retries + 1):
+            ticket = self.acquire(user, tokens, on_wait=on_wait)
+            stats["queue_s"] = time.perf_counter() - t0
+            stats.pop("usage", None)
+            started = False
+            try:
+                for chunk in factory():
+                    started = True
+                    yield chunk
+                return
+            except Exception as e:
+                if started or not is_rate_limit(e) or attempt == max_retries:
+                    raise
+                delay = _retry_after(e) or base_delay * (2 ** attempt)
+                delay *= 0.5 + random.random()
+                logging.warning("Groq rate limited (attempt %d), retrying in %.1fs", attempt + 1, delay)
+                self.pause(delay)
+            finally:
+                self.settle(ticket, _total_tokens(stats.get("usage")) or 0)
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(api_key: str) -> LLMScheduler:
+    # One scheduler per API key: the shared fallback key is gated for everyone,
+    # while students using their own key only queue behind themselves.
+    fp = hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()
+    with _schedulers_lock:
+        sched = _schedulers.get(fp)
+        if sched is None:
+            sched = _schedulers[fp] = LLMScheduler()
+        return sched
@@ -0,0 +1,120 @@
+import logging
+import time
+
+
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+
+
+def _partial_suffix(buf: str, tag: str) -> int:
+    # Length of the longest suffix of buf that is a proper prefix of tag.
+    for k in range(min(len(tag) - 1, len(buf)), 0, -1):
+        if buf.endswith(tag[:k]):
+            return k
+    return 0
+
+
+# ---------- Incremental <think> stripping ----------------------------------------
+class ThinkStripper:
+    # Removes <think>...</think> blocks from a token stream even when the tags are
+    # split across chunk boundaries; only a possible partial tag is held back.
+    def __init__(self):
+        self._buf = ""
+        self._inside = False
+        self._started = False
+
+    def _emit(self, text: str) -> str:
+        if not self._started:
+            text = text.lstrip()
+            self._started = bool(text)
+        return text
+
+    def feed(self, chunk: str) -> str:
+        self._buf += chunk or ""
+        out = []
+        while self._buf:
+            if self._inside:
+                j = self._buf.find(THINK_CLOSE)
+                if j < 0:
+                    keep = _partial_suffix(self._buf, THINK_CLOSE)
+                    self._buf = self._buf[len(self._buf) - keep:]
+                    break
+                self._buf = self._buf[j + len(THINK_CLOSE):]
+                self._inside = False
+            else:
+                j = self._buf.find(THINK_OPEN)
+                if j < 0:
+                    keep = _partial_suffix(self._buf, THINK_OPEN)
+                    out.append(self._buf[: len(self._buf) - keep])
+                    self._buf = self._buf[len(self._buf) - keep:]
+                    break
+                out.append(self._buf[:j])
+                self._buf = self._buf[j + len(THINK_OPEN):]
+                self._inside = True
+        return self._emit("".join(out))
+
+    def flush(self) -> str:
+        # An unterminated <think> block is dropped rather than shown to the student.
+        rest = "" if self._inside else self._buf
+        self._buf = ""
+        return self._emit(rest)
+
+
+# ---------- Streaming chat completion --------------------------------------------
+class _StreamState:
+    # Per-completion bookkeeping shared by the sync and async readers: strips
+    # <think> blocks, captures usage and fills stats (ttft_s, total_s, text, usage).
+    def __init__(self, stats: dict):
+        self.stats = stats
+        self.stripper = ThinkStripper()
+        self.parts = []
+        self.t0 = time.perf_counter()
+        stats["ttft_s"] = None
+
+    def _visible(self, text: str) -> str:
+        if text:
+            if self.stats["ttft_s"] is None:
+                self.stats["ttft_s"] = time.perf_counter() - self.t0
+            self.parts.append(text)
+        return text
+
+    def feed(self, chunk) -> str:
+        usage = getattr(getattr(chunk, "x_groq", None), "usage", None) or getattr(chunk, "usage", None)
+        if usage is not None:
+            self.stats["usage"] = usage
+        choices = getattr(chunk, "choices", None) or []
+        delta = getattr(choices[0].delta, "content", None) if choices else None
+        return self._visible(self.stripper.feed(delta)) if delta else ""
+
+    def finish(self) -> str:
+        tail = self._visible(self.stripper.flush())
+        self.stats["total_s"] = time.perf_counter() - self.t0
+        self.stats["text"] = "".join(self.parts).strip()
+        logging.debug("LLM stream done: ttft=%.3fs total=%.3fs", self.stats["ttft_s"] or -1.0, self.stats["total_s"])
+        return tail
+
+
+def stream_completion(client, stats: dict = None, **create_kwargs):
+    # Yields visible text deltas from a streaming Groq/OpenAI-style completion.
+    # stats (if given) receives ttft_s, total_s, text and usage when available.
+    state = _StreamState(stats if stats is not None else {})
+    for chunk in client.chat.completions.create(stream=True, **create_kwargs):
+        visible = state.feed(chunk)
+        if visible:
+            yield visible
+    tail = state.finish()
+    if tail:
+        yield tail
+
+
+async def astream_completion(client, stats: dict = None, **create_kwargs):
+    # Same as stream_completion for an async client (AsyncGroq / AsyncOpenAI).
+    state = _StreamState(stats if stats is not None else {})
+    stream = await client.chat.completions.create(stream=True, **create_kwargs)
+    async for chunk in stream:
+        visible = state.feed(chunk)
+        if visible:
+            yield visible
+    tail = state.finish()
+    if tail:
+        yield tail
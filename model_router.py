@@ -0,0 +1,203 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from llm_scheduler import QueueTimeout
+from turn_pipeline import TurnCancelled, TurnTimeout
+
+
+# Turn class -> ordered [model, max_tokens] candidates; the first healthy one is
+# tried first and the others are fallbacks. Override with LLM_ROUTES (same JSON shape).
+# gpt-oss is a reasoning model whose hidden reasoning counts against max_tokens,
+# so it never gets less than the 2000 every turn had before routing.
+DEFAULT_ROUTES = {
+    "chat": [["llama-3.1-8b-instant", 400], ["openai/gpt-oss-20b", 2000]],
+    "quiz": [["openai/gpt-oss-20b", 2000], ["llama-3.1-8b-instant", 800]],
+    "explain": [["openai/gpt-oss-20b", 2000], ["llama-3.3-70b-versatile", 2000]],
+}
+# Seconds to wait for the first token before failing over to the next model.
+DEFAULT_DEADLINES = {"chat": 4.0, "quiz": 6.0, "explain": 10.0}
+ROUTER_WINDOW = int(os.environ.get("ROUTER_WINDOW", 50))
+# Samples older than this are ignored, so a demoted model is tried first again
+# once its bad spell has aged out.
+ROUTER_WINDOW_S = float(os.environ.get("ROUTER_WINDOW_S", 300))
+ROUTER_MIN_SAMPLES = int(os.environ.get("ROUTER_MIN_SAMPLES", 5))
+ROUTER_MAX_ERROR_RATE = float(os.environ.get("ROUTER_MAX_ERROR_RATE", 0.5))
+
+
+def _load_json_env(name: str, default: dict) -> dict:
+    raw = os.environ.get(name, "").strip()
+    if not raw:
+        return default
+    try:
+        return {**default, **json.loads(raw)}
+    except ValueError as e:
+        logging.warning("Ignoring invalid %s: %s", name, e)
+        return default
+
+
+# A message that is nothing but a greeting or acknowledgement ("hi!", "ok, thanks").
+_GREETING_WORDS = (
+    r"(hi|hello|hey|howzit|good (morning|afternoon|evening)|thanks|thank you|ok(ay)?|cool|great|yes|no|sure"
+    r"|there|so much)"
+)
+_GREETING_RE = re.compile(rf"^\s*{_GREETING_WORDS}([\s,]+{_GREETING_WORDS})*[\s!.?,:)]*$", re.IGNORECASE)
+# A reply that is just an option letter or true/false, optionally with a short reason.
+_QUIZ_ANSWER_RE = re.compile(r"^\s*(\(?[a-eA-E]\)?[).:]?|true|false)(\s|[,.!]|$)", re.IGNORECASE)
+# A tutor message that poses a quiz question: lettered options or a numbered question.
+_QUIZ_OPTION_RE = re.compile(r"(?m)^\s*(?:[-*]\s*)?\(?[a-dA-D][).]\s+\S")
+_QUIZ_QUESTION_RE = re.compile(r"\b(question\s*\d+|true\s+or\s+false)\b", re.IGNORECASE)
+_EXPLAIN_RE = re.compile(
+    r"\b(explain|what|why|how|define|describe|difference|compare|example|summari[sz]e|help|quiz|test me)\b",
+    re.IGNORECASE,
+)
+
+
+def is_quiz_question(text: str) -> bool:
+    return len(_QUIZ_OPTION_RE.findall(text or "")) >= 2 or bool(_QUIZ_QUESTION_RE.search(text or ""))
+
+
+def classify_turn(question: str, messages=()) -> str:
+    # "quiz" (an answer-shaped reply to a quiz question the tutor just asked),
+    # "chat" (greetings, one-word replies to the tutor's clarifying questions such
+    # as "which faculty?") or "explain" (everything else, including asking for a
+    # quiz). Cheap regex heuristics: no model call.
+    words = len((question or "").split())
+    last_tutor = next((m.get("content", "") for m in reversed(list(messages)) if m.get("role") == "assistant"), "")
+    if words <= 12 and _QUIZ_ANSWER_RE.match(question or "") and is_quiz_question(last_tutor):
+        return "quiz"
+    if _GREETING_RE.match(question or "") or (words <= 6 and not _EXPLAIN_RE.search(question or "")):
+        return "chat"
+    return "explain"
+
+
+class EmptyCompletion(Exception):
+    # The model finished without any visible text (e.g. it spent max_tokens reasoning).
+    pass
+
+
+class Route:
+    def __init__(self, model: str, max_tokens: int, deadline: float):
+        self.model = model
+        self.max_tokens = int(max_tokens)
+        self.deadline = float(deadline)
+
+    def __repr__(self) -> str:
+        return f"Route({self.model!r}, max_tokens={self.max_tokens}, deadline={self.deadline:g}s)"
+
+
+# ---------- Latency-aware model router ---------------------------------------------
+class ModelRouter:
+    # Picks model and max_tokens per turn class and keeps a rolling window of
+    # time-to-first-token and errors per model. A model whose recent error rate
+    # or p95 TTFT is over its limits is moved behind its fallbacks; stream()
+    # fails over to the next candidate when one errors or misses the first-token
+    # deadline before anything was shown.
+    def __init__(self, routes=None, deadlines=None, window: int = ROUTER_WINDOW, window_s: float = ROUTER_WINDOW_S,
+                 min_samples: int = ROUTER_MIN_SAMPLES, max_error_rate: float = ROUTER_MAX_ERROR_RATE):
+        self.routes = routes if routes is not None else _load_json_env("LLM_ROUTES", DEFAULT_ROUTES)
+        self.deadlines = deadlines if deadlines is not None else _load_json_env("LLM_DEADLINES", DEFAULT_DEADLINES)
+        self.window = window
+        self.window_s = window_s
+        self.min_samples = min_samples
+        self.max_error_rate = max_error_rate
+        self._lock = threading.Lock()
+        self._samples = {}  # model -> deque of (timestamp, failed 0/1, ttft seconds)
+
+    # ---- stats ----
+    def record(self, model: str, ok: bool, ttft: float = None) -> None:
+        with self._lock:
+            self._samples.setdefault(model, deque(maxlen=self.window)).append(
+                (time.monotonic(), 0 if ok else 1, None if ttft is None else float(ttft))
+            )
+
+    def model_stats(self, model: str) -> dict:
+        cutoff = time.monotonic() - self.window_s
+        with self._lock:
+            recent = [s for s in self._samples.get(model, ()) if s[0] >= cutoff]
+        errors = [s[1] for s in recent]
+        ttft = [s[2] for s in recent if s[2] is not None]
+        out = {"calls": len(errors), "error_rate": (sum(errors) / len(errors)) if errors else 0.0}
+        if ttft:
+            out["ttft_p50"], out["ttft_p95"] = (float(v) for v in np.percentile(ttft, (50, 95)))
+        return out
+
+    def stats(self) -> dict:
+        with self._lock:
+            models = sorted(self._samples)
+        return {m: self.model_stats(m) for m in models}
+
+    def degraded(self, model: str, deadline: float) -> bool:
+        s = self.model_stats(model)
+        if s["calls"] < self.min_samples:
+            return False
+        return s["error_rate"] > self.max_error_rate or s.get("ttft_p95", 0.0) > deadline
+
+    # ---- routing ----
+    def plan(self, turn_class: str):
+        # Candidates for this class, healthy ones first (stable otherwise).
+        candidates = self.routes.get(turn_class) or self.routes["explain"]
+        deadline = float(self.deadlines.get(turn_class, DEFAULT_DEADLINES["explain"]))
+        routes = [Route(model, max_tokens, deadline) for model, max_tokens in candidates]
+        return sorted(routes, key=lambda r: self.degraded(r.model, r.deadline))
+
+    @staticmethod
+    def _elapsed(t0: float, stats: dict) -> float:
+        return max(0.0, time.perf_counter() - t0 - stats.get("queue_s", 0.0))
+
+    def stream(self, plan, start, stats: dict = None):
+        # start(route) returns an iterator of text chunks for that model and must
+        # raise if its first chunk misses route.deadline. Yields from the first
+        # route that produces output; stats["model"] / ["failovers"] say which.
+        # When start() waits in the scheduler queue it records stats["queue_s"],
+        # which is left out of the model's time-to-first-token. A route that ends
+        # without any text counts as failed and the next one is tried.
+        stats = stats if stats is not None else {}
+        stats["failovers"] = 0
+        last_error = None
+        for i, route in enumerate(plan):
+            stats["model"] = route.model
+            stats.pop("queue_s", None)
+            t0 = time.perf_counter()
+            ttft = None
+            try:
+                for chunk in start(route):
+                    if ttft is None:
+                        ttft = self._elapsed(t0, stats)
+                    yield chunk
+                if ttft is None:
+                    raise EmptyCompletion(f"{route.model} returned an empty answer")
+            except (TurnCancelled, TurnTimeout, QueueTimeout):
+                raise
+            except Exception as e:
+                self.record(route.model, ok=False, ttft=ttft if ttft is not None else self._elapsed(t0, stats))
+                if ttft is not None:
+                    raise
+                last_error = e
+                if i + 1 < len(plan):
+                    stats["failovers"] += 1
+                    logging.warning("Model %s failed before its first token (%s); trying %s", route.model, e, plan[i + 1].model)
+                continue
+            self.record(route.model, ok=True, ttft=ttft if ttft is not None else self._elapsed(t0, stats))
+            return
+        if last_error is not None:
+            raise last_error
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_router() -> ModelRouter:
+    # Process-wide, so latency and error windows cover every session.
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = ModelRouter()
+        return _router
@@ -0,0 +1,130 @@
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+
+
+# ---------- Model output -> Streamlit markdown ------------------------------------
+# The same substitutions, in the same order, as the normaliser that used to live
+# in tutor.py, so every answer renders exactly as before (tests/test_output_format.py
+# checks this against a verbatim copy). The patterns are compiled once and a pass
+# is skipped when the tag it rewrites does not occur, which is most of them for a
+# typical answer; plain markdown without "<" or a backslash skips everything. Fenced code
+# blocks are left untouched.
+CODE_FENCE_RE = re.compile(r"```.*?```", re.DOTALL)
+_I, _IS = re.IGNORECASE, re.IGNORECASE | re.DOTALL
+_TR_RE = re.compile(r"<tr[^>]*>(.*?)</tr>", _IS)
+_CELL_RE = re.compile(r"<t[dh][^>]*>(.*?)</t[dh]>", _IS)
+_ANY_TAG_RE = re.compile(r"<[^>]+>")
+_TEX_BLOCK_RE = re.compile(r"\\\[(.*?)\\\]", re.DOTALL)
+_TEX_INLINE_RE = re.compile(r"\\\((.*?)\\\)")
+
+
+def _table_to_md(m) -> str:
+    md_rows, headers = [], []
+    for idx, row in enumerate(_TR_RE.findall(m.group(1))):
+        cells = [_ANY_TAG_RE.sub("", c).strip() for c in _CELL_RE.findall(row)]
+        if idx == 0:
+            headers = cells
+        md_rows.append("| " + " | ".join(cells) + " |")
+    if headers:
+        sep = "| " + " | ".join(["---"] * len(headers)) + " |"
+        return md_rows[0] + "\n" + sep + ("\n" + "\n".join(md_rows[1:]) if len(md_rows) > 1 else "")
+    return "\n".join(md_rows)
+
+
+# (substrings of the lower-cased text that must be present, pattern, replacement)
+_HTML_PASSES = (
+    (("<br",), re.compile(r"<br\s*/?>", _I), "\n"),
+    (("</p>",), re.compile(r"</p>\s*", _I), "\n\n"),
+    (("<p",), re.compile(r"<p[^>]*>", _I), ""),
+    *(
+        ((f"<h{i}",), re.compile(rf"<h{i}[^>]*>(.*?)</h{i}>", _IS), "#" * i + " \\1\n\n")
+        for i in range(6, 0, -1)
+    ),
+    (("<strong>", "<b>"), re.compile(r"<(strong|b)>(.*?)</\1>", _IS), "**\\2**"),
+    (("<em>", "<i>"), re.compile(r"<(em|i)>(.*?)</\1>", _IS), "*\\2*"),
+    (("<pre><code>",), re.compile(r"<pre><code>(.*?)</code></pre>", _IS), "```\n\\1\n```"),
+    (("<code>",), re.compile(r"<code>(.*?)</code>", _IS), "`\\1`"),
+    (("</li>",), re.compile(r"\s*</li>\s*", _I), "\n"),
+    (("<li",), re.compile(r"<li[^>]*>", _I), "- "),
+    (("<ul", "<ol", "</ul", "</ol"), re.compile(r"</?(ul|ol)[^>]*>", _I), "\n"),
+    (("<table",), re.compile(r"<table[^>]*>(.*?)</table>", _IS), _table_to_md),
+    (("<",), _ANY_TAG_RE, ""),
+)
+
+
+def _strip_html(text: str) -> str:
+    lowered = text.lower()
+    for needles, pattern, repl in _HTML_PASSES:
+        if any(n in lowered for n in needles):
+            text, n = pattern.subn(repl, text)
+            if n:
+                lowered = text.lower()
+    return text
+
+
+def strip_html_tags(text: str) -> str:
+    try:
+        return _strip_html(text) if "<" in text else text
+    except Exception:
+        return text
+
+
+def _convert_tex(text: str) -> str:
+    if "\\[" in text:
+        text = _TEX_BLOCK_RE.sub(r"$$\1$$", text)
+    if "\\(" in text:
+        text = _TEX_INLINE_RE.sub(r"$\1$", text)
+    return text.replace("\\n", "\n")
+
+
+def convert_tex_delimiters(text: str) -> str:
+    try:
+        if "\\" not in text:
+            return text
+        if "```" not in text:
+            return _convert_tex(text)
+        out, pos = [], 0
+        for fence in CODE_FENCE_RE.finditer(text):
+            out.append(_convert_tex(text[pos:fence.start()]))
+            out.append(fence.group(0))
+            pos = fence.end()
+        out.append(_convert_tex(text[pos:]))
+        return "".join(out)
+    except Exception:
+        return text
+
+
+def _normalize_uncached(text: str) -> str:
+    out, pos = [], 0
+    for fence in CODE_FENCE_RE.finditer(text):
+        out.append(convert_tex_delimiters(strip_html_tags(text[pos:fence.start()])))
+        out.append(fence.group(0))
+        pos = fence.end()
+    out.append(convert_tex_delimiters(strip_html_tags(text[pos:])))
+    return "".join(out)
+
+
+# ---------- Memoisation by content hash ---------------------------------------------
+_MEMO_SIZE = 4096
+_memo = OrderedDict()
+_memo_lock = threading.Lock()
+
+
+def normalize_model_output(text: str) -> str:
+    # Chat history is re-rendered on every rerun; each distinct message is only
+    # normalised once per process.
+    text = text or ""
+    key = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+    with _memo_lock:
+        hit = _memo.get(key)
+        if hit is not None:
+            _memo.move_to_end(key)
+            return hit
+    out = _normalize_uncached(text)
+    with _memo_lock:
+        _memo[key] = out
+        while len(_memo) > _MEMO_SIZE:
+            _memo.popitem(last=False)
+    return out
@@ -0,0 +1,273 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pymupdf
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from session_store import get_session_store
+from tokens import count_tokens
+
+
+PARALLEL_MIN_PAGES = int(os.environ.get("PDF_PARALLEL_MIN_PAGES", 40))
+PDF_WORKERS = int(os.environ.get("PDF_WORKERS", min(4, os.cpu_count() or 1)))
+PDF_CACHE_ENTRIES = int(os.environ.get("PDF_CACHE_ENTRIES", 32))
+PDF_CACHE_BYTES = int(os.environ.get("PDF_CACHE_BYTES", 64 * 1024 * 1024))
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+# ---------- Page extraction -------------------------------------------------------
+def _extract_range(data: bytes, start: int, stop: int):
+    # Runs in a worker process: PyMuPDF documents are not thread-safe, so every
+    # worker opens its own handle on the same bytes.
+    with pymupdf.open(stream=data, filetype="pdf") as doc:
+        return [doc[i].get_text("text") for i in range(start, stop)]
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=PDF_WORKERS)
+        return _pool
+
+
+def extract_pages(data: bytes, workers: int = PDF_WORKERS, min_parallel_pages: int = PARALLEL_MIN_PAGES):
+    with pymupdf.open(stream=data, filetype="pdf") as doc:
+        n = doc.page_count
+        if workers <= 1 or n < min_parallel_pages:
+            return [page.get_text("text") for page in doc]
+    step = -(-n // workers)
+    ranges = [(i, min(i + step, n)) for i in range(0, n, step)]
+    try:
+        pool = _get_pool()
+        futures = [pool.submit(_extract_range, data, a, b) for a, b in ranges]
+        pages = []
+        for f in futures:
+            pages.extend(f.result())
+        return pages
+    except Exception as e:
+        logging.warning("Parallel PDF extraction failed, falling back to sequential: %s", e)
+        return _extract_range(data, 0, n)
+
+
+# ---------- Content-addressed LRU cache -------------------------------------------
+class PdfPageCache:
+    # Maps content hash -> list of page texts, evicting least recently used
+    # documents once either the entry count or the total text size is exceeded.
+    def __init__(self, max_entries: int = PDF_CACHE_ENTRIES, max_bytes: int = PDF_CACHE_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _size(pages) -> int:
+        return sum(len(p) for p in pages)
+
+    def get(self, key):
+        with self._lock:
+            pages = self._items.get(key)
+            if pages is not None:
+                self._items.move_to_end(key)
+            return pages
+
+    def put(self, key, pages) -> None:
+        size = self._size(pages)
+        with self._lock:
+            if key in self._items:
+                self._bytes -= self._size(self._items.pop(key))
+            if size > self.max_bytes:
+                return
+            self._items[key] = pages
+            self._bytes += size
+            while self._items and (len(self._items) > self.max_entries or self._bytes > self.max_bytes):
+                _, old = self._items.popitem(last=False)
+                self._bytes -= self._size(old)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    @property
+    def nbytes(self) -> int:
+        return self._bytes
+
+
+_page_cache = PdfPageCache()
+
+
+def _spill(kind: str, key: str, obj) -> None:
+    try:
+        store = get_session_store()
+        if not store.has_blob(kind, key):
+            store.put_blob(kind, key, obj)
+    except Exception as e:
+        logging.warning("Could not write %s %s to the session store: %s", kind, key[:12], e)
+
+
+def _unspill(kind: str, key: str):
+    try:
+        return get_session_store().get_blob(kind, key)
+    except Exception as e:
+        logging.warning("Could not read %s %s from the session store: %s", kind, key[:12], e)
+        return None
+
+
+def get_pdf_pages(data: bytes, key: str = None):
+    # Returns (content_hash, pages); repeat uploads of the same file, from any
+    # session, skip extraction entirely. The pages are also written to the
+    # session store, so sessions keep only the hash (see load_pdf_pages).
+    key = key or content_hash(data)
+    pages = _page_cache.get(key)
+    if pages is None:
+        # Stored as a tuple: cached pages are shared between sessions.
+        pages = tuple(extract_pages(data))
+        _page_cache.put(key, pages)
+        _spill("pdf_pages", key, pages)
+    return key, pages
+
+
+def load_pdf_pages(key: str):
+    # Pages for a hash returned by get_pdf_pages: from memory while cached,
+    # otherwise from the session store's disk copy. None if neither has it.
+    pages = _page_cache.get(key)
+    if pages is None:
+        pages = _unspill("pdf_pages", key)
+        if pages is not None:
+            _page_cache.put(key, pages)
+    return pages
+
+
+# ---------- Chunked retrieval over an uploaded PDF -------------------------------
+PDF_CHUNK_CHARS = int(os.environ.get("PDF_CHUNK_CHARS", 1200))
+PDF_CHUNK_OVERLAP = int(os.environ.get("PDF_CHUNK_OVERLAP", 200))
+PDF_CONTEXT_TOKENS = int(os.environ.get("PDF_CONTEXT_TOKENS", 1500))
+_PARA_RE = re.compile(r"\n\s*\n")
+
+
+def chunk_pages(pages, chunk_chars: int = PDF_CHUNK_CHARS, overlap: int = PDF_CHUNK_OVERLAP):
+    # Packs paragraphs into ~chunk_chars pieces without crossing page boundaries;
+    # each chunk starts with the last `overlap` characters of the previous one.
+    # Returns a list of (page_no, text) tuples, page numbers starting at 1.
+    step = max(1, chunk_chars - overlap)
+    chunks = []
+    for page_no, text in enumerate(pages, start=1):
+        units = []
+        for para in _PARA_RE.split(text or ""):
+            para = para.strip()
+            if len(para) <= chunk_chars:
+                units.extend([para] if para else [])
+            else:
+                units.extend(para[i:i + chunk_chars] for i in range(0, len(para) - overlap, step))
+        buf, tail = "", ""
+        for unit in units:
+            if buf and len(buf) + len(unit) + 1 > chunk_chars:
+                chunks.append((page_no, (tail + "\n" + buf).strip()))
+                tail = buf[-overlap:] if overlap else ""
+                buf = ""
+            buf = buf + "\n" + unit if buf else unit
+        if buf:
+            chunks.append((page_no, (tail + "\n" + buf).strip()))
+    return chunks
+
+
+class PdfChunkIndex:
+    # TF-IDF index over one document's chunks; fitted per document because the
+    # shipped course vectorizer's vocabulary does not cover arbitrary readings.
+    def __init__(self, pages, chunk_chars: int = PDF_CHUNK_CHARS, overlap: int = PDF_CHUNK_OVERLAP):
+        self.chunks = chunk_pages(pages, chunk_chars, overlap)
+        self.vectorizer = None
+        self.matrix = None
+        if not self.chunks:
+            return
+        try:
+            self.vectorizer = TfidfVectorizer(stop_words="english", sublinear_tf=True)
+            self.matrix = self.vectorizer.fit_transform([c[1] for c in self.chunks]).tocsr()
+        except ValueError:
+            # Empty vocabulary (e.g. a scanned PDF with only stop words/numbers).
+            self.vectorizer = None
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    def top_chunks(self, question: str, token_budget: int = PDF_CONTEXT_TOKENS):
+        # Returns chunk ids ranked by relevance and trimmed to the token budget.
+        if not self.chunks:
+            return []
+        if self.vectorizer is not None:
+            q = self.vectorizer.transform([question or ""])
+            scores = (self.matrix @ q.T).toarray().ravel()
+        else:
+            scores = np.zeros(len(self.chunks))
+        # With no term overlap, fall back to document order (the old truncation behaviour).
+        if scores.any():
+            order = [i for i in np.argsort(-scores, kind="stable") if scores[i] > 0]
+        else:
+            order = range(len(self.chunks))
+        picked, used = [], 0
+        for i in order:
+            cost = count_tokens(self.chunks[i][1])
+            if used + cost > token_budget:
+                if picked:
+                    continue
+                # Always include at least the best chunk, cut to fit.
+                picked.append(int(i))
+                break
+            picked.append(int(i))
+            used += cost
+        return picked
+
+    def context_for(self, question: str, token_budget: int = PDF_CONTEXT_TOKENS):
+        # Returns (context text, chunk ids); chunks are emitted in document order
+        # with page markers so the tutor can cite them.
+        ids = self.top_chunks(question, token_budget)
+        parts = []
+        for i in sorted(ids):
+            page_no, text = self.chunks[i]
+            parts.append(f"[Page {page_no}]\n{text[: token_budget * 4]}")
+        return "\n\n".join(parts), ids
+
+
+_chunk_indexes = OrderedDict()
+_chunk_lock = threading.Lock()
+PDF_INDEX_ENTRIES = int(os.environ.get("PDF_INDEX_ENTRIES", 16))
+
+
+def get_pdf_chunk_index(key: str, pages=None) -> PdfChunkIndex:
+    # Indexes pushed out of memory are spilled to the session store and loaded
+    # back from there instead of being refitted. `pages` defaults to
+    # load_pdf_pages(key) and is only needed when the index has to be built.
+    with _chunk_lock:
+        index = _chunk_indexes.get(key)
+        if index is not None:
+            _chunk_indexes.move_to_end(key)
+            return index
+    index = _unspill("pdf_index", key)
+    if index is None:
+        pages = pages if pages is not None else load_pdf_pages(key)
+        if pages is None:
+            # Text gone from memory and disk (e.g. evicted): nothing to cache, so a
+            # later call with the pages re-extracted can still build the index.
+            return PdfChunkIndex(())
+        index = PdfChunkIndex(pages)
+    evicted = []
+    with _chunk_lock:
+        _chunk_indexes[key] = index
+        while len(_chunk_indexes) > PDF_INDEX_ENTRIES:
+            evicted.append(_chunk_indexes.popitem(last=False))
+    for old_key, old_index in evicted:
+        _spill("pdf_index", old_key, old_index)
+    return index
@@ -0,0 +1,214 @@
+import logging
+import os
+
+import numpy as np
+import scipy.sparse as sp
+
+
+# Exact search stays the default: at catalogue sizes (20k rows) IVF with
+# nprobe=16 reaches ~0.96 recall at about the same latency as a full CSR scan
+# (benchmarks/bench_retrieval.py), so it only pays off on much larger corpora.
+RAG_BACKEND = os.environ.get("RAG_BACKEND", "exact").strip().lower()  # "exact", "ivf"
+RAG_IVF_NLIST = int(os.environ.get("RAG_IVF_NLIST", 0))  # 0 = about sqrt(rows)
+RAG_IVF_NPROBE = int(os.environ.get("RAG_IVF_NPROBE", 8))
+# Below this many rows a full scan is cheap enough that IVF is not built at all.
+RAG_IVF_MIN_ROWS = int(os.environ.get("RAG_IVF_MIN_ROWS", 5000))
+IVF_FILE = "ivf.npz"
+
+
+def top_k(scores: np.ndarray, k: int):
+    # (q, n) scores -> (indices, scores), each (q, k), best first.
+    n = scores.shape[1]
+    if k < n:
+        part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        part = np.broadcast_to(np.arange(n), (scores.shape[0], n))
+    part_scores = np.take_along_axis(scores, part, axis=1)
+    order = np.argsort(-part_scores, axis=1, kind="stable")
+    return np.take_along_axis(part, order, axis=1), np.take_along_axis(part_scores, order, axis=1)
+
+
+def scores(matrix, queries) -> np.ndarray:
+    # Cosine scores (q, n) of normalised queries against normalised rows. For a
+    # CSR corpus the (few, short) queries are expanded to dense vectors so each
+    # row's score is one sparse dot product over its non-zeros; that CSR
+    # mat-vec is several times faster than a sparse x sparse product.
+    if sp.issparse(matrix):
+        return np.asarray(matrix @ _dense(queries).T).T
+    out = queries @ matrix.T
+    return out.toarray() if sp.issparse(out) else np.asarray(out)
+
+
+def _dense(x) -> np.ndarray:
+    return x.toarray() if sp.issparse(x) else np.asarray(x)
+
+
+# ---------- Retrieval backends ------------------------------------------------------
+# A backend ranks the rows of EmbeddingIndex.matrix (L2-normalised float32 CSR) for
+# L2-normalised queries. It may keep auxiliary structures, which the index asks
+# it to refresh whenever rows change and which can be persisted next to the
+# embedding snapshot.
+class ExactBackend:
+    name = "exact"
+
+    def ensure(self, matrix) -> None:
+        pass
+
+    def update(self, matrix, positions) -> None:
+        pass
+
+    def search(self, matrix, queries, k: int):
+        return top_k(scores(matrix, queries), k)
+
+    def save(self, path: str) -> None:
+        pass
+
+    def load(self, path: str, matrix) -> bool:
+        return True
+
+
+class IVFBackend:
+    # Inverted-file index: rows are clustered with spherical k-means and a query
+    # only scores the rows of its `nprobe` closest clusters. Lists are stored as
+    # one row order plus offsets (CSR style), so probing is a few slices.
+    name = "ivf"
+
+    def __init__(self, nlist: int = RAG_IVF_NLIST, nprobe: int = RAG_IVF_NPROBE,
+                 min_rows: int = RAG_IVF_MIN_ROWS, iters: int = 10, seed: int = 0):
+        self.nlist = nlist
+        self.nprobe = max(1, nprobe)
+        self.min_rows = min_rows
+        self.iters = iters
+        self.seed = seed
+        # (centroids, assign, order, offsets), swapped as one tuple so concurrent
+        # searches never see a half-updated index; None means "scan everything".
+        self._state = None
+
+    # ---- build / maintain ----
+    def _assign(self, rows, centroids, block: int = 8192) -> np.ndarray:
+        out = np.empty(rows.shape[0], dtype=np.int32)
+        for start in range(0, rows.shape[0], block):
+            out[start:start + block] = np.argmax(scores(centroids, rows[start:start + block]), axis=1)
+        return out
+
+    @staticmethod
+    def _lists(assign: np.ndarray, nlist: int):
+        order = np.argsort(assign, kind="stable").astype(np.int64)
+        offsets = np.zeros(nlist + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assign, minlength=nlist), out=offsets[1:])
+        return order, offsets
+
+    def build(self, matrix) -> None:
+        n = matrix.shape[0]
+        if n < max(self.min_rows, 1):
+            self._state = None
+            return
+        nlist = self.nlist or int(np.sqrt(n))
+        nlist = max(1, min(nlist, n))
+        rng = np.random.default_rng(self.seed)
+        sample = matrix[np.sort(rng.choice(n, size=min(n, 64 * nlist), replace=False))]
+        centroids = _dense(sample[rng.choice(sample.shape[0], size=nlist, replace=False)]).astype(np.float32)
+        for _ in range(self.iters):
+            labels = self._assign(sample, centroids)
+            # Per-cluster row sums as one sparse (nlist x sample) product.
+            members = sp.csr_matrix(
+                (np.ones(len(labels), dtype=np.float32), (labels, np.arange(len(labels)))),
+                shape=(nlist, sample.shape[0]),
+            )
+            sums = _dense(members @ sample).astype(np.float32)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            empty = norms[:, 0] == 0
+            # Re-seed empty clusters from random sample rows.
+            sums[empty] = _dense(sample[rng.choice(sample.shape[0], size=int(empty.sum()))])
+            norms[empty] = 1.0
+            centroids = (sums / norms).astype(np.float32)
+        assign = self._assign(matrix, centroids)
+        self._state = (centroids, assign) + self._lists(assign, nlist)
+        logging.info("Built IVF index: %d rows in %d lists", n, nlist)
+
+    def ensure(self, matrix) -> None:
+        state = self._state
+        if state is None:
+            if matrix.shape[0] >= self.min_rows:
+                self.build(matrix)
+        elif state[1].shape[0] != matrix.shape[0] or state[0].shape[1] != matrix.shape[1]:
+            self.build(matrix)
+
+    def update(self, matrix, positions) -> None:
+        # Re-assigns changed/appended rows to their nearest existing centroid;
+        # centroids are only retrained on a full build.
+        state = self._state
+        if state is None:
+            self.ensure(matrix)
+            return
+        centroids, assign = state[0], state[1]
+        if assign.shape[0] < matrix.shape[0]:
+            assign = np.concatenate([assign, np.zeros(matrix.shape[0] - assign.shape[0], dtype=np.int32)])
+        else:
+            assign = assign.copy()
+        positions = np.asarray(positions, dtype=np.int64)
+        if positions.size:
+            assign[positions] = self._assign(matrix[positions], centroids)
+        self._state = (centroids, assign) + self._lists(assign, centroids.shape[0])
+
+    # ---- query ----
+    def search(self, matrix, queries, k: int):
+        state = self._state
+        n = matrix.shape[0]
+        if state is None or state[1].shape[0] != n:
+            return top_k(scores(matrix, queries), k)
+        centroids, _, order, offsets = state
+        nprobe = min(self.nprobe, centroids.shape[0])
+        probes = top_k(scores(centroids, queries), nprobe)[0]
+        out_idx = np.zeros((queries.shape[0], k), dtype=np.int64)
+        out_scores = np.full((queries.shape[0], k), -np.inf, dtype=np.float32)
+        for qi, lists in enumerate(probes):
+            cand = np.concatenate([order[offsets[c]:offsets[c + 1]] for c in lists])
+            if cand.size < k:
+                # Too few rows in the probed lists: fall back to a full scan.
+                idx, sc = top_k(scores(matrix, queries[qi:qi + 1]), k)
+            else:
+                idx, sc = top_k(scores(matrix[cand], queries[qi:qi + 1]), k)
+                idx = cand[idx]
+            out_idx[qi], out_scores[qi] = idx[0], sc[0]
+        return out_idx, out_scores
+
+    # ---- persistence ----
+    def save(self, path: str) -> None:
+        state = self._state
+        target = os.path.join(path, IVF_FILE)
+        if state is None:
+            if os.path.exists(target):
+                os.remove(target)
+            return
+        tmp = target + ".tmp.npz"
+        np.savez(tmp, centroids=state[0], assign=state[1])
+        os.replace(tmp, target)
+
+    def load(self, path: str, matrix) -> bool:
+        # Reuses the persisted clustering when it matches the snapshot matrix.
+        target = os.path.join(path, IVF_FILE)
+        if not os.path.exists(target):
+            return False
+        try:
+            with np.load(target) as data:
+                centroids = data["centroids"].astype(np.float32, copy=False)
+                assign = data["assign"].astype(np.int32, copy=False)
+        except Exception as e:
+            logging.warning("Ignoring unreadable IVF index at %s: %s", target, e)
+            return False
+        if assign.shape[0] != matrix.shape[0] or centroids.shape[1] != matrix.shape[1]:
+            return False
+        self._state = (centroids, assign) + self._lists(assign, centroids.shape[0])
+        return True
+
+
+BACKENDS = {"exact": ExactBackend, "ivf": IVFBackend}
+
+
+def make_backend(name: str = RAG_BACKEND, **kwargs):
+    cls = BACKENDS.get(name)
+    if cls is None:
+        logging.warning("Unknown RAG_BACKEND %r, using exact search", name)
+        cls = ExactBackend
+    return cls(**kwargs)
@@ -0,0 +1,193 @@
+import os
+import re
+import threading
+
+import numpy as np
+from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+
+from rag_backends import scores, top_k
+from rag_index import _l2_normalize_rows, to_csr
+
+
+RAG_BM25_WEIGHT = float(os.environ.get("RAG_BM25_WEIGHT", 0.5))  # 0 = TF-IDF only, 1 = BM25 only
+RAG_BM25_MAX_POSTINGS = int(os.environ.get("RAG_BM25_MAX_POSTINGS", 2000))
+RAG_HYBRID_CANDIDATES = int(os.environ.get("RAG_HYBRID_CANDIDATES", 50))
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+# UFS module codes look like "MPRS2613": four letters and four digits.
+MODULE_CODE_RE = re.compile(r"\b([A-Za-z]{4}\d{4})\b")
+
+
+def tokenize(text: str):
+    return [t for t in _TOKEN_RE.findall((text or "").lower()) if t not in ENGLISH_STOP_WORDS]
+
+
+def module_codes(text: str):
+    return sorted({m.upper() for m in MODULE_CODE_RE.findall(text or "")})
+
+
+# ---------- BM25 inverted index over course descriptions ---------------------------
+class BM25Index:
+    # Postings for all terms live in three flat arrays (docs, impacts, offsets).
+    # Each posting stores its precomputed BM25 term score ("impact"), and every
+    # list is sorted by impact, so pruning a long list is just a shorter slice
+    # and a query only ever touches documents that contain one of its terms.
+    def __init__(self, descriptions, metadata=None, k1: float = 1.2, b: float = 0.75,
+                 max_postings: int = RAG_BM25_MAX_POSTINGS):
+        self.max_postings = max_postings
+        self.n_docs = len(descriptions)
+        self.vocab = {}
+        term_ids, doc_ids, tfs = [], [], []
+        doc_len = np.zeros(self.n_docs, dtype=np.float32)
+        for d, text in enumerate(descriptions):
+            counts = {}
+            for tok in tokenize(text):
+                counts[tok] = counts.get(tok, 0) + 1
+            doc_len[d] = sum(counts.values())
+            for tok, tf in counts.items():
+                term_ids.append(self.vocab.setdefault(tok, len(self.vocab)))
+                doc_ids.append(d)
+                tfs.append(tf)
+        terms = np.asarray(term_ids, dtype=np.int64)
+        docs = np.asarray(doc_ids, dtype=np.int32)
+        tf = np.asarray(tfs, dtype=np.float32)
+        df = np.bincount(terms, minlength=len(self.vocab)).astype(np.float32)
+        idf = np.log1p((self.n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+        avgdl = float(doc_len.mean()) if self.n_docs else 1.0
+        norm = k1 * (1.0 - b + b * doc_len[docs] / max(avgdl, 1e-9))
+        impact = idf[terms] * tf * (k1 + 1.0) / (tf + norm)
+        order = np.lexsort((-impact, terms))
+        self.post_docs = docs[order]
+        self.post_impact = impact[order].astype(np.float32)
+        self.offsets = np.zeros(len(self.vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(terms, minlength=len(self.vocab)), out=self.offsets[1:])
+        self._build_metadata(descriptions, metadata)
+
+    def _build_metadata(self, descriptions, metadata) -> None:
+        # field -> value -> sorted doc positions. "module" is also read from the
+        # module codes that appear in the description itself.
+        fields = {}
+        for d, text in enumerate(descriptions):
+            meta = dict((metadata[d] if metadata is not None else None) or {})
+            values = {k: [v] for k, v in meta.items() if v is not None}
+            codes = module_codes(text)
+            if codes:
+                values.setdefault("module", []).extend(codes)
+            for field, vals in values.items():
+                for v in vals:
+                    fields.setdefault(field, {}).setdefault(str(v).strip().upper(), []).append(d)
+        self.fields = {f: {v: np.asarray(ds, dtype=np.int32) for v, ds in vals.items()} for f, vals in fields.items()}
+
+    def filter_mask(self, filters):
+        # filters: {"faculty": "Law", "module": ["MPRS2613", ...]}; values within a
+        # field are OR-ed, fields are AND-ed. None means "no filter".
+        if not filters:
+            return None
+        mask = np.ones(self.n_docs, dtype=bool)
+        for field, wanted in filters.items():
+            wanted = [wanted] if isinstance(wanted, str) else list(wanted or [])
+            if not wanted:
+                continue
+            allowed = np.zeros(self.n_docs, dtype=bool)
+            for v in wanted:
+                docs = self.fields.get(field, {}).get(str(v).strip().upper())
+                if docs is not None:
+                    allowed[docs] = True
+            mask &= allowed
+        return mask
+
+    def search(self, query: str, k: int = RAG_HYBRID_CANDIDATES, mask=None):
+        # Returns (doc positions, BM25 scores), best first, over candidates only.
+        slices_docs, slices_imp = [], []
+        for tok in set(tokenize(query)):
+            t = self.vocab.get(tok)
+            if t is None:
+                continue
+            start, end = self.offsets[t], self.offsets[t + 1]
+            end = min(end, start + self.max_postings)
+            slices_docs.append(self.post_docs[start:end])
+            slices_imp.append(self.post_impact[start:end])
+        if not slices_docs:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        docs = np.concatenate(slices_docs)
+        imp = np.concatenate(slices_imp)
+        if mask is not None:
+            keep = mask[docs]
+            docs, imp = docs[keep], imp[keep]
+            if not docs.size:
+                return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        cand, inv = np.unique(docs, return_inverse=True)
+        sc = np.bincount(inv, weights=imp).astype(np.float32)
+        idx, best = top_k(sc[None, :], min(k, cand.size))
+        return cand[idx[0]].astype(np.int64), best[0]
+
+
+# ---------- Hybrid BM25 + TF-IDF retrieval -----------------------------------------
+class HybridRetriever:
+    # BM25 proposes candidates from the inverted index; only those rows get a
+    # TF-IDF cosine, and the two are fused as
+    #   weight * bm25 / max(bm25) + (1 - weight) * cosine.
+    # When BM25 finds fewer than k candidates (no shared terms) the TF-IDF top
+    # hits are added so the student still gets context. `vectorizer` is the one
+    # the index was checked against; query vectors must come from it.
+    def __init__(self, index, weight: float = RAG_BM25_WEIGHT, candidates: int = RAG_HYBRID_CANDIDATES,
+                 vectorizer=None):
+        self.index = index
+        self.vectorizer = vectorizer
+        self.weight = min(max(weight, 0.0), 1.0)
+        self.candidates = candidates
+        self._state = None  # (index version, BM25Index), swapped as one reference
+        self._lock = threading.Lock()
+
+    def refresh(self) -> BM25Index:
+        # Rebuilds BM25 when the index has been upserted since the last build and
+        # swaps it in. Meant for the warm-up and sync threads: searches keep using
+        # the previous build meanwhile, and rows it does not know yet are still
+        # reachable through the TF-IDF fallback in search().
+        with self._lock:
+            version = self.index.version
+            state = self._state
+            if state is None or state[0] != version:
+                state = (version, BM25Index(list(self.index.descriptions), list(self.index.metadata)))
+                self._state = state
+            return state[1]
+
+    def bm25(self) -> BM25Index:
+        # The latest build; only the very first call builds it inline.
+        state = self._state
+        return state[1] if state is not None else self.refresh()
+
+    def search(self, question: str, query_vec, k: int = 5, filters=None):
+        index = self.index
+        matrix = index.matrix
+        if not matrix.shape[0] or k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        bm25 = self.bm25()
+        mask = bm25.filter_mask(filters)
+        if mask is not None and mask.shape[0] != matrix.shape[0]:
+            mask = None
+        cand, bm = bm25.search(question, max(self.candidates, k), mask=mask)
+        q = _l2_normalize_rows(to_csr(query_vec)) if query_vec is not None else None
+        if cand.size < k and q is not None:
+            extra, _ = index.search(q, max(self.candidates, k))
+            extra = extra[0]
+            if mask is not None:
+                extra = extra[mask[extra]]
+            extra = extra[~np.isin(extra, cand)]
+            cand = np.concatenate([cand, extra])
+            bm = np.concatenate([bm, np.zeros(extra.size, dtype=np.float32)])
+        if not cand.size:
+            return cand, bm
+        cos = scores(matrix[cand], q)[0] if q is not None else np.zeros(cand.size, dtype=np.float32)
+        top = float(bm.max()) if bm.size else 0.0
+        fused = self.weight * (bm / top if top > 0 else bm) + (1.0 - self.weight) * cos
+        idx, best = top_k(fused[None, :], min(k, cand.size))
+        return cand[idx[0]], best[0]
+
+    def top_rows(self, question: str, query_vec, k: int = 5, filters=None):
+        # [(row id, description), ...], best first. A filter that matches nothing
+        # is dropped rather than leaving the prompt without course context.
+        idx, _ = self.search(question, query_vec, k, filters)
+        if filters and not idx.size:
+            idx, _ = self.search(question, query_vec, k)
+        return [(self.index.ids[i], self.index.descriptions[i]) for i in idx]
@@ -0,0 +1,150 @@
+import threading
+
+import numpy as np
+import scipy.sparse as sp
+
+from rag_backends import make_backend
+
+
+# ---------- Sparse retrieval index over course_embeddings ------------------------
+def _l2_normalize_rows(mat):
+    # Works for dense arrays and CSR matrices; all-zero rows are left as zeros.
+    if sp.issparse(mat):
+        mat = sp.csr_matrix(mat, dtype=np.float32)
+        norms = np.sqrt(np.asarray(mat.multiply(mat).sum(axis=1)).ravel())
+        norms[norms == 0] = 1.0
+        return sp.csr_matrix(sp.diags((1.0 / norms).astype(np.float32)) @ mat, dtype=np.float32)
+    mat = np.asarray(mat, dtype=np.float32)
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return mat / norms
+
+
+def to_csr(embeddings) -> sp.csr_matrix:
+    # Dense rows (as parsed from Supabase; zeros are not stored) or any scipy
+    # matrix -> float32 CSR. A float32 CSR input, e.g. a memory-mapped snapshot,
+    # is returned without copying.
+    if sp.issparse(embeddings):
+        return sp.csr_matrix(embeddings, dtype=np.float32)
+    arr = np.asarray(embeddings, dtype=np.float32)
+    if arr.size == 0:
+        arr = arr.reshape(0, arr.shape[-1] if arr.ndim == 2 else 0)
+    elif arr.ndim == 1:
+        arr = arr.reshape(1, -1)
+    return sp.csr_matrix(arr)
+
+
+class EmbeddingIndex:
+    # TF-IDF rows are mostly zeros, so they are stored once as an L2-normalised
+    # float32 CSR matrix and cosine similarity for a query is one sparse product.
+    # normalized=True trusts the rows are already unit length (e.g. a memory-mapped
+    # snapshot) and keeps the matrix as-is instead of copying it. Ranking is done
+    # by a pluggable backend (exact scan or IVF, see rag_backends.py). `metadata`
+    # holds an optional dict per row (e.g. faculty) used for retrieval filters.
+    def __init__(self, embeddings, descriptions=None, ids=None, normalized: bool = False, backend=None,
+                 metadata=None):
+        mat = to_csr(embeddings)
+        self.matrix = mat if normalized else _l2_normalize_rows(mat)
+        n = self.matrix.shape[0]
+        self.descriptions = list(descriptions) if descriptions is not None else [""] * n
+        self.ids = list(ids) if ids is not None else list(range(n))
+        self.metadata = [dict(m or {}) for m in metadata] if metadata is not None else [{} for _ in range(n)]
+        if len(self.descriptions) != n or len(self.ids) != n or len(self.metadata) != n:
+            raise ValueError("descriptions/ids/metadata must have one entry per embedding row")
+        # Bumped on every upsert so derived structures (e.g. the BM25 index) know to rebuild.
+        self.version = 0
+        self._pos = {rid: i for i, rid in enumerate(self.ids)}
+        self._lock = threading.Lock()
+        self.backend = backend if backend is not None else make_backend()
+        self.backend.ensure(self.matrix)
+
+    @classmethod
+    def from_frame(cls, df, embedding_col: str = "embedding", text_col: str = "course_description", id_col: str = "id"):
+        if df is None or df.empty or embedding_col not in df.columns:
+            return cls(np.zeros((0, 0), dtype=np.float32))
+        mat = sp.vstack([to_csr(v) for v in df[embedding_col].values])
+        descriptions = df[text_col].fillna("").astype(str).tolist() if text_col in df.columns else None
+        ids = df[id_col].tolist() if id_col in df.columns else None
+        return cls(mat, descriptions=descriptions, ids=ids)
+
+    @classmethod
+    def from_snapshot(cls, matrix, meta, path: str = None, backend=None):
+        # With `path`, a backend index persisted next to the snapshot is reused
+        # instead of being rebuilt.
+        backend = backend if backend is not None else make_backend()
+        if path:
+            backend.load(path, matrix)
+        return cls(
+            matrix, descriptions=meta.get("descriptions"), ids=meta.get("ids"), normalized=True, backend=backend,
+            metadata=meta.get("metadata"),
+        )
+
+    def __len__(self) -> int:
+        return self.matrix.shape[0]
+
+    @property
+    def dim(self) -> int:
+        return self.matrix.shape[1]
+
+    def upsert(self, embeddings, descriptions, ids, metadata=None) -> int:
+        # Folds changed rows into the index: existing ids are replaced, new ids are
+        # appended. A new matrix is assembled and swapped in, so readers (and a
+        # memory-mapped snapshot) keep using the old one untouched.
+        new = to_csr(embeddings)
+        if new.shape[0] == 0:
+            return 0
+        new = _l2_normalize_rows(new)
+        metadata = metadata if metadata is not None else [{} for _ in ids]
+        with self._lock:
+            if len(self) and new.shape[1] != self.dim:
+                raise ValueError(f"upsert dim {new.shape[1]} does not match index dim {self.dim}")
+            base = self.matrix if len(self) else sp.csr_matrix((0, new.shape[1]), dtype=np.float32)
+            n = base.shape[0]
+            updates = [(self._pos[rid], row) for row, rid in enumerate(ids) if rid in self._pos]
+            appends = [row for row, rid in enumerate(ids) if rid not in self._pos]
+            # Row selection over [old rows; new rows]: updated positions point at
+            # their replacement, appended rows go at the end.
+            take = np.arange(n + len(appends), dtype=np.int64)
+            for pos, row in updates:
+                take[pos] = n + row
+                self.descriptions[pos] = descriptions[row]
+                self.metadata[pos] = dict(metadata[row] or {})
+            take[n:] = [n + row for row in appends]
+            mat = sp.vstack([base, new], format="csr", dtype=np.float32)[take]
+            for row in appends:
+                self._pos[ids[row]] = len(self.ids)
+                self.ids.append(ids[row])
+                self.descriptions.append(descriptions[row])
+                self.metadata.append(dict(metadata[row] or {}))
+            self.matrix = mat
+            self.version += 1
+            self.backend.update(mat, [pos for pos, _ in updates] + [self._pos[ids[row]] for row in appends])
+        return len(updates) + len(appends)
+
+    def search(self, queries, k: int = 5):
+        # Accepts one query vector or a (q, dim) batch, dense or sparse (e.g. the
+        # vectorizer's transform output as-is); returns (indices, scores), each
+        # shaped (q, k) and sorted by descending cosine similarity.
+        q = to_csr(queries)
+        matrix = self.matrix
+        n = matrix.shape[0]
+        k = max(0, min(int(k), n))
+        if k == 0:
+            empty = np.zeros((q.shape[0], 0))
+            return empty.astype(np.int64), empty.astype(np.float32)
+        if q.shape[1] != matrix.shape[1]:
+            raise ValueError(f"query dim {q.shape[1]} does not match index dim {matrix.shape[1]}")
+        return self.backend.search(matrix, _l2_normalize_rows(q), k)
+
+    def save_backend(self, path: str) -> None:
+        self.backend.save(path)
+
+    def top_rows(self, query, k: int = 5):
+        # [(row id, description), ...] for a single query, best first.
+        idx, _ = self.search(query, k)
+        if idx.shape[1] == 0:
+            return []
+        return [(self.ids[i], self.descriptions[i]) for i in idx[0]]
+
+    def top_descriptions(self, query, k: int = 5):
+        return [desc for _, desc in self.top_rows(query, k)]
@@ -0,0 +1,176 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+import joblib
+import numpy as np
+import scipy.sparse as sp
+
+
+VECTORIZER_PATH = "tfidf_vectorizer.joblib"
+SNAPSHOT_DIR = "rag_snapshot"
+SNAPSHOT_MATRIX = "embeddings.npy"  # dense layout written by older versions
+SNAPSHOT_CSR = ("csr_data.npy", "csr_indices.npy", "csr_indptr.npy")
+SNAPSHOT_META = "meta.json"
+SNAPSHOT_VECTORIZER = "vectorizer.joblib"  # written by build_rag.py next to the matrix
+
+
+# ---------- Process-wide TF-IDF vectorizer cache ---------------------------------
+# Streamlit re-executes tutor.py on every interaction, but imported modules live
+# for the whole process, so this cache is shared by every session and worker
+# thread. Entries are keyed by (path, mmap_mode) and reloaded only when the
+# file's mtime changes.
+_vectorizer_lock = threading.Lock()
+_vectorizer_cache = {}
+
+
+def load_vectorizer(path: str = VECTORIZER_PATH, mmap_mode=None):
+    # mmap_mode="r" lets joblib map the vectorizer's numpy arrays read-only, so
+    # several Streamlit worker processes share the same pages instead of each
+    # holding a private copy (only effective for uncompressed joblib dumps).
+    full = os.path.abspath(path)
+    mtime = os.path.getmtime(full)
+    key = (full, mmap_mode)
+    with _vectorizer_lock:
+        hit = _vectorizer_cache.get(key)
+        if hit is not None and hit[0] == mtime:
+            return hit[1]
+        vectorizer = joblib.load(full, mmap_mode=mmap_mode)
+        _vectorizer_cache[key] = (mtime, vectorizer)
+        if hit is not None:
+            logging.info("Reloaded TF-IDF vectorizer from %s (mtime changed)", full)
+        return vectorizer
+
+
+def clear_vectorizer_cache() -> None:
+    with _vectorizer_lock:
+        _vectorizer_cache.clear()
+
+
+def vectorizer_path(snapshot_dir: str = None) -> str:
+    # A snapshot built by build_rag.py carries its own vectorizer, which is the
+    # only one guaranteed to match its rows; otherwise use the repo-level file.
+    candidate = os.path.join(snapshot_dir or SNAPSHOT_DIR, SNAPSHOT_VECTORIZER)
+    return candidate if os.path.exists(candidate) else VECTORIZER_PATH
+
+
+# ---------- Vectorizer / corpus version check --------------------------------------
+class SnapshotMismatch(ValueError):
+    pass
+
+
+def vectorizer_fingerprint(vectorizer) -> str:
+    # Identifies a fitted vectorizer by its vocabulary and idf weights, so a
+    # corpus can record which vectorizer produced it.
+    h = hashlib.sha256()
+    h.update(json.dumps(sorted(vectorizer.vocabulary_.items())).encode("utf-8"))
+    idf = getattr(vectorizer, "idf_", None)
+    if idf is not None:
+        h.update(np.ascontiguousarray(idf, dtype=np.float64).tobytes())
+    return h.hexdigest()[:16]
+
+
+def check_vectorizer(vectorizer, dim: int, version: str = None) -> None:
+    # Raises SnapshotMismatch when query vectors from `vectorizer` cannot be
+    # compared with a corpus of width `dim` built by vectorizer `version`.
+    n_terms = len(vectorizer.vocabulary_)
+    if dim and dim != n_terms:
+        raise SnapshotMismatch(f"corpus has {dim} columns but the vectorizer has {n_terms} terms")
+    if version and version != vectorizer_fingerprint(vectorizer):
+        raise SnapshotMismatch(
+            f"corpus was built with vectorizer {version}, loaded vectorizer is {vectorizer_fingerprint(vectorizer)}"
+        )
+
+
+# ---------- Embedding text parsing ----------------------------------------------
+def parse_embedding(value) -> np.ndarray:
+    # Supabase returns pgvector/text columns as "[0.1, 0.2, ...]"; np.fromstring
+    # parses that in C instead of building a Python list via ast.literal_eval.
+    if isinstance(value, str):
+        return np.fromstring(value.strip().strip("[]"), sep=",", dtype=np.float32)
+    return np.asarray(value, dtype=np.float32)
+
+
+def parse_embedding_column(values) -> np.ndarray:
+    values = list(values)
+    if not values:
+        return np.zeros((0, 0), dtype=np.float32)
+    if all(isinstance(v, str) for v in values):
+        try:
+            # One json.loads over the whole column is much faster than per-row parsing.
+            mat = np.asarray(json.loads("[" + ",".join(values) + "]"), dtype=np.float32)
+            if mat.ndim == 2:
+                return mat
+        except ValueError:
+            pass
+    rows = [parse_embedding(v) for v in values]
+    dims = {r.shape[0] for r in rows}
+    if len(dims) != 1:
+        raise ValueError(f"embeddings have inconsistent dimensions: {sorted(dims)}")
+    return np.vstack(rows).astype(np.float32, copy=False)
+
+
+# ---------- On-disk embedding snapshot -------------------------------------------
+# Layout: the L2-normalised float32 CSR matrix as three raw .npy arrays
+# (<dir>/csr_data.npy, csr_indices.npy, csr_indptr.npy) that load with mmap and
+# no parsing, and <dir>/meta.json with row ids and course descriptions in the
+# same order. Only non-zero weights are stored.
+def save_snapshot(matrix, ids, descriptions, path: str = SNAPSHOT_DIR, extra_meta=None) -> None:
+    os.makedirs(path, exist_ok=True)
+    mat = sp.csr_matrix(matrix, dtype=np.float32)
+    mat.sort_indices()
+    index_dtype = np.int32 if mat.nnz < np.iinfo(np.int32).max else np.int64
+    arrays = (mat.data, mat.indices.astype(index_dtype, copy=False), mat.indptr.astype(index_dtype, copy=False))
+    meta = dict(extra_meta or {})
+    meta.update({
+        "ids": list(ids), "descriptions": list(descriptions), "shape": list(mat.shape),
+        "nnz": int(mat.nnz), "format": "csr", "saved_at": time.time(),
+    })
+    # Write to temp files then rename, so a concurrent reader never sees half a snapshot.
+    # meta.json goes last: it is what readers check the arrays against.
+    targets = [os.path.join(path, name) for name in SNAPSHOT_CSR]
+    for target, arr in zip(targets, arrays):
+        with open(target + ".tmp", "wb") as f:
+            np.save(f, arr)
+    meta_path = os.path.join(path, SNAPSHOT_META)
+    with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(meta, f, default=str)
+    for target in targets:
+        os.replace(target + ".tmp", target)
+    os.replace(meta_path + ".tmp", meta_path)
+    dense_path = os.path.join(path, SNAPSHOT_MATRIX)
+    if os.path.exists(dense_path):
+        os.remove(dense_path)
+
+
+def load_snapshot(path: str = SNAPSHOT_DIR, mmap_mode="r", max_age: float = None):
+    # Returns (CSR matrix, meta) or None when the snapshot is missing, stale or unreadable.
+    meta_path = os.path.join(path, SNAPSHOT_META)
+    if not os.path.exists(meta_path):
+        return None
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if max_age is not None and time.time() - float(meta.get("saved_at", 0)) > max_age:
+            return None
+        shape = tuple(meta.get("shape", []))
+        if meta.get("format") == "csr":
+            data, indices, indptr = (np.load(os.path.join(path, name), mmap_mode=mmap_mode) for name in SNAPSHOT_CSR)
+            if len(shape) != 2 or indptr.shape[0] != shape[0] + 1 or data.shape[0] != meta.get("nnz"):
+                return None
+            matrix = sp.csr_matrix((data, indices, indptr), shape=shape, copy=False)
+        else:
+            dense_path = os.path.join(path, SNAPSHOT_MATRIX)
+            if not os.path.exists(dense_path):
+                return None
+            dense = np.load(dense_path, mmap_mode=mmap_mode)
+            if dense.shape != shape:
+                return None
+            matrix = sp.csr_matrix(dense, dtype=np.float32)
+        return matrix, meta
+    except Exception as e:
+        logging.warning("Ignoring unreadable RAG snapshot at %s: %s", path, e)
+        return None
@@ -0,0 +1,278 @@
+import logging
+import threading
+import time
+
+from rag_index import EmbeddingIndex
+from rag_store import (
+    SNAPSHOT_DIR, check_vectorizer, load_snapshot, parse_embedding_column, save_snapshot, vectorizer_fingerprint,
+)
+
+
+def _max_id(ids):
+    ids = [i for i in ids if i is not None]
+    return max(ids) if ids else None
+
+
+# ---------- Paginated, incremental course_embeddings sync ------------------------
+# Only the query-builder subset used below is required from the client
+# (table/select/order/gt/or_/not_.is_/limit/execute), so a small local stub can
+# stand in for supabase in development and benchmarks.
+class CourseEmbeddingSync:
+    def __init__(
+        self,
+        client,
+        table: str = "course_embeddings",
+        id_col: str = "id",
+        text_col: str = "course_description",
+        embedding_col: str = "embedding",
+        updated_col: str = "updated_at",
+        page_size: int = 500,
+        snapshot_dir: str = SNAPSHOT_DIR,
+        meta_cols=(),
+    ):
+        self.client = client
+        self.table = table
+        self.id_col = id_col
+        self.text_col = text_col
+        self.embedding_col = embedding_col
+        self.updated_col = updated_col
+        self.page_size = max(1, int(page_size))
+        self.snapshot_dir = snapshot_dir
+        # Extra columns (e.g. faculty) carried into each row's metadata for filtering.
+        self.meta_cols = [c for c in meta_cols if c]
+        # Watermark of the newest row folded in so far: (updated_at, id).
+        self.watermark = (None, None)
+        # Build info (e.g. vectorizer_version from build_rag.py) kept across re-saves.
+        self.build_meta = {}
+        self.last_sync = 0.0
+        self._sync_lock = threading.Lock()
+
+    def _columns(self) -> str:
+        # embedding_col may be empty to page through text and metadata only (build_rag.py).
+        cols = [c for c in (self.id_col, self.text_col, self.embedding_col) if c] + self.meta_cols
+        if self.updated_col:
+            cols.append(self.updated_col)
+        return ",".join(cols)
+
+    def _query(self):
+        return self.client.table(self.table).select(self._columns())
+
+    def _advance(self, row) -> None:
+        upd = row.get(self.updated_col) if self.updated_col else None
+        rid = row.get(self.id_col)
+        cur_upd, cur_id = self.watermark
+        if self.updated_col:
+            # Rows without updated_at are outside the incremental keyset.
+            if upd is not None and (cur_upd is None or (upd, rid) > (cur_upd, cur_id)):
+                self.watermark = (upd, rid)
+        elif cur_id is None or rid > cur_id:
+            self.watermark = (cur_upd, rid)
+
+    def iter_pages(self, changed_only: bool = False):
+        # Keyset pagination: each page starts strictly after the last row of the
+        # previous one, so deep pages cost the same as the first. Incremental
+        # pages skip rows whose updated_at is NULL: Postgres sorts them last and
+        # they have no key to resume after (a full load still picks them up).
+        upd, rid = self.watermark if changed_only else (None, None)
+        while True:
+            q = self._query()
+            if self.updated_col and changed_only:
+                q = q.not_.is_(self.updated_col, "null")
+                if upd is not None:
+                    q = q.or_(
+                        f"{self.updated_col}.gt.{upd},"
+                        f"and({self.updated_col}.eq.{upd},{self.id_col}.gt.{rid})"
+                    )
+                q = q.order(self.updated_col).order(self.id_col)
+            else:
+                if rid is not None:
+                    q = q.gt(self.id_col, rid)
+                q = q.order(self.id_col)
+            rows = q.limit(self.page_size).execute().data or []
+            if not rows:
+                return
+            yield rows
+            last = rows[-1]
+            rid = last.get(self.id_col)
+            if self.updated_col and changed_only:
+                upd = last.get(self.updated_col)
+                if upd is None:
+                    # A client that ignored the NULL filter would restart from the top.
+                    return
+            if len(rows) < self.page_size:
+                return
+
+    @staticmethod
+    def _width(value) -> int:
+        # Embedding length without parsing it: pgvector text is "[x,y,...]".
+        if isinstance(value, str):
+            body = value.strip().strip("[]").strip()
+            return body.count(",") + 1 if body else 0
+        return len(value)
+
+    def _check_widths(self, rows, dim=None):
+        # Rows whose embedding is not `dim` wide were written by another
+        # vectorizer and cannot be folded in. Returns (usable rows, position of
+        # the first rejected row or None).
+        usable = []
+        first_bad = None
+        for i, r in enumerate(rows):
+            value = r.get(self.embedding_col)
+            if value is not None:
+                width = self._width(value)
+                dim = width if dim is None else dim
+                if width != dim:
+                    first_bad = i if first_bad is None else first_bad
+                    continue
+            usable.append(r)
+        return usable, first_bad
+
+    @property
+    def local_only(self) -> bool:
+        # A build_rag.py snapshot whose embeddings were not written back with
+        # --upsert: the rows in Supabase come from another vectorizer, so nothing
+        # is synced into it.
+        return (self.build_meta.get("build") or {}).get("upserted") is False
+
+    def _parse(self, rows):
+        latest = {}
+        for r in rows:
+            if r.get(self.embedding_col) is not None:
+                latest[r.get(self.id_col)] = r
+        rows = list(latest.values())
+        if not rows:
+            return None, [], [], []
+        mat = parse_embedding_column([r[self.embedding_col] for r in rows])
+        metadata = [{c: r.get(c) for c in self.meta_cols if r.get(c) is not None} for r in rows]
+        return mat, [r.get(self.text_col) or "" for r in rows], [r.get(self.id_col) for r in rows], metadata
+
+    def _save(self, index: EmbeddingIndex) -> None:
+        if not self.snapshot_dir:
+            return
+        try:
+            save_snapshot(
+                index.matrix, index.ids, index.descriptions, self.snapshot_dir,
+                extra_meta={
+                    **self.build_meta,
+                    "watermark": list(self.watermark), "updated_col": self.updated_col, "metadata": index.metadata,
+                },
+            )
+            index.save_backend(self.snapshot_dir)
+        except Exception as e:
+            logging.warning("Saving RAG snapshot failed: %s", e)
+
+    def _fetch_all(self):
+        self.watermark = (None, None)
+        rows = []
+        for page in self.iter_pages():
+            rows.extend(page)
+            for r in page:
+                self._advance(r)
+        return rows
+
+    def fetch_rows(self):
+        # Every row of the table, keyset-paged; leaves the watermark at the newest.
+        try:
+            return self._fetch_all()
+        except Exception as e:
+            if not self.updated_col:
+                raise
+            logging.warning("Selecting %s failed (%s); syncing by id only", self.updated_col, e)
+            self.updated_col = None
+            return self._fetch_all()
+
+    def full_load(self, vectorizer=None) -> EmbeddingIndex:
+        rows = self.fetch_rows()
+        mat, descriptions, ids, metadata = self._parse(rows)
+        if vectorizer is not None:
+            # The rows carry no version, so the width is all that can be checked
+            # here; the snapshot is stamped with the fingerprint so later loads
+            # (load_index) refuse a different vectorizer.
+            if mat is not None:
+                check_vectorizer(vectorizer, mat.shape[1], self.build_meta.get("vectorizer_version"))
+            self.build_meta["vectorizer_version"] = vectorizer_fingerprint(vectorizer)
+        if mat is not None:
+            index = EmbeddingIndex(mat, descriptions=descriptions, ids=ids, metadata=metadata)
+        else:
+            index = EmbeddingIndex.from_frame(None)
+        self.last_sync = time.time()
+        self._save(index)
+        return index
+
+    def load_index(self, vectorizer=None) -> EmbeddingIndex:
+        # Start from the on-disk snapshot when there is one and catch up with an
+        # incremental sync; otherwise page through the whole table once. With a
+        # vectorizer, a corpus it cannot have produced raises SnapshotMismatch
+        # before anything is served.
+        snap = load_snapshot(self.snapshot_dir, mmap_mode="r") if self.snapshot_dir else None
+        if snap is None:
+            return self.full_load(vectorizer)
+        matrix, meta = snap
+        if vectorizer is not None:
+            check_vectorizer(vectorizer, matrix.shape[1], meta.get("vectorizer_version"))
+        self.build_meta = {k: meta[k] for k in ("vectorizer_version", "build") if k in meta}
+        wm = meta.get("watermark") or [None, _max_id(meta.get("ids") or [])]
+        if meta.get("updated_col", self.updated_col) != self.updated_col:
+            wm = [None, _max_id(meta.get("ids") or [])]
+        self.watermark = (wm[0], wm[1])
+        index = EmbeddingIndex.from_snapshot(matrix, meta, path=self.snapshot_dir)
+        if self.local_only:
+            logging.warning("RAG snapshot was built without --upsert; serving it without syncing from Supabase")
+            return index
+        try:
+            self.sync(index)
+        except Exception as e:
+            logging.warning("Incremental RAG sync failed, serving snapshot: %s", e)
+        return index
+
+    def sync(self, index: EmbeddingIndex) -> int:
+        # The watermark only moves past rows that were folded in: it stops before
+        # the first row with the wrong embedding width, so that row is fetched
+        # (and rejected) again until it is rebuilt.
+        if self.local_only:
+            return 0
+        with self._sync_lock:
+            try:
+                rows = [r for page in self.iter_pages(changed_only=True) for r in page]
+            except Exception as e:
+                if not self.updated_col:
+                    raise
+                # Table has no updated_at column: fall back to picking up new ids only.
+                logging.warning("Sync by %s failed (%s); falling back to id watermark", self.updated_col, e)
+                self.updated_col = None
+                self.watermark = (None, _max_id(index.ids))
+                rows = [r for page in self.iter_pages(changed_only=True) for r in page]
+            self.last_sync = time.time()
+            usable, first_bad = self._check_widths(rows, index.dim if len(index) else None)
+            if first_bad is not None:
+                logging.warning(
+                    "RAG sync rejected %d course_embeddings rows whose embeddings do not match the index width; "
+                    "rebuild them with build_rag.py --upsert", len(rows) - len(usable),
+                )
+            mat, descriptions, ids, metadata = self._parse(usable)
+            changed = index.upsert(mat, descriptions, ids, metadata=metadata) if mat is not None else 0
+            for r in rows[:first_bad]:
+                self._advance(r)
+            if mat is None:
+                return 0
+            self._save(index)
+            logging.info("RAG sync folded %d changed course_embeddings rows", changed)
+            return changed
+
+    def sync_in_background(self, index: EmbeddingIndex, min_interval: float = 300.0, on_change=None) -> bool:
+        # Called on every rerun; starts at most one daemon sync per interval so
+        # no student request waits on Supabase. on_change() runs in the same
+        # thread after rows were folded in (e.g. to rebuild derived indexes).
+        if self.local_only or time.time() - self.last_sync < min_interval or self._sync_lock.locked():
+            return False
+        self.last_sync = time.time()
+
+        def _run():
+            try:
+                if self.sync(index) and on_change is not None:
+                    on_change()
+            except Exception as e:
+                logging.warning("Background RAG sync failed: %s", e)
+
+        threading.Thread(target=_run, name="rag-sync", daemon=True).start()
+        return True
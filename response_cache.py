@@ -0,0 +1,268 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+
+
+RESPONSE_CACHE_BACKEND = os.environ.get("RESPONSE_CACHE_BACKEND", "").strip().lower()  # "", "memory", "sqlite"
+RESPONSE_CACHE_DB = os.environ.get("RESPONSE_CACHE_DB", "access_logs.db")
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", 6 * 3600))
+RESPONSE_CACHE_ENTRIES = int(os.environ.get("RESPONSE_CACHE_ENTRIES", 2000))
+RESPONSE_CACHE_SIMILARITY = float(os.environ.get("RESPONSE_CACHE_SIMILARITY", 0.92))
+# A near-duplicate must also share this fraction (Jaccard) of its content words:
+# the course vectorizer's vocabulary is small, so different questions often map
+# to the same vector once their unknown words ("mitosis", "delict") drop out.
+RESPONSE_CACHE_LEXICAL = float(os.environ.get("RESPONSE_CACHE_LEXICAL", 0.8))
+# One- and two-word turns ("yes", "b", "next") only make sense in context; never cache them.
+MIN_QUESTION_WORDS = 3
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def normalize_question(question: str) -> str:
+    return " ".join(_WORD_RE.findall((question or "").lower()))
+
+
+def content_words(question: str) -> frozenset:
+    # Stop words and contraction leftovers ("what's" -> "what", "s") do not count.
+    return frozenset(w for w in normalize_question(question).split() if len(w) > 1 and w not in ENGLISH_STOP_WORDS)
+
+
+def _jaccard(a: frozenset, b: frozenset) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def make_scope(mode: str, context_ids, params: dict, history_key: str = "") -> str:
+    # Everything except the question itself: two questions can only share an
+    # answer when they were asked against the same retrieved context, mode,
+    # model parameters and conversational state.
+    payload = json.dumps(
+        {"mode": mode, "ctx": [str(c) for c in context_ids or []], "params": params or {}, "hist": history_key},
+        sort_keys=True, default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def history_key(messages) -> str:
+    # Conversational state for the cache scope: the tutor's previous reply (if
+    # any), so answers to "what is IRAC?" mid-quiz are not reused at the start.
+    for m in reversed(messages or []):
+        if m.get("role") == "assistant":
+            return hashlib.sha1(str(m.get("content", "")).encode("utf-8")).hexdigest()
+    return ""
+
+
+def _sparse_items(vec):
+    # Converts a dense or scipy-sparse vector to L2-normalised {index: value}.
+    if vec is None:
+        return None
+    if hasattr(vec, "tocoo"):
+        coo = vec.tocoo()
+        idx, val = coo.col if coo.shape[0] == 1 else coo.row, coo.data
+    else:
+        arr = np.asarray(vec, dtype=np.float64).ravel()
+        idx = np.flatnonzero(arr)
+        val = arr[idx]
+    norm = float(np.sqrt(np.dot(val, val)))
+    if norm == 0:
+        return None
+    return {int(i): float(v) / norm for i, v in zip(idx, val)}
+
+
+def _cosine(a: dict, b: dict) -> float:
+    if not a or not b:
+        return 0.0
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(v * b.get(i, 0.0) for i, v in a.items())
+
+
+# ---------- Backends --------------------------------------------------------------
+class MemoryBackend:
+    def __init__(self, max_entries: int = RESPONSE_CACHE_ENTRIES, ttl: float = RESPONSE_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._items = OrderedDict()  # (scope, question) -> (created, response, vector)
+        self._lock = threading.Lock()
+
+    def get(self, scope: str, question: str):
+        with self._lock:
+            hit = self._items.get((scope, question))
+            if hit is None:
+                return None
+            if time.time() - hit[0] > self.ttl:
+                del self._items[(scope, question)]
+                return None
+            self._items.move_to_end((scope, question))
+            return hit[1]
+
+    def candidates(self, scope: str, limit: int = 200):
+        now = time.time()
+        with self._lock:
+            out = [
+                (q, v[1], v[2]) for (s, q), v in reversed(self._items.items()) if s == scope and now - v[0] <= self.ttl
+            ]
+        return out[:limit]
+
+    def put(self, scope: str, question: str, response: str, vector) -> None:
+        with self._lock:
+            self._items[(scope, question)] = (time.time(), response, vector)
+            self._items.move_to_end((scope, question))
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class SQLiteBackend:
+    # Shared by every worker process on the host through one SQLite file.
+    def __init__(self, path: str = RESPONSE_CACHE_DB, max_entries: int = RESPONSE_CACHE_ENTRIES,
+                 ttl: float = RESPONSE_CACHE_TTL):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS response_cache (
+                    scope TEXT NOT NULL,
+                    question TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    vector TEXT,
+                    created_at REAL NOT NULL,
+                    last_hit REAL NOT NULL,
+                    PRIMARY KEY (scope, question)
+                )
+                """
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS response_cache_lru ON response_cache(last_hit)")
+
+    def get(self, scope: str, question: str):
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT response FROM response_cache WHERE scope = ? AND question = ? AND created_at >= ?",
+                (scope, question, now - self.ttl),
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE response_cache SET last_hit = ? WHERE scope = ? AND question = ?", (now, scope, question)
+            )
+            return row[0]
+
+    def candidates(self, scope: str, limit: int = 200):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT question, response, vector FROM response_cache WHERE scope = ? AND created_at >= ? "
+                "ORDER BY last_hit DESC LIMIT ?",
+                (scope, time.time() - self.ttl, limit),
+            ).fetchall()
+        out = []
+        for question, response, vector in rows:
+            vec = {int(k): v for k, v in json.loads(vector).items()} if vector else None
+            out.append((question, response, vec))
+        return out
+
+    def put(self, scope: str, question: str, response: str, vector) -> None:
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO response_cache (scope, question, response, vector, created_at, last_hit) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (scope, question, response, json.dumps(vector) if vector else None, now, now),
+            )
+            self._conn.execute("DELETE FROM response_cache WHERE created_at < ?", (now - self.ttl,))
+            self._conn.execute(
+                "DELETE FROM response_cache WHERE rowid IN ("
+                "SELECT rowid FROM response_cache ORDER BY last_hit DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+
+
+# ---------- Response cache ----------------------------------------------------------
+class ResponseCache:
+    def __init__(self, backend, similarity: float = RESPONSE_CACHE_SIMILARITY, lexical: float = RESPONSE_CACHE_LEXICAL):
+        self.backend = backend
+        self.similarity = similarity
+        self.lexical = lexical
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def cacheable(question: str) -> bool:
+        return len(normalize_question(question).split()) >= MIN_QUESTION_WORDS
+
+    def get(self, scope: str, question: str, vector=None):
+        # Exact match on the normalised question first, then the most similar
+        # earlier question in the same scope (TF-IDF cosine >= similarity) that
+        # also shares most of its content words.
+        if not self.cacheable(question):
+            return None
+        try:
+            hit = self.backend.get(scope, normalize_question(question))
+            if hit is not None:
+                self.hits += 1
+                return hit
+            items = _sparse_items(vector) if self.similarity < 1.0 else None
+            if items:
+                words = content_words(question)
+                best, best_sim = None, self.similarity
+                for cand_question, response, cand in self.backend.candidates(scope):
+                    if _jaccard(words, content_words(cand_question)) < self.lexical:
+                        continue
+                    sim = _cosine(items, cand)
+                    if sim >= best_sim:
+                        best, best_sim = response, sim
+                if best is not None:
+                    self.semantic_hits += 1
+                    return best
+        except Exception as e:
+            logging.warning("Response cache lookup failed: %s", e)
+        self.misses += 1
+        return None
+
+    def put(self, scope: str, question: str, response: str, vector=None) -> None:
+        if not response or not self.cacheable(question):
+            return
+        try:
+            self.backend.put(scope, normalize_question(question), response, _sparse_items(vector))
+        except Exception as e:
+            logging.warning("Response cache store failed: %s", e)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache(backend: str = RESPONSE_CACHE_BACKEND):
+    # Process-wide cache, or None when RESPONSE_CACHE_BACKEND is unset/"off".
+    global _cache
+    if backend not in ("memory", "sqlite"):
+        return None
+    with _cache_lock:
+        if _cache is None:
+            try:
+                _cache = ResponseCache(SQLiteBackend() if backend == "sqlite" else MemoryBackend())
+            except Exception as e:
+                logging.warning("Response cache disabled: %s", e)
+                return None
+        return _cache
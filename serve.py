@@ -0,0 +1,29 @@
+"""Starts the tutor with its caches warming up before the first request.
+
+    python serve.py [streamlit run options, e.g. --server.port 8501]
+
+`streamlit run tutor.py` only executes the script when the first browser
+session arrives, so that student would trigger the Supabase pull, the
+vectorizer load and the Groq handshake. This launcher starts the warm-up
+threads (warmup.py) first and then runs the Streamlit server in the same
+process, where tutor.py finds the already-loaded index and client pools.
+"""
+import os
+import sys
+
+import streamlit as st
+from streamlit.web import cli as stcli
+
+from warmup import start_default
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def main() -> int:
+    start_default(st.secrets, background=True)
+    sys.argv = ["streamlit", "run", os.path.join(ROOT, "tutor.py")] + sys.argv[1:]
+    return stcli.main()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
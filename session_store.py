@@ -0,0 +1,344 @@
+import json
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import uuid
+import weakref
+import zlib
+from collections import OrderedDict
+
+
+SESSION_STORE_DB = os.environ.get("SESSION_STORE_DB", "session_store.db")
+# In-memory bytes of chat history one session may hold before its oldest
+# messages are written to disk, and the total across all sessions in the process.
+SESSION_MEMORY_BYTES = int(os.environ.get("SESSION_MEMORY_BYTES", 256 * 1024))
+SESSION_STORE_BYTES = int(os.environ.get("SESSION_STORE_BYTES", 64 * 1024 * 1024))
+# The newest messages always stay in memory: they are what every rerun draws.
+SESSION_HOT_MESSAGES = int(os.environ.get("SESSION_HOT_MESSAGES", 4))
+# On-disk bytes of uploaded-PDF blobs (pages, chunk indexes); past it the least
+# recently touched blobs are deleted and rebuilt from the upload if asked for again.
+SESSION_BLOB_BYTES = int(os.environ.get("SESSION_BLOB_BYTES", 256 * 1024 * 1024))
+# Spilled rows nobody has touched for this long (e.g. left behind by a crash) are purged.
+SESSION_STORE_TTL = float(os.environ.get("SESSION_STORE_TTL", 24 * 3600))
+
+
+def _message_bytes(message: dict) -> int:
+    return sum(len(v) for v in message.values() if isinstance(v, str)) + 64
+
+
+# ---------- Chat history with a bounded in-memory tail ----------------------------
+class SessionMessages:
+    # List-like chat history for one session (append, len, indexing, slicing,
+    # iteration). Only the newest messages are kept in memory; older ones live in
+    # the store's SQLite file and are read back on demand, e.g. when "show
+    # earlier messages" reaches them or the history summary folds them in.
+    # Spilled messages come back without their cached markdown.
+    __slots__ = ("key", "_store", "_hot", "_offset", "_size", "_lock", "__weakref__")
+
+    def __init__(self, store, key: str = None):
+        self.key = key or uuid.uuid4().hex
+        self._store = store
+        self._hot = []
+        self._offset = 0  # messages [0, _offset) are on disk
+        self._size = [0]  # in-memory bytes, in a list the store's finalizer can read
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return self._offset + len(self._hot)
+
+    def __bool__(self) -> bool:
+        return len(self) > 0
+
+    def __sizeof__(self) -> int:
+        # What sys.getsizeof (and the load test's state size) should count: the
+        # in-memory tail, not the store it points at.
+        return object.__sizeof__(self) + self._size[0]
+
+    @property
+    def nbytes(self) -> int:
+        return self._size[0]
+
+    @property
+    def spilled(self) -> int:
+        return self._offset
+
+    def _range(self, start: int, stop: int):
+        with self._lock:
+            offset, hot = self._offset, list(self._hot)
+        out = self._store._load(self.key, start, min(stop, offset)) if start < offset else []
+        return out + hot[max(0, start - offset):max(0, stop - offset)]
+
+    def __getitem__(self, i):
+        n = len(self)
+        if isinstance(i, slice):
+            start, stop, step = i.indices(n)
+            if step != 1:
+                return self._range(0, n)[i]
+            return self._range(start, stop) if start < stop else []
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError("message index out of range")
+        return self._range(i, i + 1)[0]
+
+    def __iter__(self):
+        with self._lock:
+            offset, hot = self._offset, list(self._hot)
+        for start in range(0, offset, 200):
+            yield from self._store._load(self.key, start, min(start + 200, offset))
+        yield from hot
+
+    def __reversed__(self):
+        with self._lock:
+            offset, hot = self._offset, list(self._hot)
+        yield from reversed(hot)
+        for stop in range(offset, 0, -200):
+            yield from reversed(self._store._load(self.key, max(0, stop - 200), stop))
+
+    def append(self, message: dict) -> None:
+        size = _message_bytes(message)
+        with self._lock:
+            self._hot.append(message)
+            self._size[0] += size
+        self._store._grew(self, size)
+
+    def spill(self, keep_bytes: int = 0, keep_messages: int = SESSION_HOT_MESSAGES) -> int:
+        # Moves the oldest in-memory messages to disk until at most keep_bytes
+        # remain (never fewer than keep_messages). Returns the bytes freed.
+        with self._lock:
+            n = 0
+            freed = 0
+            while len(self._hot) - n > keep_messages and self._size[0] - freed > keep_bytes:
+                freed += _message_bytes(self._hot[n])
+                n += 1
+            if not n:
+                return 0
+            self._store._save(self.key, self._offset, self._hot[:n])
+            del self._hot[:n]
+            self._offset += n
+            self._size[0] -= freed
+        self._store._shrunk(self, freed)
+        return freed
+
+
+# ---------- Process-wide store -----------------------------------------------------
+class SessionStore:
+    # Owns the SQLite spill file and the memory budgets. Each session's history
+    # is trimmed to SESSION_MEMORY_BYTES as it grows; when all sessions together
+    # pass SESSION_STORE_BYTES, the least recently active ones are spilled down to
+    # their last few messages. Uploaded PDFs and their chunk indexes are kept on
+    # disk by content hash (put_blob/get_blob), so a session only holds the hash;
+    # they are shared between sessions and bounded by blob_bytes, least recently
+    # touched first.
+    def __init__(self, path: str = SESSION_STORE_DB, session_bytes: int = SESSION_MEMORY_BYTES,
+                 total_bytes: int = SESSION_STORE_BYTES, ttl: float = SESSION_STORE_TTL,
+                 blob_bytes: int = SESSION_BLOB_BYTES):
+        self.path = path
+        self.session_bytes = session_bytes
+        self.total_bytes = total_bytes
+        self.blob_bytes = blob_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._sessions = OrderedDict()  # key -> weakref to SessionMessages, least recent first
+        self._bytes = 0
+        self._evictions = 0
+        self._blob_total = 0
+        self._blob_evictions = 0
+        self._conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False)
+        with self._db_lock, self._conn:
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS session_messages (
+                    session TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    message TEXT NOT NULL,
+                    touched REAL NOT NULL,
+                    PRIMARY KEY (session, seq)
+                )
+                """
+            )
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS session_blobs (
+                    kind TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    data BLOB NOT NULL,
+                    touched REAL NOT NULL,
+                    PRIMARY KEY (kind, key)
+                )
+                """
+            )
+            cutoff = time.time() - ttl
+            self._conn.execute("DELETE FROM session_messages WHERE touched < ?", (cutoff,))
+            self._conn.execute("DELETE FROM session_blobs WHERE touched < ?", (cutoff,))
+            self._blob_total = self._conn.execute("SELECT COALESCE(SUM(LENGTH(data)), 0) FROM session_blobs").fetchone()[0]
+
+    # ---- sessions ----
+    def messages(self) -> SessionMessages:
+        # A fresh, empty history (new session or "start a new chat"). Its spilled
+        # rows are deleted once the object is garbage collected.
+        msgs = SessionMessages(self)
+        with self._lock:
+            self._sessions[msgs.key] = weakref.ref(msgs)
+        weakref.finalize(msgs, self._drop, msgs.key, msgs._size)
+        return msgs
+
+    def _drop(self, key: str, size) -> None:
+        # size is the collected session's byte cell: its in-memory tail is gone too.
+        with self._lock:
+            self._sessions.pop(key, None)
+            self._bytes -= size[0]
+        try:
+            with self._db_lock, self._conn:
+                self._conn.execute("DELETE FROM session_messages WHERE session = ?", (key,))
+        except Exception as e:
+            logging.warning("Session store cleanup failed: %s", e)
+
+    def _grew(self, msgs: SessionMessages, size: int) -> None:
+        with self._lock:
+            self._bytes += size
+            if msgs.key in self._sessions:
+                self._sessions.move_to_end(msgs.key)
+        if msgs.nbytes > self.session_bytes:
+            msgs.spill(keep_bytes=self.session_bytes)
+        if self._bytes > self.total_bytes:
+            self._evict(exclude=msgs.key)
+
+    def _shrunk(self, msgs: SessionMessages, size: int) -> None:
+        with self._lock:
+            self._bytes -= size
+
+    def _evict(self, exclude: str = None) -> None:
+        # Least recently active sessions first; the current one goes last.
+        with self._lock:
+            victims = [(k, ref) for k, ref in self._sessions.items() if k != exclude]
+            current = self._sessions.get(exclude)
+        if current is not None:
+            victims.append((exclude, current))
+        for _, ref in victims:
+            if self._bytes <= self.total_bytes:
+                return
+            msgs = ref()
+            if msgs is not None and msgs.spill(keep_bytes=0):
+                with self._lock:
+                    self._evictions += 1
+
+    def _save(self, key: str, start: int, messages) -> None:
+        now = time.time()
+        rows = [
+            (key, start + i, json.dumps({k: v for k, v in m.items() if k != "markdown"}), now)
+            for i, m in enumerate(messages)
+        ]
+        with self._db_lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO session_messages (session, seq, message, touched) VALUES (?, ?, ?, ?)", rows
+            )
+
+    def _load(self, key: str, start: int, stop: int):
+        if stop <= start:
+            return []
+        with self._db_lock, self._conn:
+            rows = self._conn.execute(
+                "SELECT message FROM session_messages WHERE session = ? AND seq >= ? AND seq < ? ORDER BY seq",
+                (key, start, stop),
+            ).fetchall()
+            self._conn.execute(
+                "UPDATE session_messages SET touched = ? WHERE session = ? AND seq >= ? AND seq < ?",
+                (time.time(), key, start, stop),
+            )
+        return [json.loads(r[0]) for r in rows]
+
+    # ---- documents ----
+    def put_blob(self, kind: str, key: str, obj) -> None:
+        data = zlib.compress(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL), 1)
+        if len(data) > self.blob_bytes:
+            return
+        with self._db_lock, self._conn:
+            old = self._conn.execute(
+                "SELECT LENGTH(data) FROM session_blobs WHERE kind = ? AND key = ?", (kind, key)
+            ).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO session_blobs (kind, key, data, touched) VALUES (?, ?, ?, ?)",
+                (kind, key, data, time.time()),
+            )
+            self._blob_total += len(data) - (old[0] if old else 0)
+            self._evict_blobs(exclude=(kind, key))
+
+    def _evict_blobs(self, exclude) -> None:
+        # Caller holds _db_lock. Oldest `touched` first; the blob just written stays.
+        while self._blob_total > self.blob_bytes:
+            rows = self._conn.execute(
+                "SELECT kind, key, LENGTH(data) FROM session_blobs WHERE NOT (kind = ? AND key = ?) "
+                "ORDER BY touched LIMIT 16",
+                exclude,
+            ).fetchall()
+            if not rows:
+                return
+            for kind, key, size in rows:
+                if self._blob_total <= self.blob_bytes:
+                    return
+                self._conn.execute("DELETE FROM session_blobs WHERE kind = ? AND key = ?", (kind, key))
+                self._blob_total -= size
+                self._blob_evictions += 1
+
+    def get_blob(self, kind: str, key: str):
+        with self._db_lock, self._conn:
+            row = self._conn.execute(
+                "SELECT data FROM session_blobs WHERE kind = ? AND key = ?", (kind, key)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE session_blobs SET touched = ? WHERE kind = ? AND key = ?", (time.time(), kind, key)
+            )
+        return pickle.loads(zlib.decompress(row[0]))
+
+    def has_blob(self, kind: str, key: str) -> bool:
+        with self._db_lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM session_blobs WHERE kind = ? AND key = ?", (kind, key)
+            ).fetchone()
+        return row is not None
+
+    # ---- reporting ----
+    def usage(self) -> dict:
+        # {session key: {"bytes", "messages", "spilled"}} for live sessions.
+        with self._lock:
+            refs = list(self._sessions.items())
+        out = {}
+        for key, ref in refs:
+            msgs = ref()
+            if msgs is not None:
+                out[key] = {"bytes": msgs.nbytes, "messages": len(msgs), "spilled": msgs.spilled}
+        return out
+
+    def stats(self) -> dict:
+        usage = self.usage()
+        return {
+            "sessions": len(usage),
+            "bytes": self._bytes,
+            "max_session_bytes": max((u["bytes"] for u in usage.values()), default=0),
+            "spilled_messages": sum(u["spilled"] for u in usage.values()),
+            "evictions": self._evictions,
+            "blob_bytes": self._blob_total,
+            "blob_evictions": self._blob_evictions,
+            "budget_session_bytes": self.session_bytes,
+            "budget_total_bytes": self.total_bytes,
+            "budget_blob_bytes": self.blob_bytes,
+        }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_session_store() -> SessionStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = SessionStore()
+        return _store
@@ -0,0 +1,216 @@
+import contextvars
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+
+TELEMETRY_SINK = os.environ.get("TELEMETRY_SINK", "jsonl").strip().lower()  # "", "off", "jsonl", "sqlite"
+TELEMETRY_PATH = os.environ.get("TELEMETRY_PATH", "")
+TELEMETRY_SAMPLES = int(os.environ.get("TELEMETRY_SAMPLES", 2048))
+
+_USAGE_FIELDS = ("prompt_tokens", "completion_tokens", "total_tokens")
+# Server-side timings Groq reports alongside token counts.
+_USAGE_TIMINGS = ("queue_time", "prompt_time", "completion_time", "total_time")
+
+
+# ---------- In-process histograms ---------------------------------------------------
+class Histogram:
+    # Keeps the most recent samples for percentiles plus running count/total.
+    def __init__(self, max_samples: int = TELEMETRY_SAMPLES):
+        self.samples = deque(maxlen=max_samples)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value: float) -> None:
+        self.samples.append(value)
+        self.count += 1
+        self.total += value
+
+    def summary(self) -> dict:
+        arr = np.fromiter(self.samples, dtype=np.float64, count=len(self.samples))
+        if not arr.size:
+            return {"count": self.count}
+        p50, p95 = np.percentile(arr, (50, 95))
+        return {
+            "count": self.count,
+            "mean": self.total / self.count,
+            "p50": float(p50),
+            "p95": float(p95),
+            "max": float(arr.max()),
+        }
+
+
+# ---------- Sinks ------------------------------------------------------------------
+class JsonlSink:
+    def __init__(self, path: str = "telemetry.jsonl"):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def write(self, record: dict) -> None:
+        line = json.dumps(record, default=str)
+        with self._lock, open(self.path, "a", encoding="utf-8") as fh:
+            fh.write(line + "\n")
+
+
+class SQLiteSink:
+    def __init__(self, path: str = "access_logs.db"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS telemetry_turns (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    ts REAL NOT NULL,
+                    mode TEXT,
+                    total_s REAL,
+                    prompt_tokens INTEGER,
+                    completion_tokens INTEGER,
+                    record TEXT NOT NULL
+                )
+                """
+            )
+
+    def write(self, record: dict) -> None:
+        usage = record.get("usage") or {}
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO telemetry_turns (ts, mode, total_s, prompt_tokens, completion_tokens, record) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    record["ts"], record.get("mode"), record.get("total_s"),
+                    usage.get("prompt_tokens"), usage.get("completion_tokens"),
+                    json.dumps(record, default=str),
+                ),
+            )
+
+
+def make_sink(kind: str = TELEMETRY_SINK, path: str = TELEMETRY_PATH):
+    if kind == "jsonl":
+        return JsonlSink(path or "telemetry.jsonl")
+    if kind == "sqlite":
+        return SQLiteSink(path or "access_logs.db")
+    return None
+
+
+# ---------- Spans and turns --------------------------------------------------------
+def _usage_dict(usage) -> dict:
+    if usage is None:
+        return {}
+    get = usage.get if isinstance(usage, dict) else (lambda k: getattr(usage, k, None))
+    out = {}
+    for k in _USAGE_FIELDS + _USAGE_TIMINGS:
+        v = get(k)
+        if isinstance(v, (int, float)):
+            out[k] = v
+    # Prompt tokens served from the provider's prefix cache (OpenAI-style
+    # prompt_tokens_details.cached_tokens), i.e. what the shared system prompt saved.
+    details = get("prompt_tokens_details")
+    cached = details.get("cached_tokens") if isinstance(details, dict) else getattr(details, "cached_tokens", None)
+    if isinstance(cached, (int, float)):
+        out["cached_tokens"] = cached
+    return out
+
+
+class Telemetry:
+    # span() times one stage and feeds the "<name>" histogram; turn() groups the
+    # spans of one tutoring turn into a record that is exported to the sink. The
+    # current turn lives in a context variable, so work handed to other threads
+    # with contextvars.copy_context() (see turn_pipeline.py) still reports into it.
+    def __init__(self, sink=None):
+        self.sink = sink
+        self._hists = {}
+        self._lock = threading.Lock()
+        self._turn = contextvars.ContextVar(f"telemetry_turn_{id(self)}", default=None)
+
+    def observe(self, name: str, value: float) -> None:
+        with self._lock:
+            hist = self._hists.get(name)
+            if hist is None:
+                hist = self._hists[name] = Histogram()
+            hist.add(float(value))
+
+    @contextmanager
+    def span(self, name: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            dt = time.perf_counter() - t0
+            self.observe(name, dt)
+            turn = self._turn.get()
+            if turn is not None:
+                with self._lock:
+                    turn["spans"][name] = turn["spans"].get(name, 0.0) + dt
+
+    @contextmanager
+    def turn(self, mode: str, **fields):
+        record = {"ts": time.time(), "mode": mode, "spans": {}, **fields}
+        token = self._turn.set(record)
+        t0 = time.perf_counter()
+        try:
+            yield record
+        except BaseException as e:
+            record["error"] = type(e).__name__
+            raise
+        finally:
+            self._turn.reset(token)
+            record["total_s"] = time.perf_counter() - t0
+            self.observe(f"turn.{mode}", record["total_s"])
+            self._export(record)
+
+    def annotate(self, **fields) -> None:
+        # Adds fields (cache hit, model, ...) to the current turn, if any.
+        turn = self._turn.get()
+        if turn is not None:
+            turn.update(fields)
+
+    def record_usage(self, usage) -> dict:
+        data = _usage_dict(usage)
+        for k, v in data.items():
+            self.observe(f"usage.{k}", v)
+        if data:
+            self.annotate(usage=data)
+        return data
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {name: hist.summary() for name, hist in sorted(self._hists.items())}
+
+    def _export(self, record: dict) -> None:
+        logging.debug(
+            "turn %s %.3fs %s",
+            record["mode"], record["total_s"], " ".join(f"{k}={v:.3f}" for k, v in record["spans"].items()),
+        )
+        if self.sink is None:
+            return
+        try:
+            self.sink.write(record)
+        except Exception as e:
+            logging.warning("Telemetry export failed: %s", e)
+
+
+_telemetry = None
+_telemetry_lock = threading.Lock()
+
+
+def get_telemetry() -> Telemetry:
+    # Process-wide collector, so histograms aggregate across sessions and reruns.
+    global _telemetry
+    with _telemetry_lock:
+        if _telemetry is None:
+            try:
+                sink = make_sink()
+            except Exception as e:
+                logging.warning("Telemetry sink disabled: %s", e)
+                sink = None
+            _telemetry = Telemetry(sink)
+        return _telemetry
@@ -0,0 +1,116 @@
+import sqlite3
+import time
+from types import SimpleNamespace
+
+from access_log import AccessLogWriter
+
+
+class RejectedRow(Exception):
+    status_code = 400
+
+
+class FakeClient:
+    # Rejects any insert containing a row for the "poison" user, like a
+    # constraint violation would; everything else is recorded.
+    def __init__(self):
+        self.rows = []
+
+    def table(self, name):
+        client = self
+
+        def insert(rows):
+            def execute():
+                if any(r["user_email"] == "poison@ufs.ac.za" for r in rows):
+                    raise RejectedRow("violates check constraint")
+                client.rows.extend(rows)
+            return SimpleNamespace(execute=execute)
+
+        return SimpleNamespace(insert=insert)
+
+
+def _wait(predicate, timeout=5.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline and not predicate():
+        time.sleep(0.02)
+    return predicate()
+
+
+def test_poison_event_does_not_block_later_events(tmp_path):
+    db = str(tmp_path / "outbox.db")
+    client = FakeClient()
+    writer = AccessLogWriter(client, db_path=db, flush_interval=0.05, max_retries=2, base_backoff=0)
+    writer.log_login("s1", "poison@ufs.ac.za", "Bad", {})
+    writer.log_login("s2", "student@ufs.ac.za", "Good", {})
+    writer.flush()
+    writer.log_login("s3", "later@ufs.ac.za", "Later", {})
+
+    emails = lambda: [r["user_email"] for r in client.rows]
+    assert _wait(lambda: emails() == ["student@ufs.ac.za", "later@ufs.ac.za"])
+    assert _wait(lambda: writer._outbox_size() == 0)
+    with sqlite3.connect(db) as conn:
+        dead = conn.execute("SELECT event FROM access_log_dead_letter").fetchall()
+    assert len(dead) == 1 and "poison@ufs.ac.za" in dead[0][0]
+    assert writer.stats["dead_lettered"] == 1
+
+
+def test_event_is_dead_lettered_after_max_attempts(tmp_path):
+    class Flaky(FakeClient):
+        def table(self, name):
+            raise ConnectionError("supabase unreachable")
+
+    writer = AccessLogWriter(Flaky(), db_path=str(tmp_path / "outbox.db"), flush_interval=0.02,
+                             max_retries=0, base_backoff=0, max_attempts=3)
+    writer.log_login("s1", "student@ufs.ac.za", "Student", {})
+    assert _wait(lambda: writer.stats["dead_lettered"] == 1)
+    assert writer._outbox_size() == 0
+
+
+class Outage(FakeClient):
+    def __init__(self):
+        super().__init__()
+        self.down = True
+        self.calls = 0
+
+    def table(self, name):
+        self.calls += 1
+        if self.down:
+            raise ConnectionError("supabase unreachable")
+        return super().table(name)
+
+
+def test_empty_outbox_is_not_polled(tmp_path, monkeypatch):
+    writer = AccessLogWriter(FakeClient(), db_path=str(tmp_path / "outbox.db"), flush_interval=0.01)
+    polls = []
+    monkeypatch.setattr(writer, "_outbox_size", lambda: polls.append(1) or 0)
+    monkeypatch.setattr(writer, "_replay", lambda: polls.append(1))
+    writer.log_login("s1", "student@ufs.ac.za", "Student", {})
+    writer.flush()
+    time.sleep(0.2)
+    assert writer.stats["inserted"] == 1
+    assert polls == []
+
+
+def test_replays_back_off_while_supabase_is_down(tmp_path):
+    client = Outage()
+    writer = AccessLogWriter(client, db_path=str(tmp_path / "outbox.db"), flush_interval=0.01,
+                             max_retries=0, base_backoff=0.2, max_replay_backoff=0.4)
+    writer.log_login("s1", "student@ufs.ac.za", "Student", {})
+    writer.flush()
+    assert writer.stats["spilled"] == 1
+    time.sleep(1.0)
+    # Polling every tick would have made ~100 attempts.
+    assert client.calls <= 7
+
+    client.down = False
+    assert _wait(lambda: [r["user_email"] for r in client.rows] == ["student@ufs.ac.za"])
+    assert writer._outbox_size() == 0
+
+
+def test_outbox_left_by_a_previous_process_is_replayed(tmp_path):
+    db = str(tmp_path / "outbox.db")
+    AccessLogWriter(None, db_path=db)._spill([{"kind": "login", "row": {"user_email": "old@ufs.ac.za"}}])
+    client = FakeClient()
+    writer = AccessLogWriter(client, db_path=db, flush_interval=0.01)
+    writer.start()
+    assert _wait(lambda: [r["user_email"] for r in client.rows] == ["old@ufs.ac.za"])
+    assert writer.stats["replayed"] == 1
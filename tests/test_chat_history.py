@@ -0,0 +1,94 @@
+from chat_history import HistoryManager, extractive_summary, format_message
+from session_store import SessionStore
+from tokens import count_tokens
+
+
+def _chat(n, words=30):
+    return [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"Turn {i} says something. " + "filler " * words}
+        for i in range(n)
+    ]
+
+
+class _CountingSummary:
+    # extractive_summary that records which slices it was asked to fold.
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, messages):
+        self.calls.append([m["content"].split(".")[0] for m in messages])
+        return extractive_summary(messages)
+
+
+def test_extractive_summary_keeps_first_sentences():
+    messages = [
+        {"role": "user", "content": "What is a tort?  It is\na civil wrong."},
+        {"role": "assistant", "content": ""},
+        {"role": "assistant", "content": "x" * 500},
+    ]
+    assert extractive_summary(messages).split("\n") == ["- User: What is a tort?", "- Assistant: " + "x" * 200]
+
+
+def test_context_stays_within_budget_and_keeps_the_newest_turns():
+    messages = _chat(40)
+    manager = HistoryManager(budget_tokens=400, summary_tokens=100)
+    context = manager.context(messages)
+
+    head, recent = context.split("\n\n", 1)
+    assert head == "Summary of earlier conversation:\n" + manager.summary
+    assert count_tokens(manager.summary) <= 100
+    assert sum(count_tokens(line) + 1 for line in recent.split("\n")) <= 300
+    assert recent.endswith(format_message(messages[-1]))
+    assert manager.summarized_upto + len(recent.split("\n")) == len(messages)
+
+
+def test_latest_message_is_kept_even_over_budget():
+    messages = [{"role": "user", "content": "long " * 200}]
+    assert HistoryManager(budget_tokens=50, summary_tokens=10).context(messages) == format_message(messages[0])
+
+
+def test_only_new_messages_are_folded():
+    summarize = _CountingSummary()
+    manager = HistoryManager(budget_tokens=400, summary_tokens=100, summarize=summarize)
+    messages = _chat(20)
+    manager.context(messages)
+    folded = manager.summarized_upto
+    assert summarize.calls == [[f"Turn {i} says something" for i in range(folded)]]
+
+    messages += _chat(30)[20:]
+    manager.context(messages)
+    assert summarize.calls[1] == [f"Turn {i} says something" for i in range(folded, manager.summarized_upto)]
+
+
+def test_new_chat_resets_the_cache():
+    manager = HistoryManager(budget_tokens=400, summary_tokens=100)
+    manager.context(_chat(30))
+    assert manager.summary
+
+    # Same length, different list (e.g. "start a new chat" then as many turns).
+    fresh = [{"role": "user", "content": f"New question {i}."} for i in range(30)]
+    context = manager.context(fresh)
+    assert "Turn 0" not in context
+    assert context.endswith("User: New question 29.")
+
+
+def test_session_messages_are_tracked_across_spills(tmp_path):
+    store = SessionStore(path=str(tmp_path / "sessions.db"), session_bytes=2048, total_bytes=1 << 20)
+    messages = store.messages()
+    summarize = _CountingSummary()
+    manager = HistoryManager(budget_tokens=400, summary_tokens=100, summarize=summarize)
+
+    for m in _chat(40):
+        messages.append(m)
+        manager.context(messages)
+    assert messages.spilled > 0
+    # Spilled messages come back as new dicts, but the history was never rebuilt.
+    assert all(len(call) < 40 for call in summarize.calls)
+    assert sum(len(call) for call in summarize.calls) == manager.summarized_upto
+
+    # Another session's history is a new chat, even at the same length.
+    other = store.messages()
+    for i in range(40):
+        other.append({"role": "user", "content": f"Other question {i}."})
+    assert manager.context(other).endswith("User: Other question 39.")
+    assert "Turn 0" not in manager.summary
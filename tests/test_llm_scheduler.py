@@ -0,0 +1,34 @@
+import pytest
+
+from llm_scheduler import LLMScheduler
+
+
+def _fails():
+    raise RuntimeError("model unavailable")
+    yield
+
+
+def _answers(stats, total_tokens):
+    def factory():
+        yield "answer"
+        stats["usage"] = {"total_tokens": total_tokens}
+    return factory
+
+
+def test_failed_and_abandoned_calls_give_their_reservation_back():
+    sched = LLMScheduler(rpm=1000, tpm=6000)
+    with pytest.raises(RuntimeError):
+        list(sched.stream("u1", 4000, _fails, max_retries=0))
+    assert sched.tokens.tokens == pytest.approx(6000, abs=50)
+
+    stream = sched.stream("u1", 4000, lambda: iter(["a", "b"]))
+    next(stream)
+    stream.close()
+    assert sched.tokens.tokens == pytest.approx(6000, abs=50)
+
+
+def test_completed_calls_are_charged_their_usage():
+    sched = LLMScheduler(rpm=1000, tpm=6000)
+    stats = {"usage": {"total_tokens": 3999}}  # left over from an earlier attempt
+    assert list(sched.stream("u1", 4000, _answers(stats, 1500), stats=stats)) == ["answer"]
+    assert sched.tokens.tokens == pytest.approx(4500, abs=50)
@@ -0,0 +1,48 @@
+import pytest
+
+from llm_stream import ThinkStripper
+
+
+def _strip(chunks):
+    stripper = ThinkStripper()
+    pieces = [stripper.feed(c) for c in chunks]
+    return pieces, "".join(pieces) + stripper.flush()
+
+
+def test_text_without_tags_passes_through_unchanged():
+    pieces, text = _strip(["The offer ", "must be ", "accepted."])
+    assert pieces == ["The offer ", "must be ", "accepted."]
+    assert text == "The offer must be accepted."
+
+
+def test_leading_whitespace_is_dropped_once():
+    assert _strip(["\n\n  ", "Hello", "  world"])[1] == "Hello  world"
+
+
+@pytest.mark.parametrize("split", range(1, len("<think>plan</think>Answer")))
+def test_tags_split_at_any_point(split):
+    text = "<think>plan</think>Answer"
+    assert _strip([text[:split], text[split:]])[1] == "Answer"
+
+
+def test_tags_split_one_character_per_chunk():
+    text = "Intro <think>hidden\nreasoning</think> and answer"
+    pieces, out = _strip(list(text))
+    assert out == "Intro  and answer"
+    assert "hidden" not in "".join(pieces)
+
+
+def test_partial_tag_is_held_back_until_resolved():
+    stripper = ThinkStripper()
+    assert stripper.feed("Answer <th") == "Answer "
+    assert stripper.feed("e end") == "<the end"
+    assert stripper.flush() == ""
+
+
+def test_unclosed_think_block_is_dropped():
+    pieces, text = _strip(["Start. ", "<think>still reasoning", " when the stream ends"])
+    assert text == "Start. "
+
+
+def test_angle_brackets_that_are_not_tags_are_kept():
+    assert _strip(["a < b and b >", " c <thin", "g>"])[1] == "a < b and b > c <thing>"
@@ -0,0 +1,47 @@
+import pytest
+
+from model_router import EmptyCompletion, ModelRouter, classify_turn
+
+
+QUIZ = "Question 1: Which of these is a prime number?\nA) 4\nB) 7\nC) 9\nD) 12"
+
+
+@pytest.mark.parametrize("question, turn_class", [
+    ("hi", "chat"),
+    ("Hello there!", "chat"),
+    ("ok, thanks", "chat"),
+    ("Law", "chat"),
+    ("hi, can you explain IRAC?", "explain"),
+    ("yes, why is that?", "explain"),
+    ("thanks! how does judicial review work in South Africa?", "explain"),
+    ("What is the difference between mitosis and meiosis?", "explain"),
+    ("quiz me on contract law", "explain"),
+])
+def test_classify_without_quiz(question, turn_class):
+    assert classify_turn(question, [{"role": "assistant", "content": "Which faculty are you in?"}]) == turn_class
+
+
+@pytest.mark.parametrize("last_tutor, question, turn_class", [
+    (QUIZ, "B", "quiz"),
+    (QUIZ, "b) because it has two factors", "quiz"),
+    ("True or false: every square is a rectangle.", "true", "quiz"),
+    ("Which difficulty would you like: easy, medium or hard?", "medium", "chat"),
+    ("Which faculty are you in?", "B", "chat"),
+    (QUIZ, "B, but why is 9 not prime?", "quiz"),
+    (QUIZ, "I am not sure, can you explain the first option in more detail please?", "explain"),
+])
+def test_quiz_answers_need_a_quiz_question(last_tutor, question, turn_class):
+    messages = [{"role": "user", "content": "quiz me"}, {"role": "assistant", "content": last_tutor}]
+    assert classify_turn(question, messages) == turn_class
+
+
+def test_empty_completion_fails_over():
+    router = ModelRouter()
+    plan = router.plan("explain")
+    stats = {}
+    out = list(router.stream(plan, lambda route: iter(()) if route is plan[0] else iter(["answer"]), stats=stats))
+    assert out == ["answer"]
+    assert stats["failovers"] == 1 and stats["model"] == plan[1].model
+
+    with pytest.raises(EmptyCompletion):
+        list(router.stream(router.plan("explain"), lambda route: iter(())))
@@ -0,0 +1,45 @@
+import pytest
+
+from benchmarks.bench_normalize import SAMPLES, legacy_normalize
+from output_format import _normalize_uncached, normalize_model_output
+
+
+EDGE_CASES = [
+    "",
+    "No markup at all, just a sentence.",
+    "<P class='x'>Upper-case tags</P><BR>and <STRONG>bold</STRONG>",
+    "<b>unclosed bold and <i>italic</i>",
+    "stray </em> closing tag and a lone < sign, 3 < 4",
+    "<ul>\n  <li>one  </li>\n  <li>two</li>\n</ul>",
+    "<ol><li><strong>Issue</strong>: <em>what</em>?</li></ol>",
+    "<h1>Title</h1><h2>Sub</h2><h6>Tiny</h6><h3>unclosed heading",
+    "<pre><code>if a < b:\n    print('<b>')</code></pre>",
+    "<code>x = 1</code> and <code>y</code>",
+    "<table><tr><td>a</td><td><b>b</b></td></tr><tr><td>c</td><td>d</td></tr></table>",
+    "<table><tr><th>only header</th></tr></table>",
+    "<div><span style='color:red'>styled</span></div><img src='x.png'/>",
+    "```html\n<b>kept inside the fence</b> \\(x\\)\n```\n<b>outside</b> \\(y\\)",
+    "Inline \\(a^2 + b^2\\), block \\[\n c^2 = a^2 + b^2\n\\] and a literal \\n newline",
+    "\\[ unclosed block and \\( unclosed inline",
+    "Escaped $5 and 10% of \\\\ backslashes",
+    "<p>first</p>   \n  <p>second</p>",
+    "mixed ```one``` then <i>two</i> then ```three <b>x</b>```",
+    "if x < 5 then <b>y</b> else z > 2",
+    "<b><b>nested</b></b> and <span class='x'>3 < 4</span>",
+    "<p>para</p><br><br/>next",
+    "<PRE><CODE>shouted code</CODE></PRE>",
+    "<br class='x'> is not a plain line break",
+    "\\( a \\[ b \\) c \\]",
+    "\\[ \\nabla f = 0 \\] uses a literal backslash-n",
+]
+
+
+@pytest.mark.parametrize("text", SAMPLES + EDGE_CASES)
+def test_single_pass_matches_the_legacy_normaliser(text):
+    assert _normalize_uncached(text) == legacy_normalize(text)
+
+
+def test_memoised_output_is_the_same():
+    for text in SAMPLES + EDGE_CASES:
+        assert normalize_model_output(text) == normalize_model_output(text) == legacy_normalize(text)
+    assert normalize_model_output(None) == ""
@@ -0,0 +1,127 @@
+import pymupdf
+import pytest
+
+import pdf_tools
+from pdf_tools import PdfPageCache
+from session_store import SessionStore
+
+
+def _pdf(n_pages):
+    doc = pymupdf.open()
+    for i in range(n_pages):
+        doc.new_page().insert_text((72, 72), f"Page {i} of the reading on contract law.")
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = SessionStore(path=str(tmp_path / "sessions.db"))
+    monkeypatch.setattr(pdf_tools, "get_session_store", lambda: store)
+    monkeypatch.setattr(pdf_tools, "_page_cache", PdfPageCache())
+    return store
+
+
+def test_page_cache_evicts_least_recently_used_by_bytes():
+    cache = PdfPageCache(max_entries=10, max_bytes=100)
+    cache.put("a", ("x" * 40,))
+    cache.put("b", ("y" * 40,))
+    cache.get("a")
+    cache.put("c", ("z" * 40,))
+    assert cache.get("b") is None
+    assert cache.get("a") and cache.get("c")
+    assert cache.nbytes == 80
+
+    # Re-putting a key replaces its size instead of adding to it.
+    cache.put("a", ("x" * 10,))
+    assert cache.nbytes == 50 and len(cache) == 2
+
+    # A document bigger than the whole budget is not cached and evicts nothing.
+    cache.put("huge", ("h" * 101,))
+    assert cache.get("huge") is None
+    assert len(cache) == 2
+
+
+def test_page_cache_evicts_by_entry_count():
+    cache = PdfPageCache(max_entries=2, max_bytes=1 << 20)
+    for key in "abc":
+        cache.put(key, (key,))
+    assert cache.get("a") is None
+    assert len(cache) == 2 and cache.nbytes == 2
+
+
+def test_parallel_extraction_matches_sequential():
+    data = _pdf(7)
+    sequential = pdf_tools.extract_pages(data, workers=1)
+    assert len(sequential) == 7 and "Page 6" in sequential[6]
+    assert pdf_tools.extract_pages(data, workers=3, min_parallel_pages=2) == sequential
+
+
+def test_repeat_upload_skips_extraction_and_survives_eviction(store, monkeypatch):
+    data = _pdf(2)
+    calls = []
+    extract = pdf_tools.extract_pages
+    monkeypatch.setattr(pdf_tools, "extract_pages", lambda d: calls.append(1) or extract(d))
+
+    key, pages = pdf_tools.get_pdf_pages(data)
+    assert key == pdf_tools.content_hash(data)
+    assert pdf_tools.get_pdf_pages(data) == (key, pages)
+    assert len(calls) == 1
+
+    # Out of memory, the pages come back from the session store's copy.
+    monkeypatch.setattr(pdf_tools, "_page_cache", PdfPageCache())
+    assert tuple(pdf_tools.load_pdf_pages(key)) == pages
+    assert pdf_tools.load_pdf_pages("unknown") is None
+
+
+def test_chunks_overlap_within_a_page_only():
+    paras = [f"Paragraph {i} " + "word " * 20 for i in range(6)]
+    pages = ["\n\n".join(paras), "Second page text."]
+    chunks = pdf_tools.chunk_pages(pages, chunk_chars=250, overlap=40)
+
+    assert [p for p, _ in chunks] == [1, 1, 1, 2]
+    assert chunks[-1] == (2, "Second page text.")
+    # The next chunk opens with the last 40 characters of the previous one.
+    assert chunks[1][1].startswith(chunks[0][1][-40:].strip())
+    assert all(len(text) <= 250 + 40 + 1 for _, text in chunks)
+    assert all(f"Paragraph {i}" in " ".join(t for _, t in chunks) for i in range(6))
+
+
+def test_long_paragraph_is_split_with_overlap():
+    text = "".join(f"{i:04d}" for i in range(250))  # 1000 chars, no breaks
+    chunks = pdf_tools.chunk_pages([text], chunk_chars=300, overlap=50)
+    pieces = [t.split("\n")[-1] for _, t in chunks]
+    assert all(len(p) <= 300 for p in pieces)
+    assert pieces[1].startswith(text[250:300])
+    assert text.endswith(pieces[-1][-50:])
+
+
+def test_top_chunks_ranks_and_stops_at_the_token_budget():
+    pages = [
+        "Offer and acceptance form a contract. " * 5,
+        "Photosynthesis happens in the chloroplast. " * 5,
+        "A contract needs consideration and an offer. " * 5,
+        "Mitochondria produce energy for the cell. " * 5,
+    ]
+    index = pdf_tools.PdfChunkIndex(pages)
+    costs = [pdf_tools.count_tokens(t) for _, t in index.chunks]
+
+    ids = index.top_chunks("What makes an offer a contract?", token_budget=10_000)
+    assert set(ids) == {0, 2}
+    ids = index.top_chunks("What makes an offer a contract?", token_budget=max(costs[0], costs[2]))
+    assert len(ids) == 1 and ids[0] in (0, 2)
+
+    # The best chunk is kept even when it alone is over budget.
+    assert index.top_chunks("consideration", token_budget=5) == [2]
+
+    # No term overlap: document order, up to the budget.
+    assert index.top_chunks("quantum", token_budget=costs[0] + costs[1]) == [0, 1]
+
+
+def test_context_is_in_document_order_with_page_markers():
+    index = pdf_tools.PdfChunkIndex(["Torts are civil wrongs.", "Contracts need an offer.", "Torts include negligence."])
+    context, ids = index.context_for("torts negligence", token_budget=1000)
+    assert sorted(ids) == [0, 2]
+    assert context == "[Page 1]\nTorts are civil wrongs.\n\n[Page 3]\nTorts include negligence."
+    assert pdf_tools.PdfChunkIndex(["", "  "]).context_for("anything") == ("", [])
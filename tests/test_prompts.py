@@ -0,0 +1,18 @@
+import re
+
+import pytest
+
+from prompts import MATERIAL_PROMPT, TUTOR_PROMPT
+
+
+@pytest.mark.parametrize("prompt", [MATERIAL_PROMPT, TUTOR_PROMPT])
+def test_system_text_has_no_unfilled_placeholders(prompt):
+    # The system message is sent verbatim; per-turn values only go in the user message.
+    assert not re.search(r"\{\w+\}", prompt.system)
+    assert "pdf_content" not in prompt.system and "rag_context" not in prompt.system
+
+
+def test_turn_message_carries_the_sections_the_instructions_refer_to():
+    user = MATERIAL_PROMPT.messages(pdf_content="[Page 1]\nOffer and acceptance", context="", question="What is an offer?")[1]
+    assert user["content"].startswith("**PDF Content:**\n[Page 1]")
+    assert "**PDF Content**" in MATERIAL_PROMPT.system
@@ -0,0 +1,62 @@
+import os
+
+import numpy as np
+
+from benchmarks.bench_retrieval import synthetic_tfidf
+from rag_backends import IVF_FILE, ExactBackend, IVFBackend, make_backend
+from rag_index import EmbeddingIndex
+
+
+def _normalized(rows):
+    return rows / np.maximum(np.linalg.norm(rows, axis=1, keepdims=True), 1e-12)
+
+
+def _recall(got, truth):
+    return np.mean([len(set(g) & set(t)) / len(t) for g, t in zip(got, truth)])
+
+
+def test_exact_search_is_the_default():
+    assert isinstance(make_backend("exact"), ExactBackend)
+    assert isinstance(make_backend("no-such-backend"), ExactBackend)
+
+
+def test_ivf_round_trip_through_its_file(tmp_path):
+    data = synthetic_tfidf(2050, 256, topics=40)
+    index = EmbeddingIndex(data[:2000], backend=IVFBackend(nlist=20, nprobe=4, min_rows=0))
+    index.save_backend(str(tmp_path))
+    assert os.path.exists(tmp_path / IVF_FILE)
+
+    loaded = IVFBackend(nlist=20, nprobe=4, min_rows=0)
+    assert loaded.load(str(tmp_path), index.matrix)
+    for a, b in zip(index.backend._state, loaded._state):
+        assert np.array_equal(a, b)
+    again = EmbeddingIndex(index.matrix, normalized=True, backend=loaded)
+    queries = _normalized(data[2000:])
+    assert np.array_equal(again.search(queries, 5)[0], index.search(queries, 5)[0])
+
+    # A clustering for another matrix, or a damaged file, is not reused.
+    assert not IVFBackend(min_rows=0).load(str(tmp_path), index.matrix[:1999])
+    (tmp_path / IVF_FILE).write_bytes(b"not an npz")
+    assert not IVFBackend(min_rows=0).load(str(tmp_path), index.matrix)
+
+
+def test_ivf_results_after_update_keep_recall():
+    data = synthetic_tfidf(3100, 256, topics=40, seed=1)
+    base, changed, appended, queries = data[:2500], data[2500:2700], data[2700:3000], _normalized(data[3000:])
+    index = EmbeddingIndex(base, ids=list(range(2500)), backend=IVFBackend(nlist=25, nprobe=8, min_rows=0))
+    centroids = index.backend._state[0]
+
+    # Replace 200 rows and append 300: rows are re-assigned, centroids kept.
+    ids = list(range(200)) + list(range(2500, 2800))
+    index.upsert(np.vstack([changed, appended]), ["" for _ in ids], ids)
+    assert index.backend._state[0] is centroids
+    assert index.backend._state[1].shape[0] == len(index) == 2800
+
+    exact = EmbeddingIndex(index.matrix, normalized=True, backend=ExactBackend())
+    truth = exact.search(queries, 5)[0]
+    got = index.search(queries, 5)[0]
+    assert _recall(got, truth) >= 0.9
+
+    # Every appended row is found by a query equal to it.
+    top = index.search(_normalized(appended), 1)[0][:, 0]
+    assert np.array_equal(top, np.arange(2500, 2800))
@@ -0,0 +1,111 @@
+import math
+
+import numpy as np
+import pytest
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from rag_bm25 import BM25Index, HybridRetriever, module_codes, tokenize
+from rag_index import EmbeddingIndex
+
+
+COURSES = [
+    ("Law of contract: offer, acceptance and breach of contract. MPRS2613", "Law"),
+    ("Criminal law and criminal procedure in South African courts.", "Law"),
+    ("Constitutional law, judicial review and the Bill of Rights.", "Law"),
+    ("Cell biology: the cell membrane, mitosis and meiosis. BLGY1514", "Natural Sciences"),
+    ("Genetics and evolution of plant and animal cells.", "Natural Sciences"),
+    ("Financial accounting: balance sheets, contract costing and audits. ACCF1624", "Economic Sciences"),
+    ("Microeconomics: supply, demand and market contracts.", "Economic Sciences"),
+]
+
+
+def _corpus(n=60, seed=0):
+    rng = np.random.default_rng(seed)
+    words = ["contract", "tort", "cell", "gene", "market", "audit", "court", "plant", "energy", "demand"]
+    return [" ".join(rng.choice(words, size=rng.integers(3, 15))) for _ in range(n)]
+
+
+def _reference_bm25(descriptions, query, k1=1.2, b=0.75):
+    docs = [tokenize(d) for d in descriptions]
+    avgdl = sum(map(len, docs)) / len(docs)
+    out = np.zeros(len(docs))
+    for term in set(tokenize(query)):
+        df = sum(term in d for d in docs)
+        if not df:
+            continue
+        idf = math.log1p((len(docs) - df + 0.5) / (df + 0.5))
+        for i, d in enumerate(docs):
+            tf = d.count(term)
+            if tf:
+                out[i] += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * len(d) / avgdl))
+    return out
+
+
+@pytest.mark.parametrize("query", ["contract", "cell gene", "market demand audit"])
+def test_exhaustive_search_matches_the_bm25_formula(query):
+    corpus = _corpus()
+    ref = _reference_bm25(corpus, query)
+    docs, scores = BM25Index(corpus, max_postings=10**9).search(query, k=10)
+    assert np.allclose(scores, np.sort(ref)[::-1][:10], rtol=1e-4)
+    assert np.allclose(ref[docs], scores, rtol=1e-4)
+
+
+@pytest.mark.parametrize("query", ["contract", "cell", "market"])
+def test_pruned_postings_keep_the_single_term_top_k(query):
+    corpus = _corpus()
+    exhaustive = BM25Index(corpus, max_postings=10**9).search(query, k=5)
+    pruned = BM25Index(corpus, max_postings=5).search(query, k=5)
+    # Same scores; documents tied at the cut-off may come back in another order.
+    assert np.allclose(pruned[1], exhaustive[1])
+    assert np.allclose(_reference_bm25(corpus, query)[pruned[0]], pruned[1], rtol=1e-4)
+
+
+def test_pruned_multi_term_search_matches_on_a_small_corpus():
+    corpus = _corpus(n=40, seed=3)
+    exhaustive = BM25Index(corpus, max_postings=10**9).search("contract court demand", k=3)
+    pruned_index = BM25Index(corpus, max_postings=25)
+    assert np.diff(pruned_index.offsets).max() > 25  # pruning really cuts some lists
+    pruned = pruned_index.search("contract court demand", k=3)
+    assert list(pruned[0]) == list(exhaustive[0])
+
+
+def _retriever(weight=0.5):
+    descriptions = [d for d, _ in COURSES]
+    vectorizer = TfidfVectorizer(stop_words="english").fit(descriptions)
+    index = EmbeddingIndex(
+        vectorizer.transform(descriptions), descriptions=descriptions, ids=list(range(100, 100 + len(COURSES))),
+        metadata=[{"faculty": f} for _, f in COURSES],
+    )
+    return HybridRetriever(index, weight=weight, vectorizer=vectorizer), vectorizer
+
+
+def _ids(retriever, vectorizer, question, k=3, filters=None):
+    return [rid for rid, _ in retriever.top_rows(question, vectorizer.transform([question]), k=k, filters=filters)]
+
+
+def test_faculty_filter_limits_results():
+    retriever, vectorizer = _retriever()
+    assert set(_ids(retriever, vectorizer, "contract", k=5, filters={"faculty": "Law"})) <= {100, 101, 102}
+    assert _ids(retriever, vectorizer, "contract", k=5, filters={"faculty": "economic sciences"})[0] in (105, 106)
+    # A filter that matches nothing falls back to the unfiltered search.
+    assert _ids(retriever, vectorizer, "contract", k=1, filters={"faculty": "Theology"}) == \
+        _ids(retriever, vectorizer, "contract", k=1)
+
+
+def test_module_code_hits():
+    retriever, vectorizer = _retriever()
+    question = "What are the outcomes of mprs2613?"
+    assert module_codes(question) == ["MPRS2613"]
+    assert _ids(retriever, vectorizer, question, k=1) == [100]
+    assert _ids(retriever, vectorizer, "cells", k=2, filters={"module": module_codes("BLGY1514 cells")}) == [103]
+
+
+def test_fusion_weight_switches_between_bm25_and_cosine():
+    question = "criminal contract"
+    bm25_only, vectorizer = _retriever(weight=1.0)
+    cosine_only, _ = _retriever(weight=0.0)
+    bm25_order = bm25_only.bm25().search(question, k=3)[0]
+    assert _ids(bm25_only, vectorizer, question) == [100 + i for i in bm25_order]
+    cos = (cosine_only.index.matrix @ vectorizer.transform([question]).T).toarray().ravel()
+    top = [i for i in np.argsort(-cos, kind="stable") if cos[i] > 0][:2]
+    assert _ids(cosine_only, vectorizer, question, k=2) == [100 + i for i in top]
@@ -0,0 +1,81 @@
+import json
+import os
+
+import numpy as np
+import pytest
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+import rag_store
+from benchmarks.fakes import FakeSupabase
+from rag_index import EmbeddingIndex
+from rag_sync import CourseEmbeddingSync
+
+
+def _row(rid, embedding, updated):
+    return {
+        "id": rid, "course_description": f"course {rid}",
+        "embedding": "[" + ",".join(str(v) for v in embedding) + "]", "updated_at": f"2025-01-01T00:00:{updated:02d}",
+    }
+
+
+def test_rows_of_another_width_are_rejected_and_hold_the_watermark():
+    rows = [_row(1, [1, 0, 0], 1), _row(2, [0, 1], 2), _row(3, [0, 0, 1], 3)]
+    syncer = CourseEmbeddingSync(FakeSupabase({"course_embeddings": rows}, latency=0), snapshot_dir=None)
+    index = EmbeddingIndex(np.eye(3, dtype=np.float32)[:1], descriptions=["seed"], ids=[0])
+
+    assert syncer.sync(index) == 2
+    assert sorted(index.ids) == [0, 1, 3]
+    # Stops before row 2, so it is fetched again once it has been rebuilt.
+    assert syncer.watermark == ("2025-01-01T00:00:01", 1)
+
+    rows[1].update(_row(2, [0, 1, 0], 4))
+    assert syncer.sync(index) == 2
+    assert sorted(index.ids) == [0, 1, 2, 3]
+    assert syncer.watermark == ("2025-01-01T00:00:04", 2)
+
+
+def test_builder_snapshot_without_upsert_is_not_synced(tmp_path):
+    rag_store.save_snapshot(
+        np.eye(3, dtype=np.float32)[:1], [0], ["seed"], str(tmp_path),
+        extra_meta={"build": {"upserted": False}, "watermark": [None, 0], "updated_col": "updated_at"},
+    )
+    client = FakeSupabase({"course_embeddings": [_row(1, [0, 1], 1)]}, latency=0)
+    syncer = CourseEmbeddingSync(client, snapshot_dir=str(tmp_path))
+
+    index = syncer.load_index()
+    assert index.ids == [0]
+    assert syncer.sync(index) == 0
+    assert not syncer.sync_in_background(index, min_interval=0)
+
+    with open(os.path.join(tmp_path, rag_store.SNAPSHOT_META), encoding="utf-8") as f:
+        assert json.load(f)["build"]["upserted"] is False
+
+
+def test_full_load_stamps_the_vectorizer_and_refuses_another(tmp_path):
+    first = TfidfVectorizer().fit(["law contract tort"])
+    other = TfidfVectorizer().fit(["cell gene virus"])
+    rows = [_row(1, [1, 0, 0], 1), _row(2, [0, 1, 0], 2)]
+    syncer = CourseEmbeddingSync(FakeSupabase({"course_embeddings": rows}, latency=0), snapshot_dir=str(tmp_path))
+    syncer.full_load(first)
+    assert syncer.build_meta["vectorizer_version"] == rag_store.vectorizer_fingerprint(first)
+
+    # Same width, different vocabulary: only the fingerprint tells them apart.
+    with pytest.raises(rag_store.SnapshotMismatch):
+        syncer.full_load(other)
+    with pytest.raises(rag_store.SnapshotMismatch):
+        CourseEmbeddingSync(FakeSupabase({"course_embeddings": rows}, latency=0), snapshot_dir=str(tmp_path)).load_index(other)
+
+
+def test_incremental_sync_skips_null_updated_at_and_terminates():
+    rows = [_row(i, [1, 0, 0], i) for i in range(1, 4)]
+    for rid in (4, 5, 6):
+        rows.append(dict(_row(rid, [0, 1, 0], 0), updated_at=None))
+    syncer = CourseEmbeddingSync(FakeSupabase({"course_embeddings": rows}, latency=0), snapshot_dir=None, page_size=2)
+
+    pages = list(syncer.iter_pages(changed_only=True))
+    assert [r["id"] for page in pages for r in page] == [1, 2, 3]
+
+    index = EmbeddingIndex(np.eye(3, dtype=np.float32)[:1], descriptions=["seed"], ids=[0])
+    assert syncer.sync(index) == 3
+    assert syncer.watermark == ("2025-01-01T00:00:03", 3)
+    assert syncer.sync(index) == 0
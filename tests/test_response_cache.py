@@ -0,0 +1,36 @@
+import os
+
+import pytest
+
+from rag_store import load_vectorizer
+from response_cache import MemoryBackend, ResponseCache, SQLiteBackend
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="module")
+def vectorizer():
+    return load_vectorizer(os.path.join(ROOT, "tfidf_vectorizer.joblib"))
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def cache(request, tmp_path):
+    backend = MemoryBackend() if request.param == "memory" else SQLiteBackend(str(tmp_path / "cache.db"))
+    return ResponseCache(backend)
+
+
+@pytest.mark.parametrize("asked, other", [
+    ("what is photosynthesis in biology", "what is mitosis in biology"),
+    ("explain the law of contract", "explain the law of delict"),
+])
+def test_out_of_vocabulary_questions_do_not_share_answers(cache, vectorizer, asked, other):
+    # Same course-vectorizer vector (cosine 1.0), different questions.
+    cache.put("scope", asked, "answer", vectorizer.transform([asked]))
+    assert cache.get("scope", other, vectorizer.transform([other])) is None
+
+
+def test_rephrased_question_is_a_semantic_hit(cache, vectorizer):
+    cache.put("scope", "What is the law of contract?", "answer", vectorizer.transform(["law of contract"]))
+    asked = "what's the law of contract"
+    assert cache.get("scope", asked, vectorizer.transform([asked])) == "answer"
+    assert cache.semantic_hits == 1
@@ -0,0 +1,45 @@
+import gc
+import os
+import time
+
+from session_store import SessionStore
+
+
+def test_collected_sessions_give_their_bytes_back(tmp_path):
+    store = SessionStore(path=str(tmp_path / "sessions.db"), session_bytes=1024, total_bytes=4096)
+    sessions = [store.messages() for _ in range(5)]
+    for msgs in sessions:
+        for i in range(20):
+            msgs.append({"role": "user", "content": f"question {i} " * 20})
+    del msgs
+    assert store.stats()["bytes"] == sum(m.nbytes for m in sessions) > 0
+
+    # Collected sessions release exactly their share; the live one keeps its bytes.
+    kept = sessions[0].nbytes
+    del sessions[1:]
+    gc.collect()
+    assert store.stats()["bytes"] == kept
+
+    del sessions
+    gc.collect()
+    assert store.stats()["sessions"] == 0
+    assert store.stats()["bytes"] == 0
+
+
+def test_blobs_stay_within_their_disk_budget(tmp_path):
+    store = SessionStore(path=str(tmp_path / "sessions.db"), blob_bytes=30_000)
+    pages = [os.urandom(9_000) for _ in range(5)]  # incompressible
+    for i, page in enumerate(pages):
+        store.put_blob("pdf_pages", f"doc{i}", page)
+        if i == 1:
+            store.get_blob("pdf_pages", "doc0")  # touched, so doc1 is older now
+        time.sleep(0.01)
+
+    assert store.stats()["blob_bytes"] <= 30_000
+    assert store.stats()["blob_evictions"] == 2
+    assert store.get_blob("pdf_pages", "doc1") is None
+    assert store.get_blob("pdf_pages", "doc4") == pages[4]
+
+    # The running total survives a restart.
+    assert SessionStore(path=str(tmp_path / "sessions.db"), blob_bytes=30_000).stats()["blob_bytes"] == \
+        store.stats()["blob_bytes"]
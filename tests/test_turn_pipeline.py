@@ -0,0 +1,79 @@
+import threading
+import time
+
+import pytest
+
+from benchmarks.fakes import FakeAsyncGroq
+from llm_stream import astream_completion
+from turn_pipeline import FirstTokenTimeout, Turn, TurnCancelled, TurnTimeout
+
+MESSAGES = [{"role": "system", "content": "You are a tutor."}, {"role": "user", "content": "What is a tort?"}]
+
+
+def _factory(client, closed=None):
+    # The production call path, plus a flag set when the upstream stream is torn down.
+    async def agen():
+        try:
+            async for text in astream_completion(client, model="m", messages=MESSAGES):
+                yield text
+        finally:
+            if closed is not None:
+                closed.set()
+    return agen
+
+
+def _fail():
+    raise RuntimeError("supabase down")
+
+
+def test_prepare_drops_slow_and_failing_stages():
+    results = Turn().prepare(
+        {"rag": lambda: "context", "history": lambda: time.sleep(1) or "late", "broken": _fail}, timeout=0.2,
+    )
+    assert results == {"rag": "context", "history": None, "broken": None}
+
+
+def test_stream_relays_every_chunk():
+    client = FakeAsyncGroq(latency=0, token_rate=0, answer_tokens=12, chunk_tokens=4)
+    assert "".join(Turn().stream(_factory(client))).split() == [f"word{i}" for i in range(12)]
+
+
+def test_first_token_timeout_cancels_the_upstream():
+    closed = threading.Event()
+    client = FakeAsyncGroq(latency=2, token_rate=0)
+    t0 = time.monotonic()
+    with pytest.raises(FirstTokenTimeout):
+        list(Turn().stream(_factory(client, closed), first_timeout=0.1))
+    assert time.monotonic() - t0 < 1
+    assert closed.wait(1)
+
+
+def test_turn_timeout_after_the_first_chunk():
+    # First chunk in time, then too slow for the turn deadline.
+    client = FakeAsyncGroq(latency=0, token_rate=20, answer_tokens=40, chunk_tokens=4)
+    got = []
+    with pytest.raises(TurnTimeout):
+        for text in Turn(timeout=0.5).stream(_factory(client), first_timeout=0.4):
+            got.append(text)
+    assert 0 < len(got) < 10
+
+
+def test_cancel_stops_the_stream_and_later_stages():
+    closed = threading.Event()
+    client = FakeAsyncGroq(latency=0, token_rate=20, answer_tokens=40, chunk_tokens=4)
+    turn = Turn()
+    threading.Timer(0.3, turn.cancel).start()
+    with pytest.raises(TurnCancelled):
+        list(turn.stream(_factory(client, closed)))
+    assert closed.wait(1)
+    with pytest.raises(TurnCancelled):
+        turn.prepare({"rag": lambda: "context"})
+
+
+def test_closing_the_stream_early_cancels_the_upstream():
+    closed = threading.Event()
+    client = FakeAsyncGroq(latency=0, token_rate=20, answer_tokens=40, chunk_tokens=4)
+    gen = Turn().stream(_factory(client, closed))
+    assert next(gen)
+    gen.close()
+    assert closed.wait(1)
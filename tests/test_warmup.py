@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+import rag_store
+import warmup
+from rag_sync import CourseEmbeddingSync
+
+
+@pytest.fixture
+def stale_snapshot(tmp_path, monkeypatch):
+    # A snapshot on disk, and a load that fails for a reason other than a mismatch.
+    built_with = TfidfVectorizer().fit(["law contract tort"])
+    rag_store.save_snapshot(
+        np.eye(3, dtype=np.float32), [1, 2, 3], ["law", "contract", "tort"], str(tmp_path),
+        extra_meta={"vectorizer_version": rag_store.vectorizer_fingerprint(built_with)},
+    )
+    monkeypatch.setattr(rag_store, "SNAPSHOT_DIR", str(tmp_path))
+
+    def _fail(self, vectorizer=None):
+        raise ConnectionError("supabase unreachable")
+
+    monkeypatch.setattr(CourseEmbeddingSync, "load_index", _fail)
+    return built_with
+
+
+def test_stale_snapshot_is_served_as_degraded(stale_snapshot):
+    with pytest.raises(warmup.Degraded) as info:
+        warmup.load_rag(None, stale_snapshot)
+    index, _, retriever = info.value.result
+    assert sorted(index.ids) == [1, 2, 3]
+    assert retriever.vectorizer is stale_snapshot
+
+
+def test_stale_snapshot_from_another_vectorizer_is_refused(stale_snapshot):
+    # Same width, different vocabulary.
+    other = TfidfVectorizer().fit(["cell gene virus"])
+    with pytest.raises(rag_store.SnapshotMismatch):
+        warmup.load_rag(None, other)
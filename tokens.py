@@ -0,0 +1,27 @@
+import math
+import re
+from functools import lru_cache
+
+
+# ---------- Local token-count approximation --------------------------------------
+# Close enough to BPE tokenizers (gpt-oss/cl100k-style) for budgeting prompts
+# without a network call or a heavyweight tokenizer dependency: short words are
+# one token, long words ~4 characters per token, punctuation/emoji one each.
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+
+@lru_cache(maxsize=4096)
+def _count_cached(text: str) -> int:
+    n = 0
+    for m in _TOKEN_RE.finditer(text):
+        n += max(1, math.ceil(len(m.group()) / 4))
+    return n
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    # Very long texts (whole PDFs) are not worth keeping in the LRU.
+    if len(text) > 20000:
+        return _count_cached.__wrapped__(text)
+    return _count_cached(text)
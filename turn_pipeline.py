@@ -0,0 +1,166 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import logging
+import os
+import queue
+import threading
+import time
+
+
+# Whole turn, from the first prep stage to the last streamed token.
+TURN_TIMEOUT = float(os.environ.get("TURN_TIMEOUT", 120))
+# Prep stages (retrieval, history) that miss this are skipped, not waited for.
+TURN_PREP_TIMEOUT = float(os.environ.get("TURN_PREP_TIMEOUT", 5))
+
+
+class TurnCancelled(Exception):
+    pass
+
+
+class TurnTimeout(Exception):
+    pass
+
+
+class FirstTokenTimeout(Exception):
+    # Only the first chunk was late; the turn itself may still go on (failover).
+    pass
+
+
+# ---------- Shared event loop ------------------------------------------------------
+# One asyncio loop per process, on a daemon thread. Streamlit script threads hand
+# coroutines to it with run_coroutine_threadsafe, so every session's Groq
+# streams share one loop and one async connection pool instead of each blocking
+# a thread on its own socket.
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    with _loop_lock:
+        if _loop is None or _loop.is_closed():
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="turn-pipeline-loop", daemon=True).start()
+            _loop = loop
+        return _loop
+
+
+_DONE = object()
+
+
+# ---------- One tutoring turn ------------------------------------------------------
+class Turn:
+    # Runs the stages of one turn on the shared loop under a single deadline.
+    # prepare() runs independent, blocking stages side by side in worker threads;
+    # stream() relays an async token stream to the (synchronous) script thread.
+    # cancel() - e.g. when the student has already sent a newer message - stops
+    # whatever is still running; so does abandoning the stream() generator, which
+    # is what happens when Streamlit interrupts a run for a rerun.
+    def __init__(self, timeout: float = TURN_TIMEOUT):
+        self.timeout = timeout
+        self.deadline = time.monotonic() + timeout
+        self.cancelled = False
+        self._lock = threading.Lock()
+        self._futures = set()
+        self._queues = []
+
+    def remaining(self) -> float:
+        return max(0.0, self.deadline - time.monotonic())
+
+    def _submit(self, coro):
+        with self._lock:
+            if self.cancelled:
+                coro.close()
+                raise TurnCancelled()
+            fut = asyncio.run_coroutine_threadsafe(coro, get_loop())
+            self._futures.add(fut)
+        fut.add_done_callback(lambda f: self._futures.discard(f))
+        return fut
+
+    def cancel(self) -> None:
+        with self._lock:
+            self.cancelled = True
+            futures, queues = list(self._futures), list(self._queues)
+        for fut in futures:
+            fut.cancel()
+        for q in queues:
+            q.put((_DONE, TurnCancelled()))
+
+    def prepare(self, stages, timeout: float = TURN_PREP_TIMEOUT) -> dict:
+        # stages: {name: callable}. Returns {name: result}; a stage that fails or
+        # misses the timeout yields None so the turn can go ahead without it.
+        # Each stage runs in a copy of the caller's context, so telemetry spans
+        # inside it still land in the current turn record.
+        calls = {name: (contextvars.copy_context(), fn) for name, fn in stages.items()}
+
+        async def _run():
+            tasks = {name: asyncio.create_task(asyncio.to_thread(ctx.run, fn)) for name, (ctx, fn) in calls.items()}
+            done, pending = await asyncio.wait(tasks.values(), timeout=min(timeout, self.remaining()))
+            for task in pending:
+                task.cancel()
+            results = {}
+            for name, task in tasks.items():
+                if task in pending:
+                    logging.warning("Turn stage %s timed out after %.1fs; continuing without it", name, timeout)
+                    results[name] = None
+                elif task.exception() is not None:
+                    logging.warning("Turn stage %s failed: %s", name, task.exception())
+                    results[name] = None
+                else:
+                    results[name] = task.result()
+            return results
+
+        fut = self._submit(_run())
+        try:
+            return fut.result()
+        except concurrent.futures.CancelledError:
+            raise TurnCancelled() from None
+
+    def stream(self, agen_factory, first_timeout: float = None):
+        # Yields the items of the async generator agen_factory() on the script
+        # thread. Raises TurnTimeout at the deadline, FirstTokenTimeout when
+        # nothing arrived within first_timeout, and TurnCancelled on cancel();
+        # closing the generator early cancels the upstream request.
+        q = queue.Queue()
+        with self._lock:
+            self._queues.append(q)
+
+        async def _pump():
+            try:
+                async for item in agen_factory():
+                    q.put((item, None))
+            except asyncio.CancelledError:
+                q.put((_DONE, TurnCancelled()))
+                raise
+            except Exception as e:
+                q.put((_DONE, e))
+            else:
+                q.put((_DONE, None))
+
+        fut = self._submit(_pump())
+        first = True
+        try:
+            while True:
+                wait = self.remaining()
+                if first and first_timeout is not None and first_timeout < wait:
+                    try:
+                        item, err = q.get(timeout=first_timeout)
+                    except queue.Empty:
+                        raise FirstTokenTimeout(f"no output within {first_timeout:g}s") from None
+                else:
+                    try:
+                        item, err = q.get(timeout=wait)
+                    except queue.Empty:
+                        raise TurnTimeout(f"turn exceeded {self.timeout:g}s") from None
+                first = False
+                if item is _DONE:
+                    if err is not None:
+                        raise err
+                    return
+                yield item
+        finally:
+            fut.cancel()
+            with self._lock:
+                if q in self._queues:
+                    self._queues.remove(q)
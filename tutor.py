@@ -1,26 +1,30 @@
 import streamlit as st
-import fitz  # PyMuPDF for PDF processing
-from groq import Groq
 import os
-import pymupdf
-import re
-from openai import OpenAI
-import textwrap
 import time
-import pandas as pd
-import numpy as np
 from streamlit_autorefresh import st_autorefresh
-from supabase import create_client, Client
-import ast
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-import joblib
-import platform
+from supabase import Client
 from datetime import datetime, timezone
 import logging
 import sys
-import html
-import re as _re
+import uuid
+from access_log import get_access_log_writer
+from clients import (
+    get_async_groq_client, get_supabase_client, groq_app_key, pool_stats, supabase_keys, vectors_supabase_keys,
+)
+from rag_bm25 import module_codes
+from llm_stream import astream_completion
+from chat_history import HistoryManager
+from response_cache import get_response_cache, history_key, make_scope
+from output_format import normalize_model_output
+from pdf_tools import PDF_CONTEXT_TOKENS, get_pdf_chunk_index, get_pdf_pages
+from session_store import get_session_store
+from llm_scheduler import QueueTimeout, get_scheduler, is_rate_limit
+from tokens import count_tokens
+from prompts import MATERIAL_PROMPT, TUTOR_PROMPT
+from telemetry import get_telemetry
+from turn_pipeline import Turn, TurnTimeout
+from model_router import EmptyCompletion, classify_turn, get_router
+from warmup import get_warmup, start_default as start_warmup
 
 # ---------- Logging (keep helpful, non-intrusive) ---------------------------------
 def _init_debug_logging():
@@ -50,9 +54,14 @@ def _log_exc(msg, e=None):
 
 
 _init_debug_logging()
+# Stage timings and token usage per turn; see telemetry.py for the sink settings.
+telemetry = get_telemetry()
+# Loads the course index, vectorizer and client pools in background threads (a
+# no-op once serve.py or an earlier run has started it); see warmup.py.
+start_warmup(st.secrets)
 
 
-# ---------- Groq client with ASCII-only headers (avoid httpx header errors) ------
+# ---------- Groq API key resolution ----------------------------------------------
 GROQ_KEYS_URL = (
     "https://console.groq.com/keys?_gl=1*129xulo*_gcl_au*MTMyNzU2Njk3Ny4xNzU5MzA0MzU5*_ga*NTk2NDgyMDAzLjE3NTkzMDQzNTk."
     "*_ga_4TD0X2GEZG*czE3NjIzMjYzNTYkbzQkZzEkdDE3NjIzMjYzOTYkajIwJGwwJGgw"
@@ -77,35 +86,7 @@ def _resolve_groq_api_key() -> str:
     key = _normalize_api_key(st.session_state.get("user_groq_api_key", ""))
     if key.startswith("gsk_"):
         return key
-    try:
-        fallback = st.secrets.get("groq", {}).get("api_key", "")
-    except Exception:
-        fallback = ""
-    return _normalize_api_key(fallback)
-
-
-def _sanitize_ascii(value: str) -> str:
-    try:
-        return value.encode("ascii", "ignore").decode("ascii")
-    except Exception:
-        return ""
-
-
-class SafeGroq(Groq):
-    @property
-    def default_headers(self) -> dict:
-        base = super().default_headers
-        safe = {k: _sanitize_ascii(str(v)) for k, v in base.items()}
-        safe.update(
-            {
-                "User-Agent": "groq-python",
-                "X-Stainless-OS": "Windows",
-                "X-Stainless-Arch": "x64",
-                "X-Stainless-Runtime": "CPython",
-                "X-Stainless-Runtime-Version": _sanitize_ascii(platform.python_version() or "3"),
-            }
-        )
-        return safe
+    return _normalize_api_key(groq_app_key(st.secrets))
 
 
 def login_screen():
@@ -174,72 +155,30 @@ else:
             _log_exc("_report_access_log_status failed", e)
 
     def _get_root_supabase_keys():
-        try:
-            url = str(st.secrets.get("SUPABASE_URL", "")).strip()
-            key = ""
-            for kname in ("SUPABASE_SERVICE_ROLE_KEY", "SUPABASE_ANON_KEY"):
-                if not key:
-                    key = str(st.secrets.get(kname, "")).strip()
-            if url and key:
-                return url, key
-        except Exception as e:
-            _log_exc("top-level SUPABASE secrets read failed", e)
-
-        try:
-            sb = st.secrets.get("supabase", {}) or {}
-            cand_urls = [sb.get("url"), sb.get("URL"), sb.get("supabase_url"), sb.get("SUPABASE_URL")]
-            cand_keys = [
-                sb.get("service_role_key"), sb.get("SERVICE_ROLE_KEY"),
-                sb.get("supabase_service_role_key"), sb.get("SUPABASE_SERVICE_ROLE_KEY"),
-                sb.get("anon_key"), sb.get("ANON_KEY"),
-            ]
-            url = (next((x for x in cand_urls if x), "") or "").strip()
-            key = (next((x for x in cand_keys if x), "") or "").strip()
-            if url and key:
-                return url, key
-        except Exception as e:
-            _log_exc("[supabase] table fallback failed", e)
-
-        url = (os.environ.get("SUPABASE_URL") or "").strip()
-        key = (os.environ.get("SUPABASE_SERVICE_ROLE_KEY") or os.environ.get("SUPABASE_ANON_KEY") or "").strip()
-        if url and key:
-            return url, key
-
-        try:
-            vec_cfg = st.secrets.get("vectors", {}) or {}
-            url = (vec_cfg.get("SUPABASE_URL1") or vec_cfg.get("url") or "").strip()
-            key = (vec_cfg.get("SUPABASE_KEY1") or vec_cfg.get("key") or "").strip()
-            if url and key:
-                return url, key
-        except Exception:
-            pass
-        return "", ""
+        return supabase_keys(st.secrets)
 
     def _get_access_supabase_client():
         try:
             url, key = _get_root_supabase_keys()
             if not url or not key:
                 return None
-            return create_client(url, key)
+            return get_supabase_client(url, key)
         except Exception as e:
             _log_exc("Failed to init Supabase client", e)
             return None
 
     def _record_login_if_needed(supabase_client, email, name):
+        # Queued for the background writer: the page never waits on Supabase here.
         if not supabase_client or not email or st.session_state.get("access_log_id"):
             return
         ts = datetime.now(timezone.utc).isoformat()
         meta = {"event": "login", "login_ts": ts, "app": "A_STEP_Tutor"}
         try:
-            resp = supabase_client.table("user_access_logs").insert(
-                {"user_email": email, "user_name": name or None, "meta": meta}
-            ).execute()
-            data = getattr(resp, "data", None)
-            if data and isinstance(data, list) and data:
-                st.session_state["access_log_id"] = data[0].get("id")
-                st.session_state["access_meta"] = meta
-                st.session_state["session_started_at"] = time.time()
-                # success toast intentionally suppressed
+            session_key = uuid.uuid4().hex
+            get_access_log_writer(supabase_client).log_login(session_key, email, name, meta)
+            st.session_state["access_log_id"] = session_key
+            st.session_state["access_meta"] = meta
+            st.session_state["session_started_at"] = time.time()
         except Exception as e:
             _log_exc("Access log insert failed", e)
 
@@ -255,7 +194,7 @@ else:
             ts = datetime.now(timezone.utc).isoformat()
             meta = dict(st.session_state.get("access_meta", {}))
             meta.update({"logout_ts": ts, "duration_sec": duration, "event": "logout"})
-            supabase_client.table("user_access_logs").update({"meta": meta}).eq("id", log_id).execute()
+            get_access_log_writer(supabase_client).log_logout(log_id, meta)
             _report_access_log_status("Access log updated with logout time.", level="success")
         except Exception as e:
             _log_exc("Access log update failed", e)
@@ -274,33 +213,20 @@ else:
     if not api_key or not api_key.startswith("gsk_"):
         st.stop()
 
-    py_ver = _sanitize_ascii(platform.python_version())
-    arch = _sanitize_ascii("x64" if "64" in (platform.machine() or "") else "x32")
-    os_name = _sanitize_ascii("Windows" if platform.system().lower() == "windows" else platform.system())
-    default_headers = {
-        "User-Agent": "groq-python",
-        "X-Stainless-OS": os_name or "Windows",
-        "X-Stainless-Arch": arch or "x64",
-        "X-Stainless-Runtime": "CPython",
-        "X-Stainless-Runtime-Version": py_ver or "3",
-    }
-    client = SafeGroq(api_key=api_key, default_headers=default_headers)
+    # Process-level async client per API key: every session's turns stream over
+    # its keep-alive pool on the shared turn-pipeline loop (turn_pipeline.py).
+    client = get_async_groq_client(api_key)
 
     def _get_vectors_supabase_client():
         try:
-            vec_cfg = st.secrets.get("vectors", {}) or {}
-            use_separate = bool(vec_cfg.get("use_separate_project", False))
-            url1 = (vec_cfg.get("SUPABASE_URL1") or "").strip()
-            key1 = (vec_cfg.get("SUPABASE_KEY1") or "").strip()
-            if use_separate and url1 and key1:
-                return create_client(url1, key1)
-            url, key = _get_root_supabase_keys()
-            return create_client(url, key) if url and key else None
+            url, key = vectors_supabase_keys(st.secrets)
+            return get_supabase_client(url, key) if url and key else None
         except Exception as e:
             # _log_exc("Failed to init vectors Supabase client", e)
             return None
 
     supabase: Client = _get_vectors_supabase_client()
+    logging.debug("HTTP client pool stats: %s", pool_stats.snapshot())
 
     # ============================== UI Chrome ===================================
     st.markdown(
@@ -340,80 +266,157 @@ else:
         [":rainbow[Tutor Session Mode]", "***Material Engagement***"],
         captions=["Engagement with a GenAI tutor", "Material Assistance with GenAI"],
     )
-    
-    # Convert LaTeX delimiters and render with markdown so math shows nicely
-    LATEX_CODE_BLOCK_RE = _re.compile(r"```.*?```", _re.DOTALL)
-    def _convert_tex_delimiters(text: str) -> str:
-        try:
-            parts = LATEX_CODE_BLOCK_RE.split(text)
-            fences = LATEX_CODE_BLOCK_RE.findall(text)
-            out = []
-            for i, seg in enumerate(parts):
-                s = _re.sub(r"\\\[(.*?)\\\]", r"$$\1$$", seg, flags=_re.DOTALL)
-                s = _re.sub(r"\\\((.*?)\\\)", r"$\1$", s)
-                # Normalize double backslashes often used for line breaks
-                s = s.replace("\\n", "\n")
-                out.append(s)
-                if i < len(fences):
-                    out.append(fences[i])
-            return "".join(out)
-        except Exception:
-            return text
-
-    def _strip_html_tags_keep_structure(text: str) -> str:
-        try:
-            t = text
-            t = _re.sub(r"<br\s*/?>", "\n", t, flags=_re.IGNORECASE)
-            t = _re.sub(r"</p>\s*", "\n\n", t, flags=_re.IGNORECASE)
-            t = _re.sub(r"<p[^>]*>", "", t, flags=_re.IGNORECASE)
-            for i in range(6, 0, -1):
-                t = _re.sub(rf"<h{i}[^>]*>(.*?)</h{i}>", lambda m: "#"*i + " " + m.group(1) + "\n\n", t, flags=_re.IGNORECASE|_re.DOTALL)
-            t = _re.sub(r"<(strong|b)>(.*?)</\1>", r"**\2**", t, flags=_re.IGNORECASE|_re.DOTALL)
-            t = _re.sub(r"<(em|i)>(.*?)</\1>", r"*\2*", t, flags=_re.IGNORECASE|_re.DOTALL)
-            t = _re.sub(r"<pre><code>(.*?)</code></pre>", lambda m: "```\n" + m.group(1) + "\n```", t, flags=_re.IGNORECASE|_re.DOTALL)
-            t = _re.sub(r"<code>(.*?)</code>", r"`\1`", t, flags=_re.IGNORECASE|_re.DOTALL)
-            t = _re.sub(r"\s*</li>\s*", "\n", t, flags=_re.IGNORECASE)
-            t = _re.sub(r"<li[^>]*>", "- ", t, flags=_re.IGNORECASE)
-            t = _re.sub(r"</?(ul|ol)[^>]*>", "\n", t, flags=_re.IGNORECASE)
-            def table_to_md(m):
-                tb = m.group(1)
-                rows = _re.findall(r"<tr[^>]*>(.*?)</tr>", tb, flags=_re.IGNORECASE|_re.DOTALL)
-                md_rows = []
-                headers = []
-                for idx, row in enumerate(rows):
-                    th = _re.findall(r"<t[dh][^>]*>(.*?)</t[dh]>", row, flags=_re.IGNORECASE|_re.DOTALL)
-                    cells = [ _re.sub(r"<[^>]+>", "", c).strip() for c in th ]
-                    if idx == 0:
-                        headers = cells if cells else []
-                    md_rows.append("| " + " | ".join(cells) + " |")
-                if headers:
-                    sep = "| " + " | ".join(["---"]*len(headers)) + " |"
-                    return md_rows[0] + "\n" + sep + ("\n" + "\n".join(md_rows[1:]) if len(md_rows)>1 else "")
-                else:
-                    return "\n".join(md_rows)
-            t = _re.sub(r"<table[^>]*>(.*?)</table>", table_to_md, t, flags=_re.IGNORECASE|_re.DOTALL)
-            t = _re.sub(r"<[^>]+>", "", t)
-            return t
-        except Exception:
-            return text
-
-    def _normalize_model_output(text: str) -> str:
-        parts = LATEX_CODE_BLOCK_RE.split(text)
-        fences = LATEX_CODE_BLOCK_RE.findall(text)
-        out = []
-        for i, seg in enumerate(parts):
-            seg = _strip_html_tags_keep_structure(seg)
-            seg = _convert_tex_delimiters(seg)
-            out.append(seg)
-            if i < len(fences):
-                out.append(fences[i])
-        return "".join(out)
+
+    # Model output is normalised (HTML tags -> markdown, TeX delimiters) once per
+    # distinct message; see output_format.py.
+    def answer_with_cache(mode: str, question: str, context_ids, query_vec, gen_params: dict, **create_kwargs) -> str:
+        # Serve repeated questions against the same context from the response cache;
+        # otherwise stream a fresh answer and remember it.
+        cache = get_response_cache()
+        scope = make_scope(mode, context_ids, gen_params, history_key(st.session_state.messages)) if cache else None
+        cached = cache.get(scope, question, query_vec) if cache else None
+        telemetry.annotate(model=gen_params.get("model"), cache_hit=cached is not None)
+        if cached is not None:
+            render_bubble("assistant", cached)
+            return cached
+        with telemetry.span("llm.answer"):
+            response = stream_bubble(**gen_params, **create_kwargs)
+        if cache:
+            cache.put(scope, question, response, query_vec)
+        return response
+
+    def get_history_manager() -> HistoryManager:
+        # One manager per session; it caches formatted turns and the running summary.
+        if "history_manager" not in st.session_state:
+            st.session_state.history_manager = HistoryManager()
+        return st.session_state.history_manager
+
+    def start_turn() -> Turn:
+        # A newer message supersedes whatever the previous turn still has running.
+        previous = st.session_state.get("active_turn")
+        if previous is not None:
+            previous.cancel()
+        st.session_state.active_turn = Turn()
+        return st.session_state.active_turn
+
+    def history_stage(messages):
+        # Runs off the script thread (Turn.prepare), so no st.* calls in here.
+        manager = get_history_manager()
+        return lambda: _timed("history.context", manager.context, messages)
+
+    def _timed(name: str, fn, *args):
+        with telemetry.span(name):
+            return fn(*args)
 
     def render_bubble(role: str, content: str):
-        txt = _normalize_model_output(content or "")
+        txt = normalize_model_output(content or "")
         with st.chat_message(role):
             st.markdown(txt)
 
+    HISTORY_PAGE_SIZE = int(os.environ.get("CHAT_HISTORY_PAGE_SIZE", 20))
+
+    def _message_markdown(message: dict) -> str:
+        md = message.get("markdown")
+        if md is None:
+            md = message["markdown"] = normalize_model_output(message.get("content") or "")
+        return md
+
+    def new_messages():
+        # Chat history with a bounded in-memory tail; older turns spill to the
+        # session store's SQLite file (session_store.py).
+        return get_session_store().messages()
+
+    def add_message(role: str, content: str) -> None:
+        # Markdown is computed once when the message is stored, not on every rerun.
+        messages = st.session_state.messages
+        messages.append({"role": role, "content": content, "markdown": normalize_model_output(content or "")})
+        telemetry.annotate(session_bytes=getattr(messages, "nbytes", None), session_messages=len(messages))
+
+    def _show_earlier_messages():
+        st.session_state.history_shown = st.session_state.get("history_shown", HISTORY_PAGE_SIZE) + HISTORY_PAGE_SIZE
+
+    @st.fragment
+    def render_history():
+        # Only the newest page of turns is drawn; older ones sit behind a button.
+        # Being a fragment, "show earlier" reruns just this block, not the app.
+        messages = st.session_state.messages
+        shown = st.session_state.get("history_shown", HISTORY_PAGE_SIZE)
+        hidden = max(0, len(messages) - shown)
+        with telemetry.span("render.history"):
+            if hidden:
+                st.button(f"Show earlier messages ({hidden} hidden)", key="show_earlier_messages", on_click=_show_earlier_messages)
+            for message in messages[hidden:]:
+                with st.chat_message(message["role"]):
+                    st.markdown(_message_markdown(message))
+
+    def route_turn(question: str):
+        # Picks model and max_tokens from the turn class (model_router.py). The
+        # primary choice goes into gen_params, which also scopes the response
+        # cache; the plan keeps the fallbacks for stream_bubble.
+        # The last few turns are enough to see the quiz question being answered.
+        turn_class = classify_turn(question, st.session_state.messages[-7:-1])
+        plan = get_router().plan(turn_class)
+        telemetry.annotate(turn_class=turn_class)
+        return {"model": plan[0].model, "temperature": 0.7, "max_tokens": plan[0].max_tokens}, plan
+
+    def stream_bubble(plan, **create_kwargs) -> str:
+        # Show tokens as they arrive, then swap in the normalised markdown once the
+        # full answer is known. Time-to-first-token is kept for diagnostics.
+        # Every model attempt goes through the process-wide scheduler for this API
+        # key, which keeps us under Groq's requests/tokens-per-minute limits, queues
+        # students fairly and backs off on 429s. The router moves on to the plan's
+        # next model when one errors or has not started answering by its deadline.
+        stats = {}
+        sched = get_scheduler(api_key)
+        router = get_router()
+        turn = st.session_state.get("active_turn") or Turn()
+        prompt = " ".join(str(m.get("content", "")) for m in create_kwargs.get("messages", []))
+        prompt_tokens = count_tokens(prompt)
+        user_key = _email or st.session_state.get("access_log_id") or "anonymous"
+        with st.chat_message("assistant"):
+            queue_note = st.empty()
+            placeholder = st.empty()
+
+            def _on_wait(pos: int):
+                queue_note.info(f"The tutor is busy right now - you're #{pos} in the queue...")
+
+            def _start(route):
+                kwargs = {**create_kwargs, "model": route.model, "max_tokens": route.max_tokens}
+                return sched.stream(
+                    user_key, prompt_tokens + route.max_tokens,
+                    lambda: turn.stream(lambda: astream_completion(client, stats=stats, **kwargs), first_timeout=route.deadline),
+                    on_wait=_on_wait, stats=stats,
+                )
+
+            try:
+                with placeholder.container():
+                    st.write_stream(router.stream(plan, _start, stats=stats))
+                queue_note.empty()
+            except QueueTimeout:
+                queue_note.warning("The tutor is very busy at the moment. Please try your question again in a minute.")
+                raise
+            except TurnTimeout:
+                queue_note.warning("The tutor took too long to answer. Please try your question again.")
+                raise
+            except EmptyCompletion:
+                queue_note.warning("The tutor could not put together an answer. Please try your question again.")
+                raise
+            except Exception as e:
+                if is_rate_limit(e):
+                    queue_note.warning("The tutor has hit its usage limit for now. Please try again in a minute.")
+                raise
+            response = stats.get("text", "")
+            with telemetry.span("render.markdown"):
+                placeholder.markdown(normalize_model_output(response))
+        for name in ("queue_s", "ttft_s", "total_s"):
+            if stats.get(name) is not None:
+                telemetry.observe(f"llm.{name[:-2]}", stats[name])
+        telemetry.record_usage(stats.get("usage"))
+        telemetry.annotate(model=stats.get("model"), failovers=stats.get("failovers", 0))
+        st.session_state["last_ttft_s"] = stats.get("ttft_s")
+        logging.debug("Groq time-to-first-token: %s", stats.get("ttft_s"))
+        return response
+
 
 
     st.markdown(
@@ -431,265 +434,167 @@ else:
 
     # ============================== Material Engagement =========================
     if genre == "***Material Engagement***":
-        template = """
-            Act as the **A_STEP GenAI Assistant Tutor** for the *Academic Student Excellence and Tutorial Programme (A_STEP)* 
-            at the **University of the Free State (UFS)** in South Africa.  
-            You specialise in helping first-year students understand and engage with **academic learning materials** — 
-            such as PDFs, notes, study guides, and readings — to deepen their comprehension and learning skills.
-
-            You are **supportive, professional, and friendly**, like a real tutor with strong subject knowledge, empathy, and a teaching mindset.  
-            Your role is to *guide*, *explain*, and *coach* — **not** to directly solve or provide answers to assignments, tests, or take-home problems.
-
-            ---
-
-            ### 💡 Core Teaching Philosophy
-
-            1. **Purpose**
-               - Help students explore, interpret, and understand the material they upload.
-               - Never provide direct answers to questions that resemble assignments, essays, or test prompts.
-               - Instead, guide the student to reach understanding on their own through conceptual hints, examples, and Socratic questioning.
-               - Encourage reflection, analysis, and application of ideas from the uploaded material.
-
-            2. **Interaction Style**
-               - Greet warmly, introduce yourself briefly at the start of a new session (once only).
-               - Communicate in **clear, plain English** appropriate for first-year university students.
-               - Avoid academic jargon unless explaining its meaning.
-               - Guide learning in **small, progressive steps** and check for understanding after key points.
-               - Encourage active participation — e.g., “What do you think this section is trying to say?” or “Can you identify the main idea in this paragraph?”
-
-            3. **Ethical Tutoring Approach**
-               - Never give full solutions to assignment questions, tests, or problem sets.
-               - Instead:
-                   - Rephrase the question to help the student think critically.
-                   - Offer examples or frameworks they can apply on their own.
-                   - Explain related theories or principles in general terms.
-                   - Encourage them to attempt a response and provide constructive feedback.
-               - If a user insists on an answer, politely remind them that your role is to *guide learning*, not to provide completed academic work.
-
-            4. **Working with Uploaded Materials (PDFs)**
-               - Use `{pdf_content}` as reference material for context.
-               - Avoid engaging with topics or context outside the pdf_content material. Steer the student back to the uploaded context.
-               - Summarize or explain concepts found in the uploaded content.
-               - Help the student identify key themes, definitions, or examples.
-               - Provide structure (e.g., outlines, key takeaways, or concept maps) that aids understanding.
-               - When relevant, connect the material to broader academic principles or South African educational contexts.
-
-            5. **Output Structure**
-               - **Explanations:** Use concise bullet points or short paragraphs.
-               - **Concept Mapping:** Break complex topics into main ideas and subtopics.
-               - **IRAC or Framework Analysis:** For law, business, or applied topics, use *Issue – Rule – Application – Conclusion*.
-               - **Study Skills Support:** Offer guidance like “How to summarize this section” or “Tips for remembering these definitions.”
-               - Avoid LaTeX formatting. Use markdown (e.g., bold, bullet lists, emojis).
-
-            6. **Engagement & Quizzes**
-               - When appropriate, generate a short 5-question quiz (multiple-choice or short-answer) **about the uploaded material**.
-               - The goal is reinforcement — not assessment.
-               - If the student answers incorrectly, provide gentle feedback and an example before asking them to retry.
-               - Praise progress to keep motivation high.
-
-            7. **Tone & Personality**
-               - Friendly, encouraging, and empathetic.
-               - Use emojis sparingly but effectively (e.g., 🌱📘✨).
-               - Foster curiosity, not dependency.
-
-            8. **Response Structure**
-               - Begin with a brief acknowledgment of the topic or question.
-               - Reference relevant concepts from the uploaded PDF.
-               - Offer guidance and explanation.
-               - End with a *Next Steps* suggestion (e.g., “Try summarizing this paragraph in your own words — I can help you check it 👇”).
-
-            ---
-
-            **PDF Content:**
-            {pdf_content}
-
-            **Conversation History:**
-            {context}
-
-            **Student’s Question:**
-            {question}
-
-            **Answer:**
-            """
-
         def extract_text_from_pdf(pdf_file):
-            pdf_reader = pymupdf.open(stream=pdf_file.getvalue(), filetype="pdf")
-            text = ""
-            for page in pdf_reader:
-                text += page.get_text("text") + "\n"
-            return text
+            # Cached by content hash across reruns and sessions; returns (hash, one string per page).
+            return get_pdf_pages(pdf_file.getvalue())
 
         st.sidebar.markdown("<h1 style='text-align: center;'>Upload PDFs</h1>", unsafe_allow_html=True)
         uploaded_file = st.sidebar.file_uploader(" ", type=["pdf"])
 
         if new_chat:
-            st.session_state.messages = []
-            st.session_state.pdf_content = ""
+            st.session_state.messages = new_messages()
+            st.session_state.pdf_key = None
+            st.session_state.pdf_chars = 0
+            st.session_state.pdf_file_id = None
+            st.session_state.history_shown = HISTORY_PAGE_SIZE
             st.success("New chat started! Upload a new PDF if needed.")
 
         if "messages" not in st.session_state:
-            st.session_state.messages = []
-        if "pdf_content" not in st.session_state:
-            st.session_state.pdf_content = ""
+            st.session_state.messages = new_messages()
+        # Only the content hash stays in the session; the page text lives in the
+        # shared page cache and the session store (pdf_tools.load_pdf_pages).
+        if "pdf_key" not in st.session_state:
+            st.session_state.pdf_key = None
+            st.session_state.pdf_chars = 0
 
         if uploaded_file is not None:
-            st.session_state.pdf_content = extract_text_from_pdf(uploaded_file)
+            # Only re-extract when a different file lands in the uploader.
+            file_id = getattr(uploaded_file, "file_id", None) or (uploaded_file.name, uploaded_file.size)
+            if st.session_state.get("pdf_file_id") != file_id:
+                with telemetry.span("pdf.extract"):
+                    pdf_key, pdf_pages = extract_text_from_pdf(uploaded_file)
+                st.session_state.pdf_key = pdf_key
+                st.session_state.pdf_chars = sum(len(p) for p in pdf_pages)
+                st.session_state.pdf_file_id = file_id
             st.sidebar.success("PDF uploaded successfully!")
 
-        for message in st.session_state.messages:
-            render_bubble(message["role"], message["content"])
+        render_history()
 
         user_input = st.chat_input("Ask something...")
         if user_input:
-            st.session_state.messages.append({"role": "user", "content": user_input})
-            render_bubble("user", user_input)
-
-            context_messages = st.session_state.messages[-5:]
-            context = "\n".join([f"{m['role'].capitalize()}: {m['content']}" for m in context_messages])
+            with telemetry.turn("material"):
+                add_message("user", user_input)
+                render_bubble("user", user_input)
 
-            if not st.session_state.pdf_content:
-                response = (
-                    "Hi there 👋. Welcome to the ***Material Engagement*** Tutorial Session. I'm your A_STEP Assistant tutor ✨. "
-                    "I see that no PDF document has been uploaded yet 🤷. "
-                    "Use the upload button to choose a PDF 📖, then we can proceed with your questions about it — or switch to the ***Tutor Session Mode*** to chat with a GenAI Tutor 🧑‍🏫."
-                )
-            else:
-                MAX_PDF_CHARS = 6000
-                pdf_text = st.session_state.pdf_content
-                if len(pdf_text) > MAX_PDF_CHARS:
-                    pdf_text = pdf_text[:MAX_PDF_CHARS] + "\n[TRUNCATED]"
-                prompt_text = template.format(pdf_content=pdf_text, context=context, question=user_input)
-                safe_headers = {
-                    "User-Agent": "groq-python",
-                    "X-Stainless-OS": "Windows",
-                    "X-Stainless-Arch": "x64",
-                    "X-Stainless-Runtime": "CPython",
-                    "X-Stainless-Runtime-Version": "3",
-                }
-                try:
-                    groq_response = client.chat.completions.create(
-                        model="openai/gpt-oss-20b",
-                        messages=[{"role": "user", "content": prompt_text}],
-                        temperature=0.7,
-                        max_tokens=2000,
-                        extra_headers=safe_headers,
+                if not st.session_state.pdf_chars:
+                    response = (
+                        "Hi there 👋. Welcome to the ***Material Engagement*** Tutorial Session. I'm your A_STEP Assistant tutor ✨. "
+                        "I see that no PDF document has been uploaded yet 🤷. "
+                        "Use the upload button to choose a PDF 📖, then we can proceed with your questions about it — or switch to the ***Tutor Session Mode*** to chat with a GenAI Tutor 🧑‍🏫."
                     )
-                    raw_text = groq_response.choices[0].message.content
-                    response = re.sub(r"<think>.*?</think>", "", raw_text, flags=re.DOTALL).strip()
-                except Exception:
-                    st.stop()
+                else:
+                    # PDF chunk lookup and history compaction run side by side on the
+                    # turn pipeline. Only the chunks most relevant to this question go
+                    # into the prompt.
+                    pdf_key = st.session_state.pdf_key
+
+                    def _pdf_stage():
+                        with telemetry.span("pdf.retrieve"):
+                            pdf_index = get_pdf_chunk_index(pdf_key)
+                            if not len(pdf_index) and uploaded_file is not None:
+                                # Pages evicted from the cache and the session store: re-extract the upload.
+                                pdf_index = get_pdf_chunk_index(pdf_key, pages=extract_text_from_pdf(uploaded_file)[1])
+                            text, chunk_ids = pdf_index.context_for(user_input, token_budget=PDF_CONTEXT_TOKENS)
+                        query_vec = pdf_index.vectorizer.transform([user_input]) if pdf_index.vectorizer is not None else None
+                        return text, chunk_ids, query_vec
+
+                    prep = start_turn().prepare({"pdf": _pdf_stage, "history": history_stage(st.session_state.messages)})
+                    pdf_text, pdf_chunk_ids, pdf_query_vec = prep["pdf"] or ("", [], None)
+                    context = prep["history"] or ""
+                    with telemetry.span("prompt.format"):
+                        prompt_messages = MATERIAL_PROMPT.messages(pdf_content=pdf_text, context=context, question=user_input)
+                    safe_headers = {
+                        "User-Agent": "groq-python",
+                        "X-Stainless-OS": "Windows",
+                        "X-Stainless-Arch": "x64",
+                        "X-Stainless-Runtime": "CPython",
+                        "X-Stainless-Runtime-Version": "3",
+                    }
+                    gen_params, plan = route_turn(user_input)
+                    try:
+                        response = answer_with_cache(
+                            "material",
+                            user_input,
+                            [st.session_state.pdf_key] + list(pdf_chunk_ids),
+                            pdf_query_vec,
+                            gen_params,
+                            plan=plan,
+                            messages=prompt_messages,
+                            extra_headers=safe_headers,
+                        )
+                    except Exception:
+                        st.stop()
 
-                st.session_state.messages.append({"role": "assistant", "content": response})
-                render_bubble("assistant", response)
+                    add_message("assistant", response)
 
     # ============================== Tutor Session Mode ==========================
     else:
-        template = """
-            You are the **A_STEP GenAI Assistant Tutor**, part of the *Academic Student Excellence and Tutorial Programme (A_STEP)* at the University of the Free State (UFS), South Africa.
-            You specialise in supporting **first-year university students** across all faculties. 
-            You are friendly, empathetic, and professional — like a real tutor who understands the challenges of transitioning to university life.
-
-            Your purpose is to help students understand and engage with academic material through guided discussion, critical questioning, and interactive learning activities.
-
-            **Important:** Use the relevant course/module information provided (from the embedded course data) to support your answers whenever possible.
-
-
-            Follow the structure below when responding:
-
-            1. **Context & Scope**  
-               - Focus on the South African university context (UFS).  
-               - Cover topics across faculties: Law, Theology and Religion, Health Sciences, Economic and Management Sciences (EMS), Natural and Agricultural Sciences (NAS), Humanities, and Education.  
-               - Focus on first-year academic concepts and skills.  
-               - Always assume the student may be a beginner in the topic.
-
-            2. **Interaction Style**  
-               - Begin by warmly greeting the student (use emojis naturally).  
-               - Ask them which faculty.
-               - Ask them which module/subject.
-               - Ask which topic of interest in the module/subject they want to explore.  
-               - If the topic is broad, ask follow-up questions to narrow it down.  
-               - Use plain, supportive, and motivating language.  
-               - Avoid overloading information — break explanations into small, clear chunks and ask if they want to continue.  
-               - Encourage reflection and critical thinking by asking short, open-ended questions.
-
-            3. **Quizzes & Engagement**  
-               - For practice, generate **5 quiz questions** on the selected topic (multiple-choice or short-answer).  
-               - Before generating a quiz, ask the student to select their **difficulty level** (Easy, Medium, or Hard).  
-               - When running a quiz:
-                   - Ask one question at a time.  
-                   - If the answer is wrong, offer a hint, followed by a short recap or an example, but never a direct answer, then let the student retry.  
-                   - If correct, praise them briefly and move to the next question.
-                   - If a student completes five quiz questions, congratulate them. Provide them a score on the quiz, highlight areas to improve.
-               - Encourage them to reflect or ask for more practice after finishing.
-
-            4. **Output Formats**  
-               - **Explanations:** Use bullet points, numbered lists, or short paragraphs.  
-               - **Case or Concept Analysis:** Use a simple *Issue-Rule-Application-Conclusion (IRAC)* or structured reasoning format.  
-               - Avoid LaTeX or code syntax unless explicitly requested.  
-               - Add visuals or emojis to make content engaging and memorable.
-
-            5. **Response Behaviour**  
-               - Always tailor explanations to the student's question and faculty context.  
-               - Ask clarifying questions if the query is vague or incomplete.  
-               - End each message with a short *Next Steps* suggestion (e.g., “Try applying this idea to your next tutorial exercise 👇”).  
-               - Do not repeat your introduction once the conversation has begun.
-
-        **Relevant Course Data:**
-        {rag_context}
-
-        Conversation History:
-        {context}
-
-        Student’s Question:
-        {question}
-
-        Answer:
-        """
-
-        @st.cache_data(show_spinner=False)
-        def load_rag_data():
-            try:
-                rag_context = supabase.table("course_embeddings").select("*").execute()
-                df_rag = pd.DataFrame(rag_context.data)
-                if not df_rag.empty and "embedding" in df_rag.columns:
-                    df_rag["embedding"] = df_rag["embedding"].apply(lambda x: np.array(ast.literal_eval(x)))
-                return df_rag
-            except Exception:
-                return pd.DataFrame(columns=["embedding", "course_description"]) 
-
-        df_rag = load_rag_data()
+        # Until the warm-up has the index and vectorizer, turns go out without
+        # course context instead of waiting for Supabase.
+        warm = get_warmup()
+        rag_state = warm.get("rag") if warm.is_ready("vectorizer") else None
+        rag_index, rag_sync, rag_retriever = rag_state if rag_state is not None else (None, None, None)
+        if warm.is_degraded("rag"):
+            # Stale snapshot or nothing; the warm-up retries the full load.
+            st.sidebar.caption("Course data could not be refreshed; answers may miss recent course changes.")
+        elif rag_index is not None and supabase is not None:
+            # BM25 is rebuilt in the sync thread, never on a student's rerun.
+            rag_sync.sync_in_background(
+                rag_index, min_interval=float(os.environ.get("RAG_SYNC_INTERVAL", 300)), on_change=rag_retriever.refresh
+            )
+        elif rag_index is None:
+            st.sidebar.caption("Course data is still loading; answers use general knowledge until it is ready.")
+
+        # Faculty filter, offered only when the catalog carries a faculty column (RAG_META_COLUMNS).
+        faculties = sorted(rag_retriever.bm25().fields.get("faculty", {})) if rag_index is not None and len(rag_index) else []
+        faculty = st.sidebar.selectbox("Faculty", ["All faculties"] + faculties) if faculties else None
 
         def handle_conversation():
             if new_chat:
-                st.session_state.messages = []
+                st.session_state.messages = new_messages()
+                st.session_state.history_shown = HISTORY_PAGE_SIZE
                 st.success("New chat started!")
 
             if "messages" not in st.session_state:
-                st.session_state.messages = []
+                st.session_state.messages = new_messages()
 
-            for message in st.session_state.messages:
-                render_bubble(message["role"], message["content"])
+            render_history()
 
             user_input = st.chat_input("Ask something...")
             if user_input:
-                st.session_state.messages.append({"role": "user", "content": user_input})
-                render_bubble("user", user_input)
-
-                if df_rag is not None and not df_rag.empty:
-                    vectorizer = joblib.load('tfidf_vectorizer.joblib')
-                    query_vec = vectorizer.transform([user_input]).toarray()[0]
-                    stored_embeddings = np.stack(df_rag['embedding'].values)
-                    similarities = cosine_similarity([query_vec], stored_embeddings)[0]
-                    top_idx = similarities.argsort()[::-1][:5]
-                    top_courses = df_rag.iloc[top_idx]
-                    rag_text = "\n".join(top_courses['course_description'].tolist())
-                else:
-                    rag_text = ""
-
-                context = "\n".join([f"{m['role'].capitalize()}: {m['content']}" for m in st.session_state.messages])
-                prompt_text = template.format(context=context, question=user_input, rag_context=rag_text)
+                with telemetry.turn("tutor"):
+                    add_message("user", user_input)
+                    render_bubble("user", user_input)
+
+                    rag_filters = {}
+                    if faculty and faculty != "All faculties":
+                        rag_filters["faculty"] = faculty
+                    if module_codes(user_input):
+                        rag_filters["module"] = module_codes(user_input)
+
+                    def _rag_stage():
+                        # The vectorizer checked against the index at warm-up, not
+                        # whatever is on disk now (build_rag.py may have replaced it).
+                        vectorizer = rag_retriever.vectorizer
+                        with telemetry.span("vectorizer.transform"):
+                            query_vec = vectorizer.transform([user_input]) if vectorizer is not None else None
+                        with telemetry.span("retrieval.search"):
+                            top_rows = rag_retriever.top_rows(user_input, query_vec, k=5, filters=rag_filters)
+                        return query_vec, top_rows
+
+                    # Course retrieval and history compaction run side by side on the turn pipeline.
+                    stages = {"history": history_stage(st.session_state.messages)}
+                    if rag_index is not None and len(rag_index):
+                        stages["rag"] = _rag_stage
+                    prep = start_turn().prepare(stages)
+                    query_vec, top_rows = prep.get("rag") or (None, [])
+                    rag_ids = [rid for rid, _ in top_rows]
+                    rag_text = "\n".join(desc for _, desc in top_rows)
+                    context = prep["history"] or ""
+
+                    with telemetry.span("prompt.format"):
+                        prompt_messages = TUTOR_PROMPT.messages(rag_context=rag_text, context=context, question=user_input)
 
-                with st.spinner("Thinking... 💭"):
                     safe_headers = {
                         "User-Agent": "groq-python",
                         "X-Stainless-OS": "Windows",
@@ -697,21 +602,22 @@ else:
                         "X-Stainless-Runtime": "CPython",
                         "X-Stainless-Runtime-Version": "3",
                     }
+                    gen_params, plan = route_turn(user_input)
                     try:
-                        groq_response = client.chat.completions.create(
-                            model="openai/gpt-oss-20b",
-                            messages=[{"role": "user", "content": prompt_text}],
-                            temperature=0.7,
-                            max_tokens=2000,
+                        response = answer_with_cache(
+                            "tutor",
+                            user_input,
+                            rag_ids,
+                            query_vec,
+                            gen_params,
+                            plan=plan,
+                            messages=prompt_messages,
                             extra_headers=safe_headers,
                         )
                     except Exception:
                         return
-                    raw_text = groq_response.choices[0].message.content
-                    response = re.sub(r"<think>.*?</think>", "", raw_text, flags=re.DOTALL).strip()
-                    render_bubble("assistant", response)
 
-                st.session_state.messages.append({"role": "assistant", "content": response})
+                    add_message("assistant", response)
 
         if __name__ == "__main__":
             handle_conversation()
@@ -0,0 +1,194 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+
+import clients
+import rag_store
+from rag_bm25 import HybridRetriever
+from rag_index import EmbeddingIndex
+from rag_sync import CourseEmbeddingSync
+from turn_pipeline import get_loop
+
+
+# With WARMUP_BACKGROUND=0 the tasks run inline on the first script run instead
+# (the behaviour before warm-up existed: the first student waits for them).
+WARMUP_BACKGROUND = os.environ.get("WARMUP_BACKGROUND", "1").strip().lower() not in ("0", "false", "off")
+# A failed task is started again by the next start() call after this many seconds.
+WARMUP_RETRY_INTERVAL = float(os.environ.get("WARMUP_RETRY_INTERVAL", 60))
+
+
+class Degraded(Exception):
+    # Raised by a task that has a fallback result (e.g. a stale snapshot) but did
+    # not really succeed: the result is served, the task is not reported ready
+    # and it is retried like a failure.
+    def __init__(self, result, reason):
+        super().__init__(str(reason))
+        self.result = result
+
+
+# ---------- Process-wide cache warm-up ---------------------------------------------
+# Each named task runs once per process in its own daemon thread; callers never
+# wait on it. Scripts ask for a result with get(), which is None until the task
+# has finished, and `ready` turns True once every task has finished, failed or
+# degraded.
+class Warmup:
+    def __init__(self, retry_interval: float = WARMUP_RETRY_INTERVAL):
+        self.retry_interval = retry_interval
+        self._lock = threading.Lock()
+        self._results = {}
+        self._status = {}  # name -> "pending" | "ok" | "degraded" | "failed"
+        self._timings = {}
+        self._failed_at = {}
+
+    def start(self, tasks, background: bool = True) -> int:
+        # tasks: {name: callable}. Starts the tasks that have not run yet (or that
+        # failed or degraded more than retry_interval ago); returns how many were started.
+        now = time.time()
+        todo = []
+        with self._lock:
+            for name, fn in tasks.items():
+                status = self._status.get(name)
+                if status in ("pending", "ok"):
+                    continue
+                if status in ("failed", "degraded") and now - self._failed_at.get(name, 0.0) < self.retry_interval:
+                    continue
+                self._status[name] = "pending"
+                todo.append((name, fn))
+        for name, fn in todo:
+            if not background:
+                self._run(name, fn)
+                continue
+            threading.Thread(target=self._run, args=(name, fn), name=f"warmup-{name}", daemon=True).start()
+        return len(todo)
+
+    def _run(self, name: str, fn) -> None:
+        t0 = time.perf_counter()
+        try:
+            result = fn()
+        except Degraded as e:
+            logging.warning("Warm-up task %s degraded: %s", name, e)
+            with self._lock:
+                self._results[name] = e.result
+                self._status[name] = "degraded"
+                self._failed_at[name] = time.time()
+                self._timings[name] = time.perf_counter() - t0
+            return
+        except Exception as e:
+            logging.warning("Warm-up task %s failed: %s", name, e)
+            with self._lock:
+                self._status[name] = "failed"
+                self._failed_at[name] = time.time()
+                self._timings[name] = time.perf_counter() - t0
+            return
+        with self._lock:
+            self._results[name] = result
+            self._status[name] = "ok"
+            self._timings[name] = time.perf_counter() - t0
+        logging.info("Warm-up task %s finished in %.2fs", name, self._timings[name])
+
+    def is_ready(self, name: str) -> bool:
+        with self._lock:
+            return self._status.get(name) == "ok"
+
+    @property
+    def ready(self) -> bool:
+        with self._lock:
+            return bool(self._status) and "pending" not in self._status.values()
+
+    def is_degraded(self, name: str) -> bool:
+        with self._lock:
+            return self._status.get(name) == "degraded"
+
+    def get(self, name: str, default=None):
+        with self._lock:
+            return self._results.get(name, default)
+
+    def wait(self, timeout: float = None) -> bool:
+        # For scripts and benchmarks; the app itself never blocks on warm-up.
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.ready:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def status(self) -> dict:
+        with self._lock:
+            return {name: (status, self._timings.get(name)) for name, status in self._status.items()}
+
+
+_warmup = Warmup()
+
+
+def get_warmup() -> Warmup:
+    return _warmup
+
+
+# ---------- Tasks ------------------------------------------------------------------
+def load_rag(supabase, vectorizer=None):
+    # One sync object per process: the index is loaded from the on-disk snapshot
+    # (or paged in from Supabase on first run) and later refreshed incrementally.
+    # The hybrid retriever keeps a BM25 inverted index over the same rows and the
+    # vectorizer that passed the check, which turns use for their queries. A
+    # corpus that does not match the vectorizer - fresh or stale - is refused
+    # (SnapshotMismatch), so turns go out without course context rather than
+    # with wrong context. When loading fails otherwise, the stale snapshot (or an
+    # empty index) is handed out as a Degraded result and the load is retried by
+    # the warm-up.
+    syncer = CourseEmbeddingSync(
+        supabase,
+        page_size=int(os.environ.get("RAG_SYNC_PAGE_SIZE", 500)),
+        snapshot_dir=rag_store.SNAPSHOT_DIR,
+        meta_cols=[c.strip() for c in os.environ.get("RAG_META_COLUMNS", "").split(",")],
+    )
+    try:
+        index = syncer.load_index(vectorizer=vectorizer)
+    except rag_store.SnapshotMismatch:
+        raise
+    except Exception as e:
+        logging.exception("load_rag failed: %s", e)
+        stale = rag_store.load_snapshot(rag_store.SNAPSHOT_DIR, mmap_mode="r")
+        if stale is not None and vectorizer is not None:
+            # The fallback is held to the same check as a normal load.
+            matrix, meta = stale
+            rag_store.check_vectorizer(vectorizer, matrix.shape[1], meta.get("vectorizer_version"))
+        index = EmbeddingIndex.from_snapshot(*stale) if stale is not None else EmbeddingIndex.from_frame(None)
+        retriever = HybridRetriever(index, vectorizer=vectorizer)
+        retriever.refresh()
+        raise Degraded((index, syncer, retriever), f"serving {'a stale snapshot' if stale else 'no course data'}: {e}")
+    retriever = HybridRetriever(index, vectorizer=vectorizer)
+    retriever.refresh()
+    return index, syncer, retriever
+
+
+def _open_groq(api_key: str):
+    # Creating the client is cheap; listing models makes its pool (on the turn
+    # pipeline loop) do the TLS handshake now, so the first student's completion
+    # reuses that connection.
+    client = clients.get_async_groq_client(api_key)
+    asyncio.run_coroutine_threadsafe(client.models.list(), get_loop()).result(timeout=clients.GROQ_TIMEOUT)
+    return client
+
+
+def default_tasks(secrets) -> dict:
+    # `secrets` is st.secrets (or any mapping with the same layout).
+    url, key = clients.vectors_supabase_keys(secrets)
+    mmap_mode = os.environ.get("TFIDF_MMAP_MODE") or None
+
+    def _vectorizer():
+        return rag_store.load_vectorizer(rag_store.vectorizer_path(), mmap_mode=mmap_mode)
+
+    tasks = {
+        "vectorizer": _vectorizer,
+        "rag": lambda: load_rag(clients.get_supabase_client(url, key) if url and key else None, _vectorizer()),
+    }
+    api_key = clients.groq_app_key(secrets)
+    if api_key.startswith("gsk_"):
+        tasks["groq"] = lambda: _open_groq(api_key)
+    return tasks
+
+
+def start_default(secrets, background: bool = WARMUP_BACKGROUND) -> int:
+    return _warmup.start(default_tasks(secrets), background=background)